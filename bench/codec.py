@@ -0,0 +1,103 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Decode cost of stored values, JSON (before) against the msgpack codec.
+
+Values are shaped like core.filters chat maps, and like the [user_id, expiry]
+pairs of timed mutes as a number-heavy comparison. Rows are read back from
+an in-memory SQLite database without the value cache, as the filter check
+did on every message before it had a compiled index.
+"""
+
+import json
+import timeit
+
+import common
+
+from utils.db import SqliteDatabase, decode_value, encode_value
+
+SIZES = (10, 100, 1000)
+NUMBER = 2000
+
+
+def filter_map(size: int) -> dict:
+    return {
+        f"trigger number {i}": {
+            "MEDIA_GROUP": False,
+            "MESSAGE_ID": str(100_000 + i),
+            "CHAT_ID": "-1001234567890",
+            "MATCH": "exact",
+        }
+        for i in range(size)
+    }
+
+
+def mute_pairs(size: int) -> list:
+    return [[100_000_000 + i, 1_700_000_000.5 + i] for i in range(size)]
+
+
+def us(func, number: int) -> str:
+    seconds = min(timeit.repeat(func, number=number, repeat=3))
+    return f"{seconds / number * 1e6:.1f}"
+
+
+def main():
+    database = SqliteDatabase(":memory:")
+    values = [(filter_map, size) for size in SIZES] + [(mute_pairs, 1000)]
+    rows = []
+    for shape, size in values:
+        value = shape(size)
+        name = f"{shape.__name__}({size})"
+        number = max(20, NUMBER // size)
+
+        as_json = json.dumps(value)
+        packed, typ = encode_value(value)
+        assert decode_value(packed, typ) == value
+
+        database.set("core.filters", name, value)
+        # the same value as a row written before the codec existed
+        database._execute("core.filters", "set", (f"{name} json", as_json, "json"))
+
+        rows.append(
+            [
+                name,
+                f"{len(as_json):,}",
+                f"{len(packed):,}",
+                us(lambda: json.loads(as_json), number),
+                us(lambda: decode_value(packed, typ), number),
+                us(lambda: database._get("core.filters", f"{name} json"), number),
+                us(lambda: database._get("core.filters", name), number),
+            ]
+        )
+    database.close()
+    common.report(
+        "decode, microseconds per value",
+        rows,
+        [
+            "value",
+            "json bytes",
+            "msgpack bytes",
+            "json.loads",
+            "msgpack",
+            "row read, json",
+            "row read, msgpack",
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
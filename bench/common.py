@@ -0,0 +1,73 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Shared setup of the benchmarks, import it before anything from utils.
+
+Run a benchmark from the repository root, e.g. `python bench/db_backends.py`.
+The bot database is never touched: utils.db opens a scratch SQLite file.
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix="moon-bench-")
+os.environ["DATABASE_TYPE"] = "sqlite"
+os.environ["DATABASE_NAME"] = os.path.join(SCRATCH, "db.sqlite3")
+for key, value in {
+    "API_ID": "1",
+    "API_HASH": "bench",
+    "STRINGSESSION": "",
+    "APIFLASH_KEY": "",
+}.items():
+    os.environ.setdefault(key, value)
+
+
+def scratch(name: str) -> str:
+    """Path of a file in the benchmark's scratch directory"""
+    return os.path.join(SCRATCH, name)
+
+
+def rate(func, number: int) -> float:
+    """Calls of func per second"""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return number / (time.perf_counter() - start)
+
+
+def per_call_us(func, number: int) -> float:
+    """Microseconds per call of func"""
+    return 1e6 / rate(func, number)
+
+
+def report(title: str, rows: list, columns: list):
+    """Print rows of values under column names as an aligned table"""
+    print(title)
+    widths = [
+        max(len(str(column)), *(len(str(row[i])) for row in rows))
+        for i, column in enumerate(columns)
+    ]
+    print("  ".join(str(c).ljust(w) for c, w in zip(columns, widths)).rstrip())
+    for row in rows:
+        print("  ".join(str(v).ljust(w) for v, w in zip(row, widths)).rstrip())
+    print()
@@ -0,0 +1,69 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""get/set/get_collection throughput of the SQLite, LMDB and dbm backends"""
+
+import itertools
+
+import common  # noqa: F401
+
+from utils import db as dbmod
+from utils.db import KeyValueDatabase, SqliteDatabase
+
+KEYS = 1000
+VALUE = {"type": "text", "text": "hello", "entities": [1, 2, 3]}
+
+
+def backends():
+    yield "sqlite", SqliteDatabase(common.scratch("bench.sqlite3"))
+    if dbmod.lmdb is not None:
+        yield "lmdb", KeyValueDatabase(common.scratch("bench.lmdb"), "lmdb")
+    yield "dbm", KeyValueDatabase(common.scratch("bench.dbm"), "dbm")
+
+
+def main():
+    rows = []
+    for name, database in backends():
+        counter = itertools.count()
+        sets = common.rate(
+            lambda: database.set("core.bench", f"key{next(counter) % KEYS}", VALUE),
+            5000,
+        )
+        database.flush()
+        database._cache.clear()
+        counter = itertools.count()
+        # uncached gets: the cache is cleared before every read
+        gets = common.rate(
+            lambda: (
+                database._cache.clear(),
+                database.get("core.bench", f"key{next(counter) % KEYS}"),
+            ),
+            5000,
+        )
+        collections = common.rate(lambda: database.get_collection("core.bench"), 50)
+        rows.append(
+            (name, f"{sets:,.0f}", f"{gets:,.0f}", f"{collections * KEYS:,.0f}")
+        )
+        database.close()
+    common.report(
+        f"Operations per second, {KEYS} keys of a small dict",
+        rows,
+        ["backend", "set/s", "get/s", "collection rows/s"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Cost per group message of deciding which modules handle it, before and
+after the per-chat feature bitsets.
+
+Both pipelines have the catch-all consumers of admintool, wchat and the two
+auto-translators, with no-op callbacks. Before, the wchat check scanned the
+enabled/disabled topic lists and the translators read their chat setting
+from the database for every message. After, every check is a bitset lookup.
+The filters are coroutines, so only the checks themselves are measured.
+"""
+
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+
+import common
+
+from pyrogram import filters
+
+import utils.pipeline
+from utils.db import db
+from utils.features import FeatureRegistry, chat_flag
+from utils.pipeline import MessagePipeline
+
+CHATS = 1000
+MESSAGES = 50_000
+ATS = "core.bench_ats"
+WCHAT = "custom.bench_wchat"
+TRANSLATE = "custom.bench_translate"
+
+
+def populate(chats: list):
+    random.seed(0)
+    for chat_id in random.sample(chats, 100):
+        db.set(ATS, f"antiraid{chat_id}", True)
+    topics = [f"{chat_id}:None" for chat_id in random.sample(chats, 50)]
+    topics += [f"{random.choice(chats)}:{thread}" for thread in range(150)]
+    db.set(WCHAT, "enabled_topics", topics)
+    db.set(WCHAT, "disabled_topics", [f"{chat_id}:7" for chat_id in chats[:100]])
+    db.set(WCHAT, "wchat_for_all_groups", {str(chats[0]): True})
+    for chat_id in random.sample(chats, 20):
+        db.set(TRANSLATE, str(chat_id), "en")
+
+
+def admintool_settings(chat_id):
+    return db.get(ATS, f"antiraid{chat_id}")
+
+
+async def noop(client, message, context):
+    pass
+
+
+def before() -> MessagePipeline:
+    pipeline = MessagePipeline()
+    enabled_topics = db.get(WCHAT, "enabled_topics")
+    disabled_topics = db.get(WCHAT, "disabled_topics")
+    all_groups = db.get(WCHAT, "wchat_for_all_groups")
+
+    async def wchat_filter(_, __, message):
+        group_id = str(message.chat.id)
+        topic_id = f"{group_id}:{message.message_thread_id}"
+        return not (
+            topic_id in disabled_topics
+            or (not all_groups.get(group_id, False) and topic_id not in enabled_topics)
+        )
+
+    async def translate_filter(_, __, message):
+        return db.get(TRANSLATE, str(message.chat.id)) is not None
+
+    pipeline.on_message(load=admintool_settings, watch=ATS)(noop)
+    pipeline.on_message(filters.create(wchat_filter))(noop)
+    for _ in range(2):
+        pipeline.on_message(filters.create(translate_filter))(noop)
+    return pipeline
+
+
+def after() -> tuple:
+    registry = FeatureRegistry()
+    antiraid = registry.register("antiraid", ATS, chat_flag("antiraid{chat_id}"))
+    group = registry.register(
+        "wchat_group",
+        WCHAT,
+        lambda variable, value: (
+            [int(chat_id) for chat_id, on in value.items() if on]
+            if variable == "wchat_for_all_groups"
+            else ()
+        ),
+    )
+    topics = registry.register(
+        "wchat_topics",
+        WCHAT,
+        lambda variable, value: (
+            [int(topic.split(":")[0]) for topic in value]
+            if variable == "enabled_topics"
+            else ()
+        ),
+    )
+    topic_on = registry.register(
+        "wchat_topic_on",
+        WCHAT,
+        lambda variable, value: value if variable == "enabled_topics" else (),
+    )
+    topic_off = registry.register(
+        "wchat_topic_off",
+        WCHAT,
+        lambda variable, value: value if variable == "disabled_topics" else (),
+    )
+    translate = registry.register("translate", TRANSLATE, chat_flag("{chat_id}"))
+
+    async def wchat_filter(_, __, message):
+        topic_bits = registry.get(f"{message.chat.id}:{message.message_thread_id}")
+        if topic_bits & topic_off:
+            return False
+        return bool(topic_bits & topic_on or registry.enabled(message.chat.id, group))
+
+    pipeline = MessagePipeline()
+    pipeline.on_message(load=admintool_settings, watch=ATS, feature=antiraid)(noop)
+    pipeline.on_message(filters.create(wchat_filter), feature=group | topics)(noop)
+    for _ in range(2):
+        pipeline.on_message(
+            load=lambda chat_id: db.get(TRANSLATE, str(chat_id)),
+            watch=TRANSLATE,
+            feature=translate,
+        )(noop)
+    return pipeline, registry
+
+
+async def dispatch_us(pipeline: MessagePipeline, messages: list) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        await pipeline.dispatch(None, message)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+
+async def main():
+    chats = [-1001000000000 - i for i in range(CHATS)]
+    populate(chats)
+    messages = [
+        SimpleNamespace(
+            chat=SimpleNamespace(id=random.choice(chats)),
+            message_thread_id=random.choice((None, None, None, 7)),
+            from_user=SimpleNamespace(id=1),
+            sender_chat=None,
+            text="hello",
+        )
+        for _ in range(MESSAGES)
+    ]
+
+    # without feature masks every chat goes through the route
+    runs = [("before", before(), FeatureRegistry()), ("after", *after())]
+    shared = utils.pipeline.features
+    rows = []
+    try:
+        for name, pipeline, registry in runs:
+            # dispatch checks the bits in the module-level registry
+            utils.pipeline.features = registry
+            await dispatch_us(pipeline, messages[:1000])
+            rows.append([name, f"{await dispatch_us(pipeline, messages):.2f}"])
+    finally:
+        utils.pipeline.features = shared
+    common.report(
+        f"pipeline dispatch per message, {CHATS:,} chats, 4 catch-all consumers",
+        rows,
+        ["", "us/message"],
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
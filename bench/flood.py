@@ -0,0 +1,160 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Detection latency of FloodDetector on a synthetic update stream.
+
+Normal traffic of 200 messages a second over 1,000 chats is mixed with an
+attack every few seconds in a random chat: a message flood, a repeated text
+or a join raid. The stream runs on a simulated clock, so the detector sees
+the same timestamps on every run. For each kind of attack we report the CPU
+time per update, how many attack updates and simulated seconds passed before
+the verdict, and verdicts against users that weren't attacking.
+"""
+
+import random
+import statistics
+import time
+
+import common
+
+from utils.handlers import FloodDetector, flood_limits
+
+CHATS = 1000
+USERS = 50
+SECONDS = 300
+RATE = 200
+ATTACK_EVERY = 5.0
+# (updates, seconds between them) of one attack
+ATTACKS = {
+    "none": None,
+    "flood": (20, 0.3),
+    "duplicates": (10, 6.0),
+    "raid": (30, 0.2),
+}
+
+
+def stream(attack: str) -> list:
+    """Updates as (time, kind, chat, user, message id, content, attack number)"""
+    random.seed(0)
+    updates = []
+    for i in range(SECONDS * RATE):
+        # unique contents, normal members don't repeat themselves
+        content = random.getrandbits(60) if random.random() < 0.5 else None
+        chat_id = -1001000000000 - random.randrange(CHATS)
+        user_id = random.randrange(USERS)
+        updates.append((i / RATE, "message", chat_id, user_id, i, content, None))
+    if ATTACKS[attack] is not None:
+        count, spacing = ATTACKS[attack]
+        starts = [n * ATTACK_EVERY for n in range(int(SECONDS / ATTACK_EVERY) - 1)]
+        for number, start in enumerate(starts):
+            chat_id = -1001000000000 - random.randrange(CHATS)
+            spam = random.getrandbits(60)
+            for j in range(count):
+                # attackers have ids no normal member has
+                user_id = 10**6 + number * 100 + (j if attack == "raid" else 0)
+                content = spam if attack == "duplicates" else random.getrandbits(60)
+                kind = "join" if attack == "raid" else "message"
+                message_id = 10**7 + number * 100 + j
+                updates.append(
+                    (
+                        start + j * spacing,
+                        kind,
+                        chat_id,
+                        user_id,
+                        message_id,
+                        content,
+                        number,
+                    )
+                )
+    updates.sort(key=lambda update: update[0])
+    return updates
+
+
+def run(updates: list) -> dict:
+    detector = FloodDetector()
+    limits = flood_limits()
+    costs = []
+    sent, started, detected = {}, {}, {}
+    false_positives = 0
+    for now, kind, chat_id, user_id, message_id, content, number in updates:
+        if number is not None:
+            started.setdefault(number, now)
+            sent[number] = sent.get(number, 0) + 1
+        begin = time.perf_counter()
+        if kind == "join":
+            verdict = detector.joined(chat_id, [user_id], message_id, limits, now)
+        else:
+            verdict = detector.message(
+                chat_id, user_id, message_id, content, limits, now
+            )
+        costs.append(time.perf_counter() - begin)
+        if verdict is None:
+            continue
+        if number is None or any(user < 10**6 for user in verdict.users):
+            false_positives += 1
+        elif number not in detected:
+            detected[number] = (sent[number], now - started[number])
+    costs.sort()
+    return {
+        "updates": len(updates),
+        "mean_us": statistics.fmean(costs) * 1e6,
+        "p99_us": costs[int(len(costs) * 0.99)] * 1e6,
+        "attacks": len(started),
+        "detected": detected,
+        "false_positives": false_positives,
+    }
+
+
+def main():
+    rows = []
+    for attack in ATTACKS:
+        result = run(stream(attack))
+        detected = list(result["detected"].values())
+        updates, seconds = "-", "-"
+        if detected:
+            updates = f"{statistics.median(n for n, _ in detected):g}"
+            seconds = f"{statistics.median(s for _, s in detected):.1f}"
+        rows.append(
+            [
+                attack,
+                f"{result['updates']:,}",
+                f"{result['mean_us']:.2f}",
+                f"{result['p99_us']:.2f}",
+                f"{len(detected)}/{result['attacks']}",
+                updates,
+                seconds,
+                result["false_positives"],
+            ]
+        )
+    common.report(
+        f"FloodDetector, {RATE} messages/s over {CHATS:,} chats, default limits",
+        rows,
+        [
+            "attack",
+            "updates",
+            "us/update",
+            "p99 us",
+            "caught",
+            "updates to verdict",
+            "sim s to verdict",
+            "false verdicts",
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
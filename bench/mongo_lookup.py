@@ -0,0 +1,99 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Lookup latency of MongoDatabase as collections grow.
+
+Runs against the mongod at BENCH_MONGO_URL when it is set, otherwise
+against mongomock. mongomock scans documents whatever the indexes, so
+only a real server shows what the `var` index saves.
+"""
+
+import contextlib
+import os
+import random
+
+import common
+
+from utils.db import MongoDatabase
+
+SIZES = (100, 1000, 10_000)
+BATCH = 20
+MOCK_URL = "mongodb://localhost"
+VALUE = {"type": "text", "text": "hello", "entities": [1, 2, 3]}
+
+
+def server():
+    url = os.environ.get("BENCH_MONGO_URL")
+    if url:
+        return url, contextlib.nullcontext()
+    import mongomock
+
+    return MOCK_URL, mongomock.patch(servers=(("localhost", 27017),))
+
+
+def main():
+    random.seed(0)
+    url, patch = server()
+    with patch:
+        database = MongoDatabase(url, f"moon_bench_{os.getpid()}")
+    rows = []
+    try:
+        for size in SIZES:
+            module = f"custom.bench{size}"
+            docs = [{"var": f"key{i}", "val": VALUE} for i in range(size)]
+            database._collection(module).insert_many([dict(doc) for doc in docs])
+            # the layout before: same documents, no index on `var`
+            plain = database._database[f"custom.plain{size}"]
+            plain.insert_many([dict(doc) for doc in docs])
+
+            keys = [f"key{random.randrange(size)}" for _ in range(BATCH)]
+            number = max(20, 20_000 // size)
+
+            def us(func, number=number) -> str:
+                return f"{common.per_call_us(func, number):.0f}"
+
+            rows.append(
+                [
+                    f"{size:,}",
+                    us(lambda: plain.find_one({"var": keys[0]})),
+                    us(lambda: database._get(module, keys[0])),
+                    us(lambda: [database._get(module, key) for key in keys]),
+                    us(lambda: database._get_many(module, keys)),
+                    us(lambda: database._get_collection(module), max(3, number // 20)),
+                ]
+            )
+    finally:
+        database._client.drop_database(database._database.name)
+        database.close()
+
+    target = "mongomock" if url == MOCK_URL else "mongod"
+    common.report(
+        f"microseconds per lookup, uncached, {target}",
+        rows,
+        [
+            "docs",
+            "get, no index",
+            "get",
+            f"{BATCH} x get",
+            f"get_many({BATCH})",
+            "get_collection",
+        ],
+    )
+
+
+if __name__ == "__main__":
+    main()
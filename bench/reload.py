@@ -0,0 +1,153 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Time to apply a changed custom module: hot reload against a restart.
+
+The restart is timed up to the point where every core module is imported
+again, in a fresh interpreter. The Telegram reconnect that follows a real
+restart is not included, see `.startup history` on a running bot for that.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import common
+
+from utils.reload import CUSTOM_MODULES_DIR, reload_modules, unload
+
+NAME = "_bench_reload"
+RELOADS = 50
+
+MODULE = """
+import asyncio
+
+from pyrogram import Client, filters
+
+from utils.db import db
+from utils.misc import modules_help, prefix
+from utils.pipeline import pipeline
+
+VERSION = {version}
+
+
+@Client.on_message(filters.command(["benchreload"], prefix) & filters.me)
+async def bench_command(_, message):
+    await message.edit(str(VERSION))
+
+
+@pipeline.on_message(filters.text)
+async def bench_consumer(client, message, context):
+    pass
+
+
+def on_change(*_):
+    pass
+
+
+db.subscribe(on_change, "custom.bench_reload")
+
+
+async def ticker():
+    while True:
+        await asyncio.sleep(60)
+
+
+asyncio.get_running_loop().create_task(ticker())
+
+modules_help["{name}"] = {{"benchreload": "Reload benchmark"}}
+"""
+
+RESTART = """
+import importlib, pathlib, sys, time
+start = time.perf_counter()
+import main
+for path in sorted(pathlib.Path("modules").glob("*.py")):
+    try:
+        importlib.import_module(f"modules.{path.stem}")
+    except Exception:
+        pass
+print(time.perf_counter() - start)
+"""
+
+
+def write_module(version: int):
+    with open(f"{CUSTOM_MODULES_DIR}/{NAME}.py", "w", encoding="utf-8") as f:
+        f.write(MODULE.format(version=version, name=NAME))
+
+
+def restart_seconds() -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", RESTART],
+        check=True,
+        capture_output=True,
+        env=os.environ,
+    )
+    return time.perf_counter() - start
+
+
+async def reload_seconds() -> tuple:
+    client = SimpleNamespace(dispatcher=SimpleNamespace(groups=OrderedDict()))
+    write_module(0)
+    timings, errors = await reload_modules(client, [NAME])
+    assert not errors, errors
+    try:
+        seconds = []
+        for version in range(1, RELOADS + 1):
+            write_module(version)
+            start = time.perf_counter()
+            timings, errors = await reload_modules(client, [NAME])
+            seconds.append(time.perf_counter() - start)
+            assert not errors, errors
+        await asyncio.sleep(0)
+        tasks = [
+            task for task in asyncio.all_tasks() if "ticker" in repr(task.get_coro())
+        ]
+        handlers = sum(len(group) for group in client.dispatcher.groups.values())
+
+        start = time.perf_counter()
+        await reload_modules(client, [NAME])
+        unchanged = time.perf_counter() - start
+    finally:
+        unload(client, NAME)
+        os.remove(f"{CUSTOM_MODULES_DIR}/{NAME}.py")
+    return sorted(seconds)[len(seconds) // 2], max(seconds), unchanged, tasks, handlers
+
+
+def main():
+    median, slowest, unchanged, tasks, handlers = asyncio.run(reload_seconds())
+    assert len(tasks) == 1 and handlers == 1, (tasks, handlers)
+    restarts = sorted(restart_seconds() for _ in range(3))
+    common.report(
+        f"{RELOADS} reloads of one changed custom module",
+        [
+            ["hot reload, median", f"{median * 1000:.1f} ms"],
+            ["hot reload, slowest", f"{slowest * 1000:.1f} ms"],
+            ["unchanged source, skipped", f"{unchanged * 1000:.2f} ms"],
+            ["restart until modules are imported", f"{restarts[1]:.2f} s"],
+        ],
+        ["", "time"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Writes per second of SqliteDatabase with write-behind group commits, against
+a commit after every write as the backend used to do.
+"""
+
+import itertools
+import json
+import sqlite3
+import time
+
+import common
+
+from utils.db import SqliteDatabase
+
+WRITES = 2000
+VALUE = {"role": "user", "text": "hello there", "time": 1700000000}
+
+
+class CommitEachWrite:
+    """The old set()/append_history(): default journal, commit per write"""
+
+    def __init__(self, file):
+        self._conn = sqlite3.connect(file)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS 'custom.bench' "
+            "(var TEXT UNIQUE NOT NULL, val TEXT NOT NULL, type TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS history (conversation TEXT NOT NULL, "
+            "seq INTEGER NOT NULL, val TEXT NOT NULL, PRIMARY KEY (conversation, seq))"
+        )
+        self._seq = itertools.count()
+
+    def set(self, module, variable, value):
+        self._conn.execute(
+            f"INSERT INTO '{module}' VALUES (?, ?, ?) ON CONFLICT (var) "
+            "DO UPDATE SET val=excluded.val, type=excluded.type",
+            (variable, json.dumps(value), "json"),
+        )
+        self._conn.commit()
+
+    def append_history(self, conversation, entry):
+        self._conn.execute(
+            "INSERT INTO history VALUES (?, ?, ?)",
+            (conversation, next(self._seq), json.dumps(entry)),
+        )
+        self._conn.commit()
+
+    def flush(self):
+        pass
+
+
+def measure(write, flush) -> tuple:
+    """Writes per second including the final flush, and the slowest write"""
+    slowest = 0
+    start = time.perf_counter()
+    for i in range(WRITES):
+        before = time.perf_counter()
+        write(i)
+        slowest = max(slowest, time.perf_counter() - before)
+    flush()
+    return WRITES / (time.perf_counter() - start), slowest
+
+
+def main():
+    databases = [
+        ("commit per write (before)", CommitEachWrite(common.scratch("old.db"))),
+        (
+            "WAL, commit per write",
+            SqliteDatabase(common.scratch("wal.db"), commit_batch=1),
+        ),
+        ("WAL, write-behind", SqliteDatabase(common.scratch("behind.db"))),
+    ]
+    rows = []
+    for name, database in databases:
+        sets, set_max = measure(
+            lambda i: database.set("custom.bench", f"key{i % 100}", VALUE),
+            database.flush,
+        )
+        appends, append_max = measure(
+            lambda i: database.append_history("custom.bench/chat", VALUE),
+            database.flush,
+        )
+        rows.append(
+            [
+                name,
+                f"{sets:,.0f}",
+                f"{set_max * 1000:.1f}",
+                f"{appends:,.0f}",
+                f"{append_max * 1000:.1f}",
+            ]
+        )
+    common.report(
+        f"{WRITES:,} writes in a row, file in {common.SCRATCH}",
+        rows,
+        ["mode", "set/s", "slowest set ms", "append/s", "slowest append ms"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Time to first response after a restart, with every module imported at boot
+against lazy loading of command-only modules.
+
+Each run is a fresh interpreter that builds the module manifest, imports the
+boot modules like main.py and then answers `.ping` through the dispatcher
+groups. The client is stubbed, so the Telegram connection is not included.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+import common
+
+RUNS = 3
+
+CHILD = """
+import asyncio, sys, time
+from collections import OrderedDict
+from pathlib import Path
+
+sys.path.insert(0, "bench")
+import common
+
+from pyrogram import enums, types
+from pyrogram.handlers import MessageHandler
+
+from utils.lazy import build_manifest, lazy_modules
+from utils.scripts import load_modules
+
+LAZY = sys.argv[1] == "lazy"
+LAUNCHED = float(sys.argv[2])
+
+
+class Client:
+    def __init__(self):
+        self.dispatcher = type("Dispatcher", (), {"groups": OrderedDict()})()
+        self.me = types.User(id=1, is_self=True)
+        self.answered = None
+
+    def add_handler(self, handler, group=0):
+        self.dispatcher.groups.setdefault(group, []).append(handler)
+        self.dispatcher.groups = OrderedDict(sorted(self.dispatcher.groups.items()))
+
+    def get_listener_matching_with_data(self, *args, **kwargs):
+        return None
+
+    async def edit_message_text(self, *args, **kwargs):
+        if self.answered is None:
+            self.answered = time.time()
+
+
+async def main():
+    client = Client()
+    # sync filters run on client.executor, None is the loop's default one
+    client.loop, client.executor = asyncio.get_running_loop(), None
+    manifest = build_manifest(
+        Path("modules").rglob("*.py"), common.scratch("manifest.json")
+    )
+    boot = {}
+    for path, entry in manifest.items():
+        if LAZY and entry["lazy"]:
+            lazy_modules.defer(Path(path).stem, "custom_modules" not in path, entry)
+        else:
+            boot[path] = entry
+    await load_modules(client, boot)
+    client.add_handler(lazy_modules.handler(), lazy_modules.group)
+    booted = time.time()
+
+    message = types.Message(
+        id=1,
+        chat=types.Chat(id=1, type=enums.ChatType.PRIVATE),
+        from_user=client.me,
+        outgoing=True,
+        text=".ping",
+        client=client,
+    )
+    for handlers in list(client.dispatcher.groups.values()):
+        for handler in handlers:
+            if not isinstance(handler, MessageHandler):
+                continue
+            if await handler.check(client, message):
+                await handler.callback(client, message)
+                break
+    print(booted - LAUNCHED, client.answered - LAUNCHED, len(boot), len(manifest))
+
+
+asyncio.run(main())
+"""
+
+
+def run(mode: str) -> list:
+    launched = time.time()
+    child = subprocess.run(
+        [sys.executable, "-c", CHILD, mode, str(launched)],
+        capture_output=True,
+        text=True,
+        env=os.environ,
+    )
+    if child.returncode:
+        raise RuntimeError(f"{mode} boot failed:\n{child.stderr}")
+    return [float(value) for value in child.stdout.split()]
+
+
+def main():
+    # the first boots write bytecode caches and the manifest, keep them out
+    run("lazy")
+    run("eager")
+    rows = []
+    for mode in ("eager", "lazy"):
+        runs = sorted(run(mode) for _ in range(RUNS))
+        booted, answered, imported, total = runs[len(runs) // 2]
+        rows.append(
+            [
+                mode,
+                f"{int(imported)}/{int(total)}",
+                f"{booted:.2f}",
+                f"{answered:.2f}",
+            ]
+        )
+    common.report(
+        f"restart to first .ping answer, median of {RUNS}",
+        rows,
+        ["", "modules at boot", "boot s", "first answer s"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""Lookup, expiry and memory cost of TimedMutes at 100k active mutes"""
+
+import random
+import time
+import tracemalloc
+
+import common
+
+from utils.db import db
+from utils.handlers import TimedMutes
+
+CHATS = 1000
+MUTES = 100_000
+LOOKUPS = 200_000
+
+
+def populate() -> list:
+    """Store MUTES timed mutes spread over CHATS chats, as .tmute leaves them"""
+    now = time.time()
+    muted = []
+    for chat_id in range(-CHATS, 0):
+        users = list(range(MUTES // CHATS))
+        db.set("core.ats", f"c{chat_id}", users)
+        timed = [[user_id, now + random.uniform(60, 86400)] for user_id in users]
+        db.set("core.ats", f"tmute_until{chat_id}", timed)
+        muted.extend((chat_id, user_id) for user_id in users)
+    db.flush()
+    return muted
+
+
+def main():
+    random.seed(0)
+    muted = populate()
+
+    start = time.perf_counter()
+    tracemalloc.start()
+    mutes = TimedMutes()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    loaded = time.perf_counter() - start
+    assert len(mutes) == MUTES
+
+    # the list scan the per-message check used to do
+    lists = {chat_id: mutes.users(chat_id) for chat_id in range(-CHATS, 0)}
+    probes = [random.choice(muted) for _ in range(LOOKUPS)]
+    misses = [(chat_id, user_id + MUTES) for chat_id, user_id in probes]
+
+    def lookups(check, pairs):
+        it = iter(pairs * 2)
+        return common.per_call_us(lambda: check(*next(it)), LOOKUPS)
+
+    rows = [
+        [
+            name,
+            f"{lookups(check, probes):.3f}",
+            f"{lookups(check, misses):.3f}",
+        ]
+        for name, check in [
+            ("set index", mutes.is_muted),
+            ("list scan", lambda chat_id, user_id: user_id in lists[chat_id]),
+        ]
+    ]
+    common.report(
+        f"is_muted at {MUTES:,} mutes in {CHATS:,} chats",
+        rows,
+        ["check", "hit us", "miss us"],
+    )
+
+    start = time.perf_counter()
+    lifted = mutes.expire(time.time() + 86400)
+    db.flush()
+    expired = time.perf_counter() - start
+    common.report(
+        "TimedMutes",
+        [
+            ["load from db", f"{loaded:.2f}s"],
+            ["memory", f"{size / 2**20:.1f} MiB"],
+            [f"expire all {lifted:,}", f"{expired:.2f}s"],
+        ],
+        ["step", "cost"],
+    )
+
+
+if __name__ == "__main__":
+    main()
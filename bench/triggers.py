@@ -0,0 +1,127 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+TriggerIndex against a scan of every trigger, 10k triggers in 1k chats.
+"automaton" forces the Aho-Corasick path whatever the number of triggers.
+"""
+
+import random
+import re
+import string
+import time
+import tracemalloc
+
+import common
+
+from utils.triggers import MATCH_CONTAINS, MATCH_EXACT, MATCH_WORD, TriggerIndex
+
+CHATS = 1000
+TRIGGERS = 10_000
+MESSAGES = 2000
+MODES = (MATCH_EXACT, MATCH_CONTAINS, MATCH_WORD)
+
+
+def word() -> str:
+    return "".join(random.choices(string.ascii_lowercase, k=random.randint(3, 9)))
+
+
+def text(length: int) -> str:
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(word())
+    return " ".join(words)[:length]
+
+
+def chat_triggers(count: int) -> list:
+    return [(word(), random.choice(MODES)) for _ in range(count)]
+
+
+def scan(triggers: list):
+    """Check every trigger in turn, what a per-chat loop over filters does"""
+    exact = {trigger for trigger, mode in triggers if mode == MATCH_EXACT}
+    others = [
+        (trigger, re.compile(rf"(?<!\w){re.escape(trigger)}(?!\w)"))
+        for trigger, mode in triggers
+        if mode == MATCH_WORD
+    ] + [(trigger, None) for trigger, mode in triggers if mode == MATCH_CONTAINS]
+
+    def match(message: str):
+        message = message.lower()
+        if message in exact:
+            return message
+        for trigger, word_re in others:
+            if trigger in message and (word_re is None or word_re.search(message)):
+                return trigger
+        return None
+
+    return match
+
+
+def main():
+    random.seed(0)
+    chats = [chat_triggers(TRIGGERS // CHATS) for _ in range(CHATS)]
+
+    start = time.perf_counter()
+    tracemalloc.start()
+    # the indexes are only referenced until their memory is measured
+    indexes = [TriggerIndex(triggers) for triggers in chats]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    built = time.perf_counter() - start
+    del indexes
+    common.report(
+        f"{CHATS:,} chat indexes of {TRIGGERS // CHATS} triggers",
+        [[f"{built * 1000:.0f} ms", f"{size / 2**20:.1f} MiB"]],
+        ["build all", "memory"],
+    )
+
+    rows = []
+    scan_limit = TriggerIndex.SCAN_LIMIT
+    for per_chat in (10, 100, 1000):
+        triggers = chat_triggers(per_chat)
+        index, scanner = TriggerIndex(triggers), scan(triggers)
+        TriggerIndex.SCAN_LIMIT = 0
+        automaton = TriggerIndex(triggers)
+        TriggerIndex.SCAN_LIMIT = scan_limit
+        for length in (20, 200, 2000):
+            messages = [text(length) for _ in range(MESSAGES)]
+            for message in messages:
+                assert (index.match(message) is None) == (scanner(message) is None)
+            it = iter(messages * 3)
+            indexed = common.per_call_us(lambda: index.match(next(it)), MESSAGES)
+            it = iter(messages * 3)
+            walked = common.per_call_us(lambda: automaton.match(next(it)), MESSAGES)
+            it = iter(messages * 3)
+            scanned = common.per_call_us(lambda: scanner(next(it)), MESSAGES)
+            rows.append(
+                [
+                    per_chat,
+                    length,
+                    f"{indexed:.1f}",
+                    f"{walked:.1f}",
+                    f"{scanned:.1f}",
+                ]
+            )
+    common.report(
+        "match per message",
+        rows,
+        ["triggers", "chars", "index us", "automaton us", "per-trigger scan us"],
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -27,6 +27,7 @@
 #     "pygments",
 #     "ffmpeg-python",
 #     "pymongo",
+#     "msgpack",
 #     "psutil",
 #     "Pillow>=9.0.0",
 #     "pytubefix",
@@ -42,6 +43,7 @@
 #     "lexica-api",
 # ]
 # ///
+import asyncio
 import os
 import logging
 
@@ -55,10 +57,23 @@ from pyrogram.enums.parse_mode import ParseMode
 from pyrogram.raw.functions.account import GetAuthorizations, DeleteAccount
 import requests
 
-from utils import config
-from utils.db import db
-from utils.misc import gitrepo, userbot_version
-from utils.scripts import restart, load_module
+from utils.startup import startup
+
+with startup.phase("config"):
+    from utils import config
+with startup.phase("db"):
+    from utils.db import db
+# utils.misc records the build info phase itself
+from utils import misc
+from utils.misc import build_info, userbot_version
+
+with startup.phase("imports"):
+    from utils.dispatcher import ShardedDispatcher
+    from utils.handlers import tmutes
+    from utils.lazy import build_manifest, lazy_modules
+    from utils.pipeline import pipeline
+    from utils.buildinfo import refresh_build_info
+    from utils.scripts import restart, load_modules, scheduler
 
 SCRIPT_PATH = os.path.dirname(os.path.realpath(__file__))
 if SCRIPT_PATH != os.getcwd():
@@ -70,7 +85,7 @@ common_params = {
     "hide_password": True,
     "workdir": SCRIPT_PATH,
     "app_version": userbot_version,
-    "device_model": f"Moon-Userbot @ {gitrepo.head.commit.hexsha[:7]}",
+    "device_model": f"Moon-Userbot @ {(build_info['head'] or 'unknown')[:7]}",
     "system_version": platform.version() + " " + platform.machine(),
     "sleep_threshold": 30,
     "test_mode": config.test_server,
@@ -81,6 +96,7 @@ if config.STRINGSESSION:
     common_params["session_string"] = config.STRINGSESSION
 
 app = Client("my_account", **common_params)
+app.dispatcher = ShardedDispatcher(app, config.update_shards)
 
 
 def load_missing_modules():
@@ -115,6 +131,16 @@ def load_missing_modules():
                 logging.warning("Failed to load module: %s", module_name)
 
 
+def build_info_refreshed(future):
+    if future.cancelled():
+        return
+    if future.exception() is not None:
+        logging.warning("Can't refresh build info: %s", future.exception())
+        return
+    misc.userbot_version = build_info["version"]
+    logging.info("Build info refreshed, version %s", misc.userbot_version)
+
+
 async def main():
     logging.basicConfig(
         format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -124,7 +150,8 @@ async def main():
     DeleteAccount.__new__ = None
 
     try:
-        await app.start()
+        with startup.phase("app.start"):
+            await app.start()
     except sqlite3.OperationalError as e:
         if str(e) == "database is locked" and os.name == "posix":
             logging.warning(
@@ -140,52 +167,83 @@ async def main():
         os.rename("./my_account.session", "./my_account.session-old")
         restart()
 
-    load_missing_modules()
-    success_modules = 0
-    failed_modules = 0
-
-    for path in Path("modules").rglob("*.py"):
-        try:
-            await load_module(
-                path.stem, app, core="custom_modules" not in path.parent.parts
-            )
-        except Exception:
-            logging.warning("Can't import module %s", path.stem, exc_info=True)
-            failed_modules += 1
+    with startup.phase("missing modules"):
+        load_missing_modules()
+    with startup.phase("db migrations"):
+        db.migrate_history()
+        db.migrate_values()
+    with startup.phase("manifest"):
+        manifest = build_manifest(Path("modules").rglob("*.py"))
+    boot_modules = {}
+    for path, entry in manifest.items():
+        if config.lazy_modules and entry["lazy"]:
+            path = Path(path)
+            core = "custom_modules" not in path.parent.parts
+            lazy_modules.defer(path.stem, core, entry)
         else:
-            success_modules += 1
-
-    logging.info("Imported %s modules", success_modules)
-    if failed_modules:
-        logging.warning("Failed to import %s modules", failed_modules)
+            boot_modules[path] = entry
+    with startup.phase("modules"):
+        import_times, import_errors = await load_modules(app, boot_modules)
+    startup.modules = import_times
+
+    app.add_handler(lazy_modules.handler(), lazy_modules.group)
+    app.add_handler(pipeline.handler(), pipeline.group)
+    scheduler.start(app)
+    tmutes.start()
+
+    logging.info(
+        "Imported %s modules, %s deferred until first use",
+        len(import_times),
+        len(manifest) - len(boot_modules),
+    )
+    if import_errors:
+        logging.warning("Failed to import %s modules", len(import_errors))
+    slowest = sorted(import_times.items(), key=lambda item: item[1], reverse=True)
+    logging.info(
+        "Slowest imports: %s",
+        ", ".join(f"{name} {seconds:.2f}s" for name, seconds in slowest[:5]),
+    )
 
     if info := db.get("core.updater", "restart_info"):
         text = {
             "restart": "<b>Restart completed!</b>",
             "update": "<b>Update process completed!</b>",
         }[info["type"]]
-        try:
-            await app.edit_message_text(info["chat_id"], info["message_id"], text)
-        except errors.RPCError:
-            pass
+        with startup.phase("restart info"):
+            try:
+                await app.edit_message_text(info["chat_id"], info["message_id"], text)
+            except errors.RPCError:
+                pass
         db.remove("core.updater", "restart_info")
 
     # required for sessionkiller module
     if db.get("core.sessionkiller", "enabled", False):
+        with startup.phase("sessionkiller"):
+            authorizations = (await app.invoke(GetAuthorizations())).authorizations
         db.set(
             "core.sessionkiller",
             "auths_hashes",
-            [
-                auth.hash
-                for auth in (await app.invoke(GetAuthorizations())).authorizations
-            ],
+            [auth.hash for auth in authorizations],
         )
 
-    logging.info("Moon-Userbot started!")
+    if build_info["stale"] and build_info["head"]:
+        # HEAD moved outside of .update, recount the version off the boot path
+        refresh = asyncio.get_running_loop().run_in_executor(
+            None, lambda: build_info.update(refresh_build_info())
+        )
+        refresh.add_done_callback(build_info_refreshed)
+
+    run = startup.finish()
+    logging.info("Moon-Userbot started in %.2fs!", run["total"])
+    for name, seconds, usual in run["regressions"]:
+        logging.warning(
+            "Startup regression: %s took %.2fs, usually %.2fs", name, seconds, usual
+        )
 
     await idle()
 
     await app.stop()
+    db.close()
 
 
 if __name__ == "__main__":
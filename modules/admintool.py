@@ -14,18 +14,17 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-from contextlib import suppress
-
-from pyrogram import Client, ContinuePropagation, filters
+from pyrogram import Client, filters
 from pyrogram.errors import (
     UserAdminInvalid,
     ChatAdminRequired,
-    RPCError,
 )
 from pyrogram.raw import functions
 from pyrogram.types import Message, ChatPermissions
 
 from utils.db import db
+from utils.features import chat_flag, features
+from utils.pipeline import chat_keys, pipeline
 from utils.scripts import format_exc, with_reply
 from utils.misc import modules_help, prefix
 
@@ -44,58 +43,105 @@ from utils.handlers import (
     AntiChannelsHandler,
     DeleteHistoryHandler,
     AntiRaidHandler,
+    AntiFloodHandler,
+    content_hash,
+    flood_actions,
+    flood_detector,
+    flood_limits,
+    moderation,
+    tmutes,
 )
 
+ANTICHANNELS = features.register(
+    "antichannels", "core.ats", chat_flag("antich{chat_id}")
+)
+ANTIRAID = features.register("antiraid", "core.ats", chat_flag("antiraid{chat_id}"))
+WELCOME = features.register(
+    "welcome", "core.ats", chat_flag("welcome_enabled{chat_id}")
+)
+TMUTE = features.register("tmute", "core.ats", chat_flag("c{chat_id}"))
+ANTIFLOOD = features.register("antiflood", "core.ats", chat_flag("antiflood{chat_id}"))
+
+
+SETTINGS = (
+    "linked",
+    "antich",
+    "antiraid",
+    "welcome_enabled",
+    "welcome_text",
+    "antiflood",
+    "antiflood_limits",
+)
 
-db_cache: dict = db.get_collection("core.ats")
 
+def admintool_settings(chat_id):
+    settings = db.get_many("core.ats", [f"{key}{chat_id}" for key in SETTINGS])
+    settings = {key[: -len(str(chat_id))]: value for key, value in settings.items()}
+    settings["antiflood_limits"] = flood_limits(settings["antiflood_limits"])
+    return settings
 
-def update_cache():
-    db_cache.clear()
-    db_cache.update(db.get_collection("core.ats"))
 
+@pipeline.on_message(
+    filters.group & ~filters.me,
+    load=admintool_settings,
+    watch="core.ats",
+    # the route of a chat only depends on its own settings
+    watch_chat=chat_keys(*(key + "{chat_id}" for key in SETTINGS)),
+    feature=ANTICHANNELS | ANTIRAID | WELCOME | TMUTE | ANTIFLOOD,
+)
+async def admintool_handler(client: Client, message: Message, context):
+    settings = context.settings
 
-@Client.on_message(filters.group & ~filters.me)
-async def admintool_handler(_, message: Message):
     if message.sender_chat and (
         message.sender_chat.type == "supergroup"
-        or message.sender_chat.id == db_cache.get(f"linked{message.chat.id}", 0)
+        or message.sender_chat.id == settings["linked"]
     ):
-        raise ContinuePropagation
-
-    if message.sender_chat and db_cache.get(f"antich{message.chat.id}", False):
-        with suppress(RPCError):
-            await message.delete()
-            await message.chat.ban_member(message.sender_chat.id)
-
-    tmuted_users = db_cache.get(f"c{message.chat.id}", [])
-    if (
-        message.from_user
-        and message.from_user.id in tmuted_users
-        or message.sender_chat
-        and message.sender_chat.id in tmuted_users
-    ):
-        with suppress(RPCError):
-            await message.delete()
-
-    if db_cache.get(f"antiraid{message.chat.id}", False):
-        with suppress(RPCError):
-            await message.delete()
-            if message.from_user:
-                await message.chat.ban_member(message.from_user.id)
-            elif message.sender_chat:
-                await message.chat.ban_member(message.sender_chat.id)
-
-    if message.new_chat_members and db_cache.get(
-        f"welcome_enabled{message.chat.id}", False
+        return
+
+    if message.sender_chat and settings["antich"]:
+        moderation.delete(client, context.chat_id, [message.id])
+        moderation.ban(client, context.chat_id, message.sender_chat.id)
+
+    if context.sender_id is not None and tmutes.is_muted(
+        context.chat_id, context.sender_id
     ):
+        moderation.delete(client, context.chat_id, [message.id])
+
+    if settings["antiraid"]:
+        moderation.delete(client, context.chat_id, [message.id])
+        if context.sender_id is not None:
+            moderation.ban(client, context.chat_id, context.sender_id)
+
+    if settings["antiflood"]:
+        limits = settings["antiflood_limits"]
+        if message.new_chat_members:
+            verdict = flood_detector.joined(
+                context.chat_id,
+                [user.id for user in message.new_chat_members],
+                message.id,
+                limits,
+            )
+        elif context.sender_id is None or flood_actions.track(
+            client, context.chat_id, context.sender_id, message.id
+        ):
+            verdict = None
+        else:
+            verdict = flood_detector.message(
+                context.chat_id,
+                context.sender_id,
+                message.id,
+                content_hash(message),
+                limits,
+            )
+        if verdict:
+            flood_actions.submit(client, context.chat_id, verdict, limits)
+
+    if message.new_chat_members and settings["welcome_enabled"]:
         await message.reply(
-            db_cache.get(f"welcome_text{message.chat.id}"),
+            settings["welcome_text"],
             disable_web_page_preview=True,
         )
 
-    raise ContinuePropagation
-
 
 async def get_user_and_name(message):
     if message.reply_to_message.from_user:
@@ -138,14 +184,12 @@ async def kickdel_cmd(client: Client, message: Message):
 async def tmute_command(client: Client, message: Message):
     handler = TimeMuteHandler(client, message)
     await handler.handle_tmute()
-    update_cache()
 
 
 @Client.on_message(filters.command(["tunmute"], prefix) & filters.me)
 async def tunmute_command(client: Client, message: Message):
     handler = TimeUnmuteHandler(client, message)
     await handler.handle_tunmute()
-    update_cache()
 
 
 @Client.on_message(filters.command(["tmute_users"], prefix) & filters.me)
@@ -182,7 +226,6 @@ async def promote_command(client: Client, message: Message):
 async def anti_channels(client: Client, message: Message):
     handler = AntiChannelsHandler(client, message)
     await handler.handle_anti_channels()
-    update_cache()
 
 
 @Client.on_message(filters.command(["delete_history", "dh"], prefix))
@@ -303,7 +346,12 @@ async def unro(client: Client, message: Message):
 async def antiraid(client: Client, message: Message):
     handler = AntiRaidHandler(client, message)
     await handler.handle_antiraid()
-    update_cache()
+
+
+@Client.on_message(filters.command("antiflood", prefix) & filters.me)
+async def antiflood(client: Client, message: Message):
+    handler = AntiFloodHandler(client, message)
+    await handler.handle_antiflood()
 
 
 @Client.on_message(filters.command(["welcome", "wc"], prefix) & filters.me)
@@ -323,8 +371,6 @@ async def welcome(_, message: Message):
         db.set("core.ats", f"welcome_enabled{message.chat.id}", False)
         await message.edit("<b>Welcome disabled in this chat</b>")
 
-    update_cache()
-
 
 modules_help["admintool"] = {
     "ban [reply]/[username/id]* [reason] [report_spam] [delete_history]": "ban user in chat",
@@ -334,7 +380,8 @@ modules_help["admintool"] = {
     "unmute [reply]/[userid]* [reason]": "unmute user in chat",
     "promote [reply]/[userid]* [prefix]": "promote user in chat",
     "demote [reply]/[userid]* [reason]": "demote user in chat",
-    "tmute [reply]/[username/id]* [reason]": "delete all new messages from user in chat",
+    "tmute [reply]/[username/id]* [1m]/[1h]/[1d]/[1w] [reason]": "delete all new messages from user in chat, "
+    "for the given time or until tunmute",
     "tunmute [reply]/[username/id]* [reason]": "stop deleting all messages from user in chat",
     "tmute_users": "list of tmuted (.tmute) users",
     "antich [enable/disable]": "turn on/off blocking channels in this chat",
@@ -346,6 +393,12 @@ modules_help["admintool"] = {
     "unro": "disable read-only mode",
     "antiraid [on|off]": "when enabled, anyone who writes message will be blocked. Useful in raids. "
     "Running without arguments equals to toggling state",
+    "antiflood [on|off]": "automatically mute flooders and senders of repeated messages, "
+    "and ban new members during join waves. Running without arguments shows the limits",
+    "antiflood [joins|messages|duplicates] [count] [seconds]": "set a sliding-window limit",
+    "antiflood action [mute|ban]": "what to do with flooders",
+    "antiflood [mute_time|raid_time] [seconds]": "mute length and how long new members "
+    "are banned after a join wave",
     "welcome [text]*": "enable auto-welcome to new users in groups. "
     "Running without text equals to disable",
     "kickdel": "Kick all deleted accounts",
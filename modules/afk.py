@@ -1,10 +1,9 @@
-import asyncio
 from datetime import datetime
 import humanize
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from utils.misc import modules_help, prefix
-from utils.scripts import ReplyCheck
+from utils.scripts import ReplyCheck, scheduler
 from utils.db import db
 
 # Variables
@@ -58,8 +57,7 @@ async def collect_afk_messages(bot: Client, message: Message):
                 text=text,
             )
             CHAT_TYPE[GetChatID(message)] = 1
-            await asyncio.sleep(30)
-            await afk_message.delete()
+            scheduler.delete_later(afk_message.chat.id, afk_message.id, 30)
             return
 
         if CHAT_TYPE[GetChatID(message)] == 50:
@@ -74,8 +72,7 @@ async def collect_afk_messages(bot: Client, message: Message):
                 chat_id=GetChatID(message),
                 text=text,
             )
-            await asyncio.sleep(30)
-            await afk_message.delete()
+            scheduler.delete_later(afk_message.chat.id, afk_message.id, 30)
         elif CHAT_TYPE[GetChatID(message)] > 50:
             return
         elif CHAT_TYPE[GetChatID(message)] % 5 == 0:
@@ -90,8 +87,7 @@ async def collect_afk_messages(bot: Client, message: Message):
                 chat_id=GetChatID(message),
                 text=text,
             )
-            await asyncio.sleep(30)
-            await afk_message.delete()
+            scheduler.delete_later(afk_message.chat.id, afk_message.id, 30)
 
         CHAT_TYPE[GetChatID(message)] += 1
 
@@ -130,9 +126,9 @@ async def afk_unset(_, message: Message):
         AFK_REASON = ""
         USERS = {}
         GROUPS = {}
-        await asyncio.sleep(5)
-
-    await message.delete()
+        scheduler.delete_later(message.chat.id, message.id, 5)
+    else:
+        await message.delete()
 
 
 @Client.on_message(filters.command("setafkmsg", prefix) & filters.me, group=3)
@@ -186,8 +182,7 @@ async def auto_afk_unset(_, message: Message):
         AFK_REASON = ""
         USERS = {}
         GROUPS = {}
-        await asyncio.sleep(5)
-        await reply.delete()
+        scheduler.delete_later(reply.chat.id, reply.id, 5)
 
 
 modules_help["afk"] = {
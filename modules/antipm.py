@@ -14,23 +14,128 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import logging
+import time
+
 from pyrogram import Client, filters
+from pyrogram.errors import FloodWait
 from pyrogram.raw import functions
 from pyrogram.types import Message
 
-from utils.config import pm_limit
+from utils.config import pm_limit, pm_warn_ttl
 from utils.db import db
+from utils.features import chat_flag, features
+from utils.handlers import TokenBucket
 from utils.misc import modules_help, prefix
 
-anti_pm_enabled = filters.create(
-    lambda _, __, ___: db.get("core.antipm", "status", False)
+SETTINGS_KEYS = ("status", "antipm_msg", "spamrep", "block", "antipm_pic")
+SETTINGS = db.get_many("core.antipm", SETTINGS_KEYS)
+
+
+def on_settings_change(_, variable, value):
+    if variable in SETTINGS_KEYS:
+        SETTINGS[variable] = value
+
+
+db.subscribe(on_settings_change, "core.antipm")
+
+APPROVED = features.register(
+    "antipm_approved", "core.antipm", chat_flag("allowusers{chat_id}")
 )
 
+anti_pm_enabled = filters.create(lambda _, __, ___: bool(SETTINGS["status"]))
+
 in_contact_list = filters.create(lambda _, __, message: message.from_user.is_contact)
 
 is_support = filters.create(lambda _, __, message: message.chat.is_support)
 
-USER_WARNINGS = {}
+is_approved = filters.create(
+    lambda _, __, message: features.enabled(message.chat.id, APPROVED)
+)
+
+
+class WarningCounter:
+    """Per-user warnings, stored in core.antipm and decaying by one every ttl"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    def get(self, user_id: int) -> int:
+        stored = db.get("core.antipm", f"warns{user_id}")
+        if not stored:
+            return 0
+        count, updated = stored
+        count -= int((time.time() - updated) / self.ttl)
+        if count <= 0:
+            # fully decayed, don't keep a key per user who ever wrote
+            self.reset(user_id)
+            return 0
+        return count
+
+    def increment(self, user_id: int) -> int:
+        count = self.get(user_id) + 1
+        db.set("core.antipm", f"warns{user_id}", [count, time.time()])
+        return count
+
+    def reset(self, user_id: int):
+        db.remove("core.antipm", f"warns{user_id}")
+
+
+class AntiPMActions:
+    """
+    Queue of block/report calls, run by one task at a rate Telegram accepts.
+    The same action for the same user is queued only once. Users with a
+    pending block are in `blocking`, their messages until then are ignored.
+    """
+
+    def __init__(self, rate: float = 1, burst: int = 5):
+        self.bucket = TokenBucket(rate, burst)
+        self.queue = asyncio.Queue()
+        self.queued = set()
+        self.blocking = set()
+        self.task = None
+
+    def submit(self, client: Client, action: str, user_id: int):
+        if (action, user_id) in self.queued:
+            return
+        if action == "block":
+            self.blocking.add(user_id)
+        self.queued.add((action, user_id))
+        self.queue.put_nowait((client, action, user_id))
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._worker())
+
+    async def _worker(self):
+        while not self.queue.empty():
+            client, action, user_id = self.queue.get_nowait()
+            await self.bucket.acquire()
+            try:
+                if action == "report":
+                    await client.invoke(
+                        functions.messages.ReportSpam(
+                            peer=await client.resolve_peer(user_id)
+                        )
+                    )
+                else:
+                    await client.block_user(user_id)
+            except FloodWait as e:
+                self.bucket.pause(e.value)
+                self.queue.put_nowait((client, action, user_id))
+                continue
+            except Exception as e:
+                logging.warning("Anti-PM %s of %s failed: %s", action, user_id, e)
+            self.queued.discard((action, user_id))
+            # a blocked user can't write, a message later means they were
+            # unblocked by hand and go through the warnings again
+            if action == "block":
+                self.blocking.discard(user_id)
+
+
+warnings = WarningCounter(pm_warn_ttl)
+actions = AntiPMActions()
+# outgoing warnings, extra ones are skipped during PM waves
+replies = TokenBucket(rate=0.5, capacity=10)
 
 
 @Client.on_message(
@@ -40,59 +145,53 @@ USER_WARNINGS = {}
     & ~in_contact_list
     & ~is_support
     & anti_pm_enabled
+    & ~is_approved
 )
 async def anti_pm_handler(client: Client, message: Message):
     user_id = message.from_user.id
-    ids = message.chat.id
-    b_f = await client.get_me()
-    u_n = b_f.first_name
-    user = await client.get_users(ids)
-    u_f = user.first_name
-    default_text = db.get("core.antipm", "antipm_msg", None)
-    if default_text is None:
-        default_text = f"""<b>Hello, {u_f}!
+    if user_id in actions.blocking:
+        return
+
+    warns = warnings.get(user_id)
+    if SETTINGS["spamrep"]:
+        actions.submit(client, "report", user_id)
+
+    if warns >= pm_limit:
+        # that was the last warning
+        if replies.try_acquire():
+            await client.send_message(
+                message.chat.id,
+                "<b>Ehm...! That was your Last warn, Bye Bye see you L0L</b>",
+            )
+        actions.submit(client, "block", user_id)
+        warnings.reset(user_id)
+        return
+
+    warnings.increment(user_id)
+    if replies.try_acquire():
+        u_f = message.from_user.first_name
+        u_n = client.me.first_name
+        default_text = SETTINGS["antipm_msg"]
+        if default_text is None:
+            default_text = f"""<b>Hello, {u_f}!
 This is the Assistant Of {u_n}.</b>
 <i>My Boss is away or busy as of now, You can wait for him to respond.
 Do not spam further messages else I may have to block you!</i>
 
 <b>This is an automated message by the assistant.</b>
-<b><u>Currently You Have <code>{USER_WARNINGS.get(user_id, 0)}</code> Warnings.</u></b>
+<b><u>Currently You Have <code>{warns}</code> Warnings.</u></b>
     """
-    else:
-        default_text = default_text.format(
-            user=u_f, my_name=u_n, warns=USER_WARNINGS.get(user_id, 0)
-        )
-
-    if db.get("core.antipm", "spamrep", False):
-        user_info = await client.resolve_peer(ids)
-        await client.invoke(functions.messages.ReportSpam(peer=user_info))
-
-    if db.get("core.antipm", "block", False):
-        await client.block_user(user_id)
+        else:
+            default_text = default_text.format(user=u_f, my_name=u_n, warns=warns)
 
-    if db.get("core.antipm", f"disallowusers{ids}") == user_id != db.get(
-        "core.antipm", f"allowusers{ids}"
-    ) or db.get("core.antipm", f"disallowusers{ids}") != user_id != db.get(
-        "core.antipm", f"allowusers{ids}"
-    ):
-        default_pic = db.get("core.antipm", "antipm_pic", None)
+        default_pic = SETTINGS["antipm_pic"]
         if default_pic:
             await client.send_photo(message.chat.id, default_pic, caption=default_text)
         else:
             await client.send_message(message.chat.id, default_text)
 
-        if user_id in USER_WARNINGS:
-            USER_WARNINGS[user_id] += 1
-        else:
-            USER_WARNINGS[user_id] = 1
-
-        if USER_WARNINGS[user_id] > pm_limit:
-            await client.send_message(
-                message.chat.id,
-                "<b>Ehm...! That was your Last warn, Bye Bye see you L0L</b>",
-            )
-            await client.block_user(user_id)
-            del USER_WARNINGS[user_id]
+    if SETTINGS["block"]:
+        actions.submit(client, "block", user_id)
 
 
 @Client.on_message(filters.command(["antipm", "anti_pm"], prefix) & filters.me)
@@ -169,8 +268,8 @@ async def add_contact(_, message: Message):
     ids = message.chat.id
 
     db.set("core.antipm", f"allowusers{ids}", ids)
-    if ids in USER_WARNINGS:
-        del USER_WARNINGS[ids]
+    warnings.reset(ids)
+    actions.blocking.discard(ids)
     await message.edit("User Approved!")
 
 
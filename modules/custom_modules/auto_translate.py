@@ -5,13 +5,20 @@ from pyrogram.types import Message
 from pyrogram.filters import create
 from utils.misc import modules_help, prefix
 from utils.db import db
+from utils.features import chat_flag, features
+from utils.pipeline import pipeline
 
 TRANSLATE_API = "https://delirius-apiofc.vercel.app/tools/translate?text={query}&language={lang}"
 
+AUTO_TRANSLATE = features.register("auto_translate", "custom.translate", chat_flag("{chat_id}"))
+
+def auto_translate_lang(chat_id):
+    """Language set for the chat, translation is enabled only if there is one."""
+    return db.get("custom.translate", str(chat_id), None)
+
 def auto_translate_filter(_, __, message: Message):
-    """Filter to process messages only if translation is enabled for the chat."""
-    lang_code = db.get("custom.translate", str(message.chat.id), None)
-    return bool(lang_code) and not message.text.startswith(prefix)
+    """Filter out commands."""
+    return not message.text.startswith(prefix)
 
 auto_translate_filter = create(auto_translate_filter)
 
@@ -49,15 +56,13 @@ async def language_status(_, message: Message):
     else:
         await message.edit(f"<b>Usage:</b> \n<code>{prefix}lang</code> [check language] \n<code>{prefix}lang off</code> [turn off auto-translation].")
 
-@Client.on_message(filters.text & auto_translate_filter)
-async def auto_translate(_, message: Message):
+@pipeline.on_message(filters.text & auto_translate_filter, load=auto_translate_lang, watch="custom.translate", feature=AUTO_TRANSLATE, background=True)
+async def auto_translate(_, message: Message, context):
     """Automatically translate and edit messages in chats with a set language."""
     if message.from_user and not message.from_user.is_self:
         return
 
-    lang_code = db.get("custom.translate", str(message.chat.id), None)
-    if not lang_code:
-        return
+    lang_code = context.settings
 
     try:
         response = requests.get(TRANSLATE_API.format(query=quote(message.text), lang=lang_code))
@@ -51,10 +51,8 @@ async def fetch_roles():
         return {}
 
 def get_chat_history(user_id, user_message, user_name):
-    chat_history = db.get(collection, f"chat_history.{user_id}") or []
-    chat_history.append(f"{user_name}: {user_message}")
-    db.set(collection, f"chat_history.{user_id}", chat_history)
-    return chat_history
+    db.append_history(f"{collection}/{user_id}", f"{user_name}: {user_message}")
+    return db.get_history(f"{collection}/{user_id}")
 
 def build_prompt(bot_role, chat_history, user_message):
     timestamp = datetime.datetime.now(la_timezone).strftime("%Y-%m-%d %H:%M:%S")
@@ -83,7 +81,7 @@ async def generate_gemini_response(input_data, chat_history, user_id):
             bot_response = response.text.strip()
 
             chat_history.append(bot_response)
-            db.set(collection, f"chat_history.{user_id}", chat_history)
+            db.append_history(f"{collection}/{user_id}", bot_response)
             return bot_response
         except Exception as e:
             if "429" in str(e) or "invalid" in str(e).lower():
@@ -181,7 +179,7 @@ async def gchat(client: Client, message: Message):
                 bot_response = response.text.strip()
 
                 chat_history.append(bot_response)
-                db.set(collection, f"chat_history.{user_id}", chat_history)
+                db.append_history(f"{collection}/{user_id}", bot_response)
 
                 if await handle_voice_message(client, message.chat.id, bot_response):
                     return
@@ -313,7 +311,7 @@ async def gchat_command(client: Client, message: Message):
             await message.edit_text(f"<b>OFF</b> [{user_id}].")
 
         elif command == "del":
-            db.set(collection, f"chat_history.{user_id}", None)
+            db.clear_history(f"{collection}/{user_id}")
             await message.edit_text(f"<b>Deleted</b> [{user_id}].")
 
         elif command == "all":
@@ -350,7 +348,7 @@ async def switch_role(client: Client, message: Message):
         role_name = parts[1].lower()
         if role_name in roles:
             db.set(collection, f"custom_roles.{user_id}", roles[role_name])
-            db.set(collection, f"chat_history.{user_id}", None)
+            db.clear_history(f"{collection}/{user_id}")
             await message.edit_text(f"Switched to: <b>{role_name}</b>")
         else:
             await message.edit_text(f"Role <b>{role_name}</b> not found.")
@@ -384,11 +382,11 @@ async def set_custom_role(client: Client, message: Message):
 
         if not custom_role:
             db.set(collection, f"custom_roles.{user_id}", default_role)
-            db.set(collection, f"chat_history.{user_id}", None)
+            db.clear_history(f"{collection}/{user_id}")
             await message.edit_text(f"Role reset [{user_id}].")
         else:
             db.set(collection, f"custom_roles.{user_id}", custom_role)
-            db.set(collection, f"chat_history.{user_id}", None)
+            db.clear_history(f"{collection}/{user_id}")
             await message.edit_text(f"Role set [{user_id}]!\n<b>New Role:</b> {custom_role}")
 
         await message.delete()
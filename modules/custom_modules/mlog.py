@@ -13,7 +13,17 @@ from collections import defaultdict
 from utils.db import db
 from utils.misc import modules_help, prefix
 
-mlog_enabled = filters.create(lambda _, __, ___: db.get("custom.mlog", "status", False))
+MLOG_ENABLED = db.get("custom.mlog", "status", False)
+
+
+def on_status_change(_, __, value):
+    global MLOG_ENABLED
+    MLOG_ENABLED = bool(value)
+
+
+db.subscribe(on_status_change, "custom.mlog", "status")
+
+mlog_enabled = filters.create(lambda _, __, ___: MLOG_ENABLED)
 
 # Media cache and processing tasks
 user_media_cache = defaultdict(list)
@@ -6,6 +6,8 @@ from pyrogram.types import Message
 from utils.scripts import import_library
 from utils.db import db
 from utils.misc import modules_help, prefix
+from utils.features import features
+from utils.pipeline import pipeline
 from modules.custom_modules.elevenlabs import generate_elevenlabs_audio
 from PIL import Image
 import datetime
@@ -43,6 +45,30 @@ group_roles = db.get(collection, "group_roles") or {}
 
 smileys = ["-.-", "):", ":)", "*.*", ")*"]
 
+def _wchat_groups(variable, value):
+    if variable == "wchat_for_all_groups":
+        return [int(group_id) for group_id, enabled in value.items() if enabled]
+    return ()
+
+def _wchat_topic_groups(variable, value):
+    if variable == "enabled_topics":
+        return [int(topic_id.split(":")[0]) for topic_id in value]
+    return ()
+
+def _wchat_topics(name):
+    return lambda variable, value: value if variable == name else ()
+
+WCHAT_GROUP = features.register("wchat_group", collection, _wchat_groups)
+WCHAT_TOPICS = features.register("wchat_topics", collection, _wchat_topic_groups)
+WCHAT_TOPIC_ON = features.register("wchat_topic_on", collection, _wchat_topics("enabled_topics"))
+WCHAT_TOPIC_OFF = features.register("wchat_topic_off", collection, _wchat_topics("disabled_topics"))
+
+def wchat_topic_enabled(context):
+    topic_bits = features.get(context.topic_id)
+    if topic_bits & WCHAT_TOPIC_OFF:
+        return False
+    return bool(topic_bits & WCHAT_TOPIC_ON or features.enabled(context.chat_id, WCHAT_GROUP))
+
 async def fetch_roles():
     try:
         response = requests.get(ROLES_URL, timeout=5)
@@ -57,10 +83,8 @@ async def fetch_roles():
         return {}
 
 def get_chat_history(topic_id, user_message, user_name):
-    chat_history = db.get(collection, f"chat_history.{topic_id}") or []
-    chat_history.append(f"{user_name}: {user_message}")
-    db.set(collection, f"chat_history.{topic_id}", chat_history)
-    return chat_history
+    db.append_history(f"{collection}/{topic_id}", f"{user_name}: {user_message}")
+    return db.get_history(f"{collection}/{topic_id}")
 
 def build_prompt(bot_role, chat_history, user_message):
     timestamp = datetime.datetime.now(la_timezone).strftime("%Y-%m-%d %H:%M:%S")
@@ -89,7 +113,7 @@ async def generate_gemini_response(input_data, chat_history, topic_id):
             bot_response = response.text.strip()
 
             chat_history.append(bot_response)
-            db.set(collection, f"chat_history.{topic_id}", chat_history)
+            db.append_history(f"{collection}/{topic_id}", bot_response)
             return bot_response
         except Exception as e:
             if "429" in str(e) or "invalid" in str(e).lower():
@@ -143,15 +167,10 @@ async def handle_voice_message(client, chat_id, bot_response, thread_id=None):
             return True
     return False
 
-@Client.on_message(filters.sticker & filters.group & ~filters.me)
-async def handle_sticker(client: Client, message: Message):
+@pipeline.on_message(filters.sticker & filters.group & ~filters.me, feature=WCHAT_GROUP | WCHAT_TOPICS, background=True)
+async def handle_sticker(client: Client, message: Message, context):
     try:
-        group_id = str(message.chat.id)
-        topic_id = f"{group_id}:{message.message_thread_id}"
-        if topic_id in disabled_topics or (
-            not wchat_for_all_groups.get(group_id, False)
-            and topic_id not in enabled_topics
-        ):
+        if not wchat_topic_enabled(context):
             return
         random_smiley = random.choice(smileys)
         await asyncio.sleep(random.uniform(5, 10))
@@ -161,12 +180,10 @@ async def handle_sticker(client: Client, message: Message):
             "me", f"An error occurred in the `handle_sticker` function:\n\n{str(e)}"
         )
 
-@Client.on_message(filters.animation & filters.group & ~filters.me)
-async def handle_gif(client: Client, message: Message):
+@pipeline.on_message(filters.animation & filters.group & ~filters.me, feature=WCHAT_GROUP | WCHAT_TOPICS, background=True)
+async def handle_gif(client: Client, message: Message, context):
     try:
-        group_id = str(message.chat.id)
-        topic_id = f"{group_id}:{message.message_thread_id}"
-        if topic_id in disabled_topics or (not wchat_for_all_groups.get(group_id, False) and topic_id not in enabled_topics):
+        if not wchat_topic_enabled(context):
             return
         random_smiley = random.choice(smileys)
         await asyncio.sleep(random.uniform(5, 10))
@@ -174,11 +191,11 @@ async def handle_gif(client: Client, message: Message):
     except Exception as e:
         await client.send_message("me", f"An error occurred in the `handle_gif` function:\n\n{str(e)}")
 
-@Client.on_message(filters.text & filters.group & ~filters.me)
-async def wchat(client: Client, message: Message):
+@pipeline.on_message(filters.text & filters.group & ~filters.me, feature=WCHAT_GROUP | WCHAT_TOPICS, background=True)
+async def wchat(client: Client, message: Message, context):
     try:
-        group_id = str(message.chat.id)
-        topic_id = f"{group_id}:{message.message_thread_id}"
+        group_id = context.chat_key
+        topic_id = context.topic_id
         
         if message.from_user is None:
             user_name = "User"
@@ -187,7 +204,7 @@ async def wchat(client: Client, message: Message):
         
         user_message = message.text.strip()
         
-        if topic_id in disabled_topics or (not wchat_for_all_groups.get(group_id, False) and topic_id not in enabled_topics):
+        if not wchat_topic_enabled(context):
             return
 
         roles = await fetch_roles()
@@ -219,7 +236,7 @@ async def wchat(client: Client, message: Message):
                 bot_response = response.text.strip()
 
                 chat_history.append(bot_response)
-                db.set(collection, f"chat_history.{topic_id}", chat_history)
+                db.append_history(f"{collection}/{topic_id}", bot_response)
 
                 if ".el" in bot_response:
                     return await handle_voice_message(client, message.chat.id, bot_response, thread_id=message.message_thread_id)
@@ -237,18 +254,21 @@ async def wchat(client: Client, message: Message):
     except Exception as e:
         return await client.send_message("me", f"An error occurred in the `wchat` module:\n\n{str(e)}")
 
-@Client.on_message(filters.group & ~filters.me)
-async def handle_files(client: Client, message: Message):
+@pipeline.on_message(
+    (filters.photo | filters.video | filters.video_note | filters.audio | filters.voice | filters.document)
+    & filters.group
+    & ~filters.me,
+    feature=WCHAT_GROUP | WCHAT_TOPICS,
+    background=True,
+)
+async def handle_files(client: Client, message: Message, context):
     try:
-        group_id = str(message.chat.id)
-        topic_id = f"{group_id}:{message.message_thread_id}"
+        group_id = context.chat_key
+        topic_id = context.topic_id
         
         user_name = message.from_user.first_name if message.from_user else "User"
         
-        if topic_id in disabled_topics or (
-            not wchat_for_all_groups.get(group_id, False)
-            and topic_id not in enabled_topics
-        ):
+        if not wchat_topic_enabled(context):
             return
 
         roles = await fetch_roles()
@@ -375,7 +395,7 @@ async def wchat_command(client: Client, message: Message):
             await message.edit_text(f"<b>Disabled for topic</b> [{topic_id}].")
 
         elif command == "del":
-            db.set(collection, f"chat_history.{topic_id}", None)
+            db.clear_history(f"{collection}/{topic_id}")
             await message.edit_text(f"<b>Deleted for topic</b> [{topic_id}].")
 
         elif command == "all":
@@ -427,7 +447,7 @@ async def set_custom_role(client: Client, message: Message):
             if len(parts) == 2:
                 topic_id = f"{group_id}:{message.message_thread_id}"
                 db.set(collection, f"custom_roles.{topic_id}", default_role)
-                db.set(collection, f"chat_history.{topic_id}", None)
+                db.clear_history(f"{collection}/{topic_id}")
                 await message.edit_text(
                     f"Role reset to default for topic {topic_id}."
                 )
@@ -435,7 +455,7 @@ async def set_custom_role(client: Client, message: Message):
                 topic_id = f"{group_id}:{parts[2]}"
                 group_role = group_roles.get(group_id, default_role)
                 db.set(collection, f"custom_roles.{topic_id}", group_role)
-                db.set(collection, f"chat_history.{topic_id}", None)
+                db.clear_history(f"{collection}/{topic_id}")
                 await message.edit_text(
                     f"Role reset to group's role for topic {topic_id}."
                 )
@@ -447,7 +467,7 @@ async def set_custom_role(client: Client, message: Message):
                     topic_id = f"{group_id}:{message.message_thread_id}"
                     custom_role = " ".join(parts[2:]).strip()
                 db.set(collection, f"custom_roles.{topic_id}", custom_role)
-                db.set(collection, f"chat_history.{topic_id}", None)
+                db.clear_history(f"{collection}/{topic_id}")
                 await message.edit_text(
                     f"New role for topic [{topic_id}]!\n<b>Role:</b> {custom_role}"
                 )
@@ -487,7 +507,7 @@ async def switch_role(client: Client, message: Message):
 
         if role_name in roles:
             db.set(collection, f"custom_roles.{topic_id}", roles[role_name])
-            db.set(collection, f"chat_history.{topic_id}", None)
+            db.clear_history(f"{collection}/{topic_id}")
             await message.edit_text(f"Switched to: <b>{role_name}</b> for topic <b>{topic_id}</b>")
         else:
             await message.edit_text(f"Role <b>{role_name}</b> not found.")
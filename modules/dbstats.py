@@ -0,0 +1,87 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import io
+import json
+import time
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from utils.db import db
+from utils.misc import modules_help, prefix
+from utils.scripts import format_exc
+
+TOP_COLLECTIONS = 10
+
+
+@Client.on_message(filters.command(["dbstats"], prefix) & filters.me)
+async def dbstats(client: Client, message: Message):
+    action = message.command[1].lower() if len(message.command) > 1 else ""
+
+    if action == "reset":
+        db.metrics.reset()
+        return await message.edit("<b>Database stats have been reset</b>")
+
+    snapshot = db.metrics.snapshot()
+
+    if action == "json":
+        try:
+            with io.BytesIO(json.dumps(snapshot, indent=2).encode()) as dump:
+                dump.name = "dbstats.json"
+                await client.send_document(
+                    message.chat.id, dump, reply_to_message_id=message.id
+                )
+            return await message.delete()
+        except Exception as e:
+            return await message.edit(format_exc(e))
+
+    totals = []
+    for collection, operations in snapshot["collections"].items():
+        count = sum(op["count"] for op in operations.values())
+        total_ms = sum(op["total_ms"] for op in operations.values())
+        max_ms = max(op["max_ms"] for op in operations.values())
+        totals.append((collection, count, total_ms, max_ms))
+
+    if not totals:
+        return await message.edit("<b>No database operations recorded yet</b>")
+
+    totals.sort(key=lambda item: item[2], reverse=True)
+    uptime = int(time.time() - snapshot["since"])
+    text = f"<b>Database stats for the last {uptime}s:</b>\n"
+    for collection, count, total_ms, max_ms in totals[:TOP_COLLECTIONS]:
+        text += (
+            f"\n<code>{collection}</code>: {count} ops, "
+            f"{total_ms:.1f} ms total, {total_ms / count:.2f} ms avg, "
+            f"{max_ms:.1f} ms max"
+        )
+
+    if snapshot["slow_queries"]:
+        text += f"\n\n<b>Slow queries (≥ {snapshot['slow_query_ms']} ms):</b>\n"
+        for query in snapshot["slow_queries"][-5:]:
+            text += (
+                f"\n<code>{query['operation']} {query['collection']}</code>: "
+                f"{query['ms']} ms from <code>{query['caller']}</code>"
+            )
+
+    await message.edit(text)
+
+
+modules_help["dbstats"] = {
+    "dbstats": "Show database operation counts and latency per collection",
+    "dbstats json": "Send full database stats with latency histograms as a JSON file",
+    "dbstats reset": "Reset database stats",
+}
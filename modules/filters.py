@@ -14,18 +14,29 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+from collections import OrderedDict
+
 from pyrogram import Client, ContinuePropagation, errors, filters
-from pyrogram.types import (
-    InputMediaAudio,
-    InputMediaDocument,
-    InputMediaPhoto,
-    InputMediaVideo,
-    Message,
-)
+from pyrogram.types import Message
 
 from utils.db import db
+from utils.handlers import send_stored_message
 from utils.misc import modules_help, prefix
 from utils.scripts import format_exc
+from utils.triggers import (
+    MATCH_CONTAINS,
+    MATCH_EXACT,
+    MATCH_WORD,
+    TriggerIndex,
+)
+
+MATCH_FLAGS = {"-c": MATCH_CONTAINS, "-w": MATCH_WORD}
+
+# chat_id -> (compiled trigger index, filters of the chat), least recently
+# used chats are dropped first
+filters_index = OrderedDict()
+FILTERS_INDEX_SIZE = 1024
+filters_generation = 0
 
 
 def get_filters_chat(chat_id):
@@ -36,105 +47,88 @@ def set_filters_chat(chat_id, filters_):
     return db.set("core.filters", f"{chat_id}", filters_)
 
 
+async def aget_filters_chat(chat_id):
+    return await db.aget("core.filters", f"{chat_id}", {})
+
+
+def on_filters_change(_, variable, __):
+    global filters_generation
+    filters_generation += 1
+    if variable is None:
+        filters_index.clear()
+    else:
+        filters_index.pop(variable, None)
+
+
+db.subscribe(on_filters_change, "core.filters")
+
+
+async def get_filters_index(chat_id):
+    key = f"{chat_id}"
+    cached = filters_index.get(key)
+    if cached is not None:
+        filters_index.move_to_end(key)
+    else:
+        generation = filters_generation
+        chat_filters = await aget_filters_chat(chat_id)
+        cached = (
+            TriggerIndex(
+                (name, value.get("MATCH", MATCH_EXACT))
+                for name, value in chat_filters.items()
+            ),
+            chat_filters,
+        )
+        # don't keep an index built from filters that changed meanwhile
+        if generation == filters_generation:
+            filters_index[key] = cached
+            if len(filters_index) > FILTERS_INDEX_SIZE:
+                filters_index.popitem(last=False)
+    return cached
+
+
 async def contains_filter(_, __, m):
-    return m.text and m.text.lower() in get_filters_chat(m.chat.id).keys()
+    if not m.text:
+        return False
+    index, chat_filters = await get_filters_index(m.chat.id)
+    if not index:
+        return False
+    name = index.match(m.text)
+    if name is None:
+        return False
+    m.filter_value = chat_filters[name]
+    return True
 
 
 contains = filters.create(contains_filter)
 
 
-# noinspection PyTypeChecker
 @Client.on_message(contains)
 async def filters_main_handler(client: Client, message: Message):
-    value = get_filters_chat(message.chat.id)[message.text.lower()]
     try:
-        await client.get_messages(int(value["CHAT_ID"]), int(value["MESSAGE_ID"]))
-    except errors.RPCError as exc:
-        raise ContinuePropagation from exc
-
-    if value.get("MEDIA_GROUP"):
-        messages_grouped = await client.get_media_group(
-            int(value["CHAT_ID"]), int(value["MESSAGE_ID"])
-        )
-        media_grouped_list = []
-        for _ in messages_grouped:
-            if _.photo:
-                if _.caption:
-                    media_grouped_list.append(
-                        InputMediaPhoto(_.photo.file_id, _.caption.HTML)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaPhoto(_.photo.file_id))
-            elif _.video:
-                if _.caption:
-                    if _.video.thumbs:
-                        media_grouped_list.append(
-                            InputMediaVideo(
-                                _.video.file_id,
-                                _.video.thumbs[0].file_id,
-                                _.caption.HTML,
-                            )
-                        )
-                    else:
-                        media_grouped_list.append(
-                            InputMediaVideo(_.video.file_id, _.caption.HTML)
-                        )
-                elif _.video.thumbs:
-                    media_grouped_list.append(
-                        InputMediaVideo(_.video.file_id, _.video.thumbs[0].file_id)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaVideo(_.video.file_id))
-            elif _.audio:
-                if _.caption:
-                    media_grouped_list.append(
-                        InputMediaAudio(_.audio.file_id, _.caption.HTML)
-                    )
-                else:
-                    media_grouped_list.append(InputMediaAudio(_.audio.file_id))
-            elif _.document:
-                if _.caption:
-                    if _.document.thumbs:
-                        media_grouped_list.append(
-                            InputMediaDocument(
-                                _.document.file_id,
-                                _.document.thumbs[0].file_id,
-                                _.caption.HTML,
-                            )
-                        )
-                    else:
-                        media_grouped_list.append(
-                            InputMediaDocument(_.document.file_id, _.caption.HTML)
-                        )
-                elif _.document.thumbs:
-                    media_grouped_list.append(
-                        InputMediaDocument(
-                            _.document.file_id, _.document.thumbs[0].file_id
-                        )
-                    )
-                else:
-                    media_grouped_list.append(InputMediaDocument(_.document.file_id))
-        await client.send_media_group(
-            message.chat.id, media_grouped_list, reply_to_message_id=message.id
-        )
-    else:
-        await client.copy_message(
+        await send_stored_message(
+            client,
             message.chat.id,
-            int(value["CHAT_ID"]),
-            int(value["MESSAGE_ID"]),
+            message.filter_value,
             reply_to_message_id=message.id,
         )
+    except errors.RPCError as exc:
+        raise ContinuePropagation from exc
     raise ContinuePropagation
 
 
 @Client.on_message(filters.command(["filter"], prefix) & filters.me)
 async def filter_handler(client: Client, message: Message):
     try:
-        if len(message.text.split()) < 2:
+        args = message.text.split(maxsplit=1)[1:]
+        match = MATCH_EXACT
+        if args and args[0].split(maxsplit=1)[0] in MATCH_FLAGS:
+            flag, *args = args[0].split(maxsplit=1)
+            match = MATCH_FLAGS[flag]
+        if not args:
             return await message.edit(
-                f"<b>Usage</b>: <code>{prefix}filter [name] (Reply required)</code>"
+                f"<b>Usage</b>: <code>{prefix}filter [-c|-w] [name] (Reply required)</code>"
             )
-        name = message.text.split(maxsplit=1)[1].lower()
+        name = args[0].lower()
         chat_filters = get_filters_chat(message.chat.id)
         if name in chat_filters.keys():
             return await message.edit(
@@ -174,6 +168,7 @@ async def filter_handler(client: Client, message: Message):
                 "MESSAGE_ID": str(message_id[1].id),
                 "MEDIA_GROUP": True,
                 "CHAT_ID": str(chat_id),
+                "MATCH": match,
             }
         else:
             try:
@@ -184,6 +179,7 @@ async def filter_handler(client: Client, message: Message):
                 "MEDIA_GROUP": False,
                 "MESSAGE_ID": str(message_id.id),
                 "CHAT_ID": str(chat_id),
+                "MATCH": match,
             }
 
         chat_filters.update({name: filter_})
@@ -201,9 +197,11 @@ async def filters_handler(_, message: Message):
     try:
         text = ""
         for index, a in enumerate(get_filters_chat(message.chat.id).items(), start=1):
-            key, _ = a
+            key, value = a
             key = key.replace("<", "").replace(">", "")
-            text += f"{index}. <code>{key}</code>\n"
+            match = value.get("MATCH", MATCH_EXACT)
+            mode = "" if match == MATCH_EXACT else f" ({match})"
+            text += f"{index}. <code>{key}</code>{mode}\n"
         text = f"<b>Your filters in current chat</b>:\n\n" f"{text}"
         text = text[:4096]
         return await message.edit(text)
@@ -257,7 +255,8 @@ async def filter_search_handler(_, message: Message):
 
 
 modules_help["filters"] = {
-    "filter [name]": "Create filter (Reply required)",
+    "filter [-c|-w] [name]": "Create filter (Reply required). By default the whole "
+    "message must match, -c matches it anywhere in a message, -w as a whole word",
     "filters": "List of all triggers",
     "fdel [name]": "Delete filter by name",
     "fsearch [name]": "Info filter by name",
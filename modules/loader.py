@@ -6,7 +6,8 @@ import requests
 from pyrogram import Client, filters
 from pyrogram.types import Message
 from utils.misc import modules_help, prefix
-from utils.scripts import restart
+from utils.reload import reload_modules, restart_seconds, unload
+from utils.scripts import format_exc
 from utils.db import db
 
 
@@ -29,8 +30,18 @@ CATEGORIES = [
 ]
 
 
+def reload_report(timings, errors):
+    text = f"Reloaded {len(timings)} modules in {sum(timings.values()):.2f}s"
+    restart_time = restart_seconds()
+    if restart_time:
+        text += f" instead of a ~{restart_time:.1f}s restart"
+    if errors:
+        text += "\nFailed: " + ", ".join(f"<code>{name}</code>" for name in errors)
+    return text
+
+
 @Client.on_message(filters.command(["loadmod", "lm"], prefix) & filters.me)
-async def loadmod(_, message: Message):
+async def loadmod(client: Client, message: Message):
     if (
         not (
             message.reply_to_message
@@ -99,24 +110,18 @@ async def loadmod(_, message: Message):
     if module_name not in all_modules:
         all_modules.append(module_name)
         db.set("custom.modules", "allModules", all_modules)
+
+    await message.edit(f"<b>Loading <code>{module_name}</code>...</b>")
+    timings, errors = await reload_modules(client, [module_name])
+    if module_name in errors:
+        return await message.edit(format_exc(errors[module_name]))
     await message.edit(
-        f"<b>The module <code>{module_name}</code> is loaded!\nRestarting...</b>"
+        f"<b>The module <code>{module_name}</code> is loaded!\n{reload_report(timings, errors)}</b>"
     )
-    db.set(
-        "core.updater",
-        "restart_info",
-        {
-            "type": "restart",
-            "chat_id": message.chat.id,
-            "message_id": message.id,
-        },
-    )
-    restart()
-
 
 
 @Client.on_message(filters.command(["unloadmod", "ulm"], prefix) & filters.me)
-async def unload_mods(_, message: Message):
+async def unload_mods(client: Client, message: Message):
     if len(message.command) <= 1:
         return
 
@@ -128,6 +133,7 @@ async def unload_mods(_, message: Message):
         module_name = module_name.split("/")[-1].split(".")[0]
 
     if os.path.exists(f"{BASE_PATH}/modules/custom_modules/{module_name}.py"):
+        unload(client, module_name)
         os.remove(f"{BASE_PATH}/modules/custom_modules/{module_name}.py")
         if module_name == "musicbot":
             subprocess.run(
@@ -139,19 +145,7 @@ async def unload_mods(_, message: Message):
         if module_name in all_modules:
             all_modules.remove(module_name)
             db.set("custom.modules", "allModules", all_modules)
-        await message.edit(
-            f"<b>The module <code>{module_name}</code> removed!\nRestarting...</b>"
-        )
-        db.set(
-            "core.updater",
-            "restart_info",
-            {
-                "type": "restart",
-                "chat_id": message.chat.id,
-                "message_id": message.id,
-            },
-        )
-        restart()
+        await message.edit(f"<b>The module <code>{module_name}</code> removed!</b>")
     elif os.path.exists(f"{BASE_PATH}/modules/{module_name}.py"):
         await message.edit(
             "<b>It is forbidden to remove built-in modules, it will disrupt the updater</b>"
@@ -161,7 +155,7 @@ async def unload_mods(_, message: Message):
 
 
 @Client.on_message(filters.command(["loadallmods", "lmall"], prefix) & filters.me)
-async def load_all_mods(_, message: Message):
+async def load_all_mods(client: Client, message: Message):
     await message.edit("<b>Fetching info...</b>")
 
     if not os.path.exists(f"{BASE_PATH}/modules/custom_modules"):
@@ -176,6 +170,7 @@ async def load_all_mods(_, message: Message):
     modules_list = f.splitlines()
 
     await message.edit("<b>Loading modules...</b>")
+    downloaded = []
     for module_name in modules_list:
         url = f"https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/{module_name}.py"
         resp = requests.get(url)
@@ -185,46 +180,30 @@ async def load_all_mods(_, message: Message):
             f"./modules/custom_modules/{module_name.split('/')[1]}.py", "wb"
         ) as f:
             f.write(resp.content)
+        downloaded.append(module_name.split("/")[1])
 
+    timings, errors = await reload_modules(client, downloaded)
     await message.edit(
-        f"<b>Successfully loaded new modules: {len(modules_list)}\nRestarting...</b>",
-    )
-    db.set(
-        "core.updater",
-        "restart_info",
-        {
-            "type": "restart",
-            "chat_id": message.chat.id,
-            "message_id": message.id,
-        },
+        f"<b>Successfully loaded new modules: {len(downloaded)}\n{reload_report(timings, errors)}</b>",
     )
-    restart()
 
 
 @Client.on_message(filters.command(["unloadallmods", "ulmall"], prefix) & filters.me)
-async def unload_all_mods(_, message: Message):
+async def unload_all_mods(client: Client, message: Message):
     await message.edit("<b>Fetching info...</b>")
 
     if not os.path.exists(f"{BASE_PATH}/modules/custom_modules"):
         return await message.edit("<b>You don't have any modules installed</b>")
+    for file_name in os.listdir(f"{BASE_PATH}/modules/custom_modules"):
+        if file_name.endswith(".py"):
+            unload(client, file_name[:-3])
     shutil.rmtree(f"{BASE_PATH}/modules/custom_modules")
     db.set("custom.modules", "allModules", [])
-    await message.edit("<b>Successfully unloaded all modules!\nRestarting...</b>")
-
-    db.set(
-        "core.updater",
-        "restart_info",
-        {
-            "type": "restart",
-            "chat_id": message.chat.id,
-            "message_id": message.id,
-        },
-    )
-    restart()
+    await message.edit("<b>Successfully unloaded all modules!</b>")
 
 
 @Client.on_message(filters.command(["updateallmods"], prefix) & filters.me)
-async def updateallmods(_, message: Message):
+async def updateallmods(client: Client, message: Message):
     await message.edit("<b>Updating modules...</b>")
 
     if not os.path.exists(f"{BASE_PATH}/modules/custom_modules"):
@@ -235,28 +214,34 @@ async def updateallmods(_, message: Message):
     if not modules_installed:
         return await message.edit("<b>You don't have any modules installed</b>")
 
-    for module_name in modules_installed:
-        if not module_name.endswith(".py"):
+    try:
+        f = requests.get(
+            "https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/full.txt"
+        ).text
+    except Exception:
+        return await message.edit("Failed to fetch custom modules list")
+    modules_dict = {line.split("/")[-1].split()[0]: line.strip() for line in f.splitlines()}
+
+    updated = []
+    for file_name in modules_installed:
+        module_name = file_name[:-3]
+        if not file_name.endswith(".py") or module_name not in modules_dict:
+            continue
+        resp = requests.get(
+            f"https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/{modules_dict[module_name]}.py"
+        )
+        if not resp.ok:
             continue
-        try:
-            f = requests.get(
-                "https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/full.txt"
-            ).text
-        except Exception:
-            return await message.edit("Failed to fetch custom modules list")
-        modules_dict = {line.split("/")[-1].split()[0]: line.strip() for line in f.splitlines()}
-        if module_name in modules_dict:
-            resp = requests.get(
-                f"https://raw.githubusercontent.com/The-MoonTg-project/custom_modules/main/{modules_dict[module_name]}.py"
-            )
-            if not resp.ok:
-                modules_installed.remove(module_name)
-                continue
 
-            with open(f"./modules/custom_modules/{module_name}", "wb") as f:
-                f.write(resp.content)
+        with open(f"./modules/custom_modules/{file_name}", "wb") as f:
+            f.write(resp.content)
+        updated.append(module_name)
 
-    await message.edit(f"<b>Successfully updated {len(modules_installed)} modules</b>")
+    # only modules whose code changed are reloaded
+    timings, errors = await reload_modules(client, updated)
+    await message.edit(
+        f"<b>Successfully updated {len(updated)} modules\n{reload_report(timings, errors)}</b>"
+    )
 
 
 modules_help["loader"] = {
@@ -31,6 +31,18 @@ from utils.db import db
 from utils.misc import modules_help, prefix
 
 auth_hashes = db.get("core.sessionkiller", "auths_hashes", [])
+sessionkiller_enabled = db.get("core.sessionkiller", "enabled", False)
+
+
+def on_settings_change(_, variable, value):
+    global auth_hashes, sessionkiller_enabled
+    if variable == "auths_hashes":
+        auth_hashes = value or []
+    elif variable == "enabled":
+        sessionkiller_enabled = bool(value)
+
+
+db.subscribe(on_settings_change, "core.sessionkiller")
 
 
 @Client.on_message(filters.command(["sessions"], prefix) & filters.me)
@@ -100,7 +112,7 @@ async def check_new_login(client: Client, update: UpdateServiceNotification, _,
         "auth"
     ):
         raise ContinuePropagation
-    if not db.get("core.sessionkiller", "enabled", False):
+    if not sessionkiller_enabled:
         raise ContinuePropagation
     authorizations = (await client.invoke(GetAuthorizations()))["authorizations"]
     for auth in authorizations:
@@ -0,0 +1,48 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from utils.misc import modules_help, prefix
+
+
+@Client.on_message(filters.command(["shards"], prefix) & filters.me)
+async def shards(client: Client, message: Message):
+    if not hasattr(client.dispatcher, "stats"):
+        return await message.edit("<b>Update sharding is not enabled</b>")
+
+    if len(message.command) > 1 and message.command[1].lower() == "reset":
+        client.dispatcher.reset_stats()
+        return await message.edit("<b>Shard stats have been reset</b>")
+
+    text = "<b>Update shards:</b>\n"
+    for stats in client.dispatcher.stats():
+        text += (
+            f"\n<code>#{stats['shard']}</code>: "
+            f"depth {stats['depth']} (max {stats['max_depth']}), "
+            f"{stats['processed']} processed, "
+            f"wait {stats['avg_wait_ms']} ms avg / {stats['max_wait_ms']} ms max"
+        )
+        if stats["busy_ms"]:
+            text += f", busy for {stats['busy_ms']} ms"
+    await message.edit(text)
+
+
+modules_help["shards"] = {
+    "shards": "Show queue depth and wait time of every update shard",
+    "shards reset": "Reset update shard stats",
+}
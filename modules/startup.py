@@ -0,0 +1,83 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import statistics
+import time
+
+from pyrogram import Client, filters
+from pyrogram.types import Message
+
+from utils.db import db
+from utils.misc import modules_help, prefix
+
+TOP_MODULES = 10
+
+
+def _change(seconds: float, previous: list) -> str:
+    if not previous:
+        return ""
+    usual = statistics.median(previous)
+    return f" ({seconds - usual:+.2f}s)"
+
+
+@Client.on_message(filters.command(["startup"], prefix) & filters.me)
+async def startup_report(_, message: Message):
+    action = message.command[1].lower() if len(message.command) > 1 else ""
+    history = db.get("core.startup", "history", [])
+
+    if not history:
+        return await message.edit("<b>No startup recorded yet</b>")
+
+    if action == "history":
+        text = "<b>Last startups:</b>\n"
+        for run in reversed(history):
+            at = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["at"]))
+            text += f"\n{at}: {run['total']:.2f}s"
+            if run["regressions"]:
+                text += f", {len(run['regressions'])} regressions"
+        return await message.edit(text)
+
+    run, previous = history[-1], history[:-1]
+    at = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["at"]))
+    text = (
+        f"<b>Startup at {at} took {run['total']:.2f}s</b>"
+        f"{_change(run['total'], [r['total'] for r in previous])}\n"
+    )
+
+    text += "\n<b>Phases:</b>"
+    for name, seconds in run["phases"].items():
+        usual = [r["phases"][name] for r in previous if name in r["phases"]]
+        text += f"\n<code>{name}</code>: {seconds:.2f}s{_change(seconds, usual)}"
+
+    if run["modules"]:
+        text += f"\n\n<b>Slowest of {len(run['modules'])} module imports:</b>"
+        slowest = sorted(run["modules"].items(), key=lambda item: -item[1])
+        for name, seconds in slowest[:TOP_MODULES]:
+            usual = [r["modules"][name] for r in previous if name in r["modules"]]
+            text += f"\n<code>{name}</code>: {seconds:.2f}s{_change(seconds, usual)}"
+
+    if run["regressions"]:
+        text += "\n\n<b>Regressions against previous startups:</b>"
+        for name, seconds, usual in run["regressions"]:
+            text += f"\n<code>{name}</code>: {seconds:.2f}s, usually {usual:.2f}s"
+
+    await message.edit(text)
+
+
+modules_help["startup"] = {
+    "startup": "Show how long the last startup took, per phase and module import",
+    "startup history": "Show the duration of the last startups",
+}
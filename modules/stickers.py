@@ -26,6 +26,7 @@ from utils.scripts import (
     interact_with_to_delete,
     format_exc,
     resize_image,
+    scheduler,
 )
 
 
@@ -102,7 +103,7 @@ async def kang(client: Client, message: types.Message):
                 "@stickers", "/done", parse_mode=enums.ParseMode.MARKDOWN
             )
         )
-        await client.delete_messages("@stickers", interact_with_to_delete)
+        scheduler.delete_later("@stickers", interact_with_to_delete, 0)
         await message.edit(
             f"<b>Sticker added to <a href=https://t.me/addstickers/{pack}>pack</a></b>",
         )
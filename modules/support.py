@@ -16,10 +16,13 @@
 
 from pyrogram import Client, filters
 from pyrogram.types import Message
+import asyncio
+import logging
 import random
 import datetime
 
-from utils.misc import modules_help, prefix, userbot_version, python_version, gitrepo
+from utils.buildinfo import read_build_info, refresh_build_info
+from utils.misc import modules_help, prefix, python_version, build_info
 
 
 @Client.on_message(filters.command(["support", "repo"], prefix) & filters.me)
@@ -51,6 +54,18 @@ async def support(_, message: Message):
 
 @Client.on_message(filters.command(["version", "ver"], prefix) & filters.me)
 async def version(client: Client, message: Message):
+    info = build_info
+    if info["stale"]:
+        from git.exc import GitError
+
+        try:
+            info.update(await asyncio.to_thread(refresh_build_info))
+        except (GitError, OSError, ValueError) as e:
+            # no usable repository, show what was saved last time
+            logging.warning("Can't read build info from git: %s", e)
+            info = read_build_info() or info
+    userbot_version = info["version"]
+
     changelog = ""
     ub_version = ".".join(userbot_version.split(".")[:2])
     async for m in client.search_messages("moonuserbot", query=f"{userbot_version}."):
@@ -59,12 +74,22 @@ async def version(client: Client, message: Message):
 
     await message.delete()
 
-    remote_url = list(gitrepo.remote().urls)[0]
-    commit_time = (
-        datetime.datetime.fromtimestamp(gitrepo.head.commit.committed_date)
-        .astimezone(datetime.timezone.utc)
-        .strftime("%Y-%m-%d %H:%M:%S %Z")
-    )
+    remote_url = info["remote_url"]
+    commit = ""
+    if info.get("head"):
+        commit = (
+            f"Commit: <a href={remote_url}/commit/{info['head']}>"
+            f"{info['head'][:7]}</a>"
+        )
+        if info.get("author"):
+            commit += f" by {info['author']}"
+        commit += "\n"
+    if info.get("committed_date"):
+        commit += "Commit time: " + (
+            datetime.datetime.fromtimestamp(info["committed_date"])
+            .astimezone(datetime.timezone.utc)
+            .strftime("%Y-%m-%d %H:%M:%S %Z")
+        )
 
     await message.reply(
         f"<b>Moon Userbot version: {userbot_version}\n"
@@ -72,13 +97,11 @@ async def version(client: Client, message: Message):
         f"Changelog written by </b><i>"
         f"<a href=https://t.me/Qbtaumai>Abhi</a></i>\n\n"
         + (
-            f"<b>Branch: <a href={remote_url}/tree/{gitrepo.active_branch}>{gitrepo.active_branch}</a>\n"
-            if gitrepo.active_branch != "master"
+            f"<b>Branch: <a href={remote_url}/tree/{info['branch']}>{info['branch']}</a>\n"
+            if info.get("branch") not in ("master", None)
             else ""
         )
-        + f"Commit: <a href={remote_url}/commit/{gitrepo.head.commit.hexsha}>"
-        f"{gitrepo.head.commit.hexsha[:7]}</a> by {gitrepo.head.commit.author.name}\n"
-        f"Commit time: {commit_time}</b>",
+        + f"{commit}</b>",
     )
 
 
@@ -22,6 +22,7 @@ import subprocess
 from pyrogram import Client, filters
 from pyrogram.types import Message
 
+from utils.buildinfo import ensure_repo, refresh_build_info
 from utils.misc import modules_help, prefix, requirements_list
 from utils.db import db
 from utils.scripts import format_exc, restart
@@ -77,7 +78,9 @@ async def update(_, message: Message):
             subprocess.run(
                 [sys.executable, "-m", "pip", "install", "-U", "pip"], check=True
             )
+        ensure_repo()
         subprocess.run(["git", "pull"], check=True)
+        refresh_build_info()
 
         if (
             os.path.exists("requirements.txt")
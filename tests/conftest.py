@@ -0,0 +1,36 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+# utils.config reads these at import, the tests never touch the real database
+os.environ["DATABASE_TYPE"] = "sqlite"
+os.environ["DATABASE_NAME"] = os.path.join(
+    tempfile.mkdtemp(prefix="moon-tests-"), "db.sqlite3"
+)
+for key, value in {
+    "API_ID": "1",
+    "API_HASH": "test",
+    "STRINGSESSION": "",
+    "APIFLASH_KEY": "",
+}.items():
+    os.environ.setdefault(key, value)
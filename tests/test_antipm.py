@@ -0,0 +1,135 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from modules import antipm
+from utils import handlers
+from utils.db import db
+from utils.handlers import TokenBucket
+
+
+class Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(handlers.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def wall_clock(monkeypatch):
+    clock = Clock(1_700_000_000.0)
+    monkeypatch.setattr(antipm.time, "time", clock)
+    return clock
+
+
+def test_token_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_token_bucket_never_exceeds_capacity(clock):
+    bucket = TokenBucket(rate=10, capacity=2)
+    clock.now += 3600
+    assert [bucket.try_acquire() for _ in range(3)] == [True, True, False]
+
+
+def test_token_bucket_pause_drains_it(clock):
+    bucket = TokenBucket(rate=1, capacity=5)
+    bucket.pause(30)
+    clock.now += 29
+    assert not bucket.try_acquire()
+    clock.now += 2
+    assert bucket.try_acquire()
+
+
+def test_token_bucket_acquire_waits_for_a_token(clock, monkeypatch):
+    slept = []
+
+    async def sleep(seconds):
+        slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(handlers.asyncio, "sleep", sleep)
+    bucket = TokenBucket(rate=4, capacity=1)
+
+    async def take(times):
+        for _ in range(times):
+            await bucket.acquire()
+
+    asyncio.run(take(3))
+    assert slept == pytest.approx([0.25, 0.25])
+
+
+def test_warnings_decay_by_one_per_ttl(wall_clock):
+    counter = antipm.WarningCounter(ttl=60)
+    assert [counter.increment(1) for _ in range(3)] == [1, 2, 3]
+    wall_clock.now += 61
+    assert counter.get(1) == 2
+    assert counter.increment(1) == 3
+    counter.reset(1)
+    assert counter.get(1) == 0
+
+
+def test_decayed_warnings_are_removed(wall_clock):
+    counter = antipm.WarningCounter(ttl=60)
+    counter.increment(2)
+    counter.increment(2)
+    wall_clock.now += 150
+    assert counter.get(2) == 0
+    assert db.get("core.antipm", "warns2") is None
+    assert counter.increment(2) == 1
+
+
+class AntiPMClient:
+    def __init__(self):
+        self.blocked = []
+
+    async def resolve_peer(self, user_id):
+        raise KeyError(user_id)
+
+    async def block_user(self, user_id):
+        self.blocked.append(user_id)
+
+
+def test_failed_actions_leave_the_queue_and_blocks_are_forgotten():
+    actions = antipm.AntiPMActions(rate=1000, burst=10)
+    client = AntiPMClient()
+
+    async def run():
+        actions.submit(client, "report", 5)
+        actions.submit(client, "block", 5)
+        assert 5 in actions.blocking
+        await actions.task
+
+    asyncio.run(run())
+    assert client.blocked == [5]
+    assert actions.queued == set()
+    # once blocked, a new message from them means they were unblocked
+    assert actions.blocking == set()
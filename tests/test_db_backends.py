@@ -0,0 +1,168 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+
+from utils import db as dbmod
+from utils.db import KeyValueDatabase, MongoDatabase, SqliteDatabase
+
+BACKENDS = ["sqlite", "lmdb", "dbm", "mongo"]
+
+VALUES = [
+    True,
+    False,
+    0,
+    -42,
+    "text",
+    "",
+    1.5,
+    None,
+    [1, "two", 3.0],
+    {"a": {"b": [1, 2]}, "c": None},
+    {1: "one", 2: "two"},
+    [2**70],
+    {"filters": {"hi": {"type": "text", "text": "hello"}}},
+]
+
+# BSON needs str keys and 64-bit ints, Mongo keeps documents as they are
+MONGO_UNSUPPORTED = {repr({1: "one", 2: "two"}), repr([2**70])}
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, tmp_path):
+    kind = request.param
+    if kind == "sqlite":
+        database = SqliteDatabase(str(tmp_path / "db.sqlite3"))
+    elif kind == "lmdb":
+        if dbmod.lmdb is None:
+            pytest.skip("lmdb is not installed")
+        database = KeyValueDatabase(str(tmp_path / "db.lmdb"), "lmdb")
+    elif kind == "dbm":
+        database = KeyValueDatabase(str(tmp_path / "db.dbm"), "dbm")
+    else:
+        mongomock = pytest.importorskip("mongomock")
+        with mongomock.patch(servers=(("localhost", 27017),)):
+            database = MongoDatabase("mongodb://localhost", f"test{id(tmp_path)}")
+    database.kind = kind
+    yield database
+    database.close()
+
+
+@pytest.mark.parametrize("value", VALUES, ids=repr)
+def test_round_trip_matches_sqlite(backend, value, tmp_path):
+    if backend.kind == "mongo" and repr(value) in MONGO_UNSUPPORTED:
+        pytest.skip("not representable in BSON")
+    reference = SqliteDatabase(str(tmp_path / "reference.sqlite3"))
+    reference.set("core.test", "value", value)
+    expected = reference.get("core.test", "value")
+    reference.close()
+
+    backend.set("core.test", "value", value)
+    result = backend.get("core.test", "value")
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+def test_int_dict_keys_become_strings(backend):
+    if backend.kind == "mongo":
+        pytest.skip("not representable in BSON")
+    backend.set("core.test", "map", {1: "one"})
+    assert backend.get("core.test", "map") == {"1": "one"}
+
+
+def test_get_set_remove(backend):
+    assert backend.get("core.test", "missing", "default") == "default"
+    backend.set("core.test", "key", {"a": 1})
+    assert backend.get("core.test", "key") == {"a": 1}
+    backend.remove("core.test", "key")
+    assert backend.get("core.test", "key") is None
+
+
+def test_returned_values_are_copies(backend):
+    backend.set("core.test", "list", [1, 2])
+    backend.get("core.test", "list").append(3)
+    assert backend.get("core.test", "list") == [1, 2]
+
+
+def test_many_and_collection(backend):
+    if backend.kind == "mongo":
+        pytest.skip("mongomock lags behind pymongo's bulk_write operations")
+    backend.set_many("custom.test", {"a": 1, "b": [2], "c": "3"})
+    backend.set("custom.other", "a", 0)
+    assert backend.get_many("custom.test", ["a", "c", "x"], "-") == {
+        "a": 1,
+        "c": "3",
+        "x": "-",
+    }
+    assert backend.get_collection("custom.test") == {"a": 1, "b": [2], "c": "3"}
+
+
+def test_history(backend):
+    for i in range(5):
+        backend.append_history("custom.chat/1", {"n": i}, limit=3)
+    backend.append_history("custom.chat/2", {"n": 9}, limit=3)
+    assert backend.get_history("custom.chat/1") == [{"n": 2}, {"n": 3}, {"n": 4}]
+    assert backend.get_history("custom.chat/1", limit=2) == [{"n": 3}, {"n": 4}]
+    backend.clear_history("custom.chat/1")
+    assert backend.get_history("custom.chat/1") == []
+    assert backend.get_history("custom.chat/2") == [{"n": 9}]
+
+
+def test_change_events(backend):
+    changes = []
+    backend.subscribe(lambda *change: changes.append(change), "core.test")
+    backend.set("core.test", "a", 1)
+    backend.remove("core.test", "a")
+    assert changes == [("core.test", "a", 1), ("core.test", "a", None)]
+
+
+def test_slow_async_query_names_the_awaiting_caller(backend):
+    backend.metrics.slow_query_ms = 0
+    asyncio.run(backend.aset("core.test", "a", 1))
+    assert backend.metrics.snapshot()["slow_queries"][-1]["caller"].startswith(
+        __name__ + ":"
+    )
+
+
+def test_mongo_change_stream_skips_own_writes():
+    mongomock = pytest.importorskip("mongomock")
+    with mongomock.patch(servers=(("localhost", 27017),)):
+        database = MongoDatabase("mongodb://localhost", "test_echo")
+    # what change_streams=True enables, without the watch thread
+    database._watching = True
+    changes = []
+    database.subscribe(lambda *change: changes.append(change), "core.test")
+    ns = {"coll": "core.test"}
+
+    database.set("core.test", "a", 1)
+    document = database._database["core.test"].find_one({"var": "a"})
+    key = {"_id": document["_id"]}
+    database._changed({"ns": ns, "fullDocument": document, "documentKey": key})
+    other = {**document, "val": 2, "src": "another process"}
+    database._changed({"ns": ns, "fullDocument": other, "documentKey": key})
+    database.remove("core.test", "a")
+    database._changed({"ns": ns, "documentKey": key})
+    database._changed({"ns": ns, "documentKey": {"_id": "another process"}})
+    database.close()
+
+    assert changes == [
+        ("core.test", "a", 1),
+        ("core.test", "a", 2),
+        ("core.test", "a", None),
+        ("core.test", None, None),
+    ]
@@ -0,0 +1,51 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from pyrogram import raw
+
+from utils.dispatcher import ShardedDispatcher
+
+
+def channel_message(channel_id: int):
+    message = raw.types.Message(
+        id=1, peer_id=raw.types.PeerChannel(channel_id=channel_id), date=0, message=""
+    )
+    return raw.types.UpdateNewChannelMessage(message=message, pts=1, pts_count=1)
+
+
+def test_channel_updates_share_a_key_with_its_messages():
+    key = ShardedDispatcher.shard_key(channel_message(1234))
+    assert key == -1000000001234
+    assert (
+        ShardedDispatcher.shard_key(raw.types.UpdateChannelTooLong(channel_id=1234))
+        == key
+    )
+
+
+def test_basic_group_and_user_keys_do_not_collide():
+    chat = raw.types.UpdateChatParticipantAdd(
+        chat_id=42, user_id=7, inviter_id=7, date=0, version=1
+    )
+    assert ShardedDispatcher.shard_key(chat) == -42
+    assert (
+        ShardedDispatcher.shard_key(
+            raw.types.UpdateUserTyping(
+                user_id=42, action=raw.types.SendMessageTypingAction()
+            )
+        )
+        == 42
+    )
+    assert ShardedDispatcher.shard_key(raw.types.UpdateDcOptions(dc_options=[])) is None
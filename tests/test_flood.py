@@ -0,0 +1,164 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+import pytest
+from pyrogram.types import Message
+
+from utils.handlers import (
+    FloodDetector,
+    ModerationExecutor,
+    RingWindow,
+    content_hash,
+    flood_limits,
+)
+
+SPAM = "join my channel for free crypto"
+
+
+def test_ring_window_reports_age_of_oldest_event():
+    ring = RingWindow(3)
+    assert ring.push(0.0, 1, 10) == float("inf")
+    assert ring.push(1.0, 2, 11) == float("inf")
+    # full: three events within 2 seconds
+    assert ring.push(2.0, 3, 12) == 2.0
+    # the one at 0.0 is dropped, the oldest kept is the one at 1.0
+    assert ring.push(5.0, 4, 13) == 4.0
+    assert ring.last == 5.0
+
+
+def test_ring_window_recent_and_clear():
+    ring = RingWindow(4)
+    for i, now in enumerate((0.0, 5.0, 9.0, 10.0)):
+        ring.push(now, i, 100 + i)
+    assert sorted(ring.recent(10.0, 2.0)) == [(2, 102), (3, 103)]
+    ring.clear()
+    assert ring.recent(10.0, 100.0) == []
+
+
+def test_content_hash_ignores_short_texts():
+    assert content_hash(Message(id=1, text="ok")) is None
+    assert content_hash(Message(id=1, text="  +  ")) is None
+    assert content_hash(Message(id=1, text=SPAM)) == content_hash(
+        Message(id=2, text=SPAM.upper().replace(" ", "   "))
+    )
+
+
+def test_message_flood_from_one_user():
+    detector = FloodDetector()
+    limits = flood_limits({"messages": (3, 5)})
+    assert detector.message(1, 7, 1, None, limits, now=0.0) is None
+    assert detector.message(1, 7, 2, None, limits, now=1.0) is None
+    verdict = detector.message(1, 7, 3, None, limits, now=2.0)
+    assert verdict.reason == "flood"
+    assert verdict.users == {7}
+    assert verdict.messages == {1, 2, 3}
+
+
+def test_slow_messages_are_not_flood():
+    detector = FloodDetector()
+    limits = flood_limits({"messages": (3, 5)})
+    for i in range(10):
+        assert detector.message(1, 7, i, None, limits, now=i * 3.0) is None
+
+
+def test_same_text_from_different_users_is_not_flagged():
+    detector = FloodDetector()
+    limits = flood_limits()
+    content = content_hash(Message(id=1, text=SPAM))
+    for user_id in range(20):
+        now = user_id * 0.5
+        assert detector.message(1, user_id, user_id, content, limits, now) is None
+
+
+def test_repeated_text_from_one_user():
+    detector = FloodDetector()
+    limits = flood_limits({"duplicates": (3, 30)})
+    content = content_hash(Message(id=1, text=SPAM))
+    # spaced out so the message window doesn't trigger first
+    assert detector.message(1, 7, 1, content, limits, now=0.0) is None
+    assert detector.message(1, 8, 2, content, limits, now=1.0) is None
+    assert detector.message(1, 7, 3, content, limits, now=10.0) is None
+    verdict = detector.message(1, 7, 4, content, limits, now=20.0)
+    assert verdict.reason == "duplicates"
+    assert verdict.users == {7}
+    assert verdict.messages == {1, 3, 4}
+
+
+def test_join_raid_bans_everyone_until_it_ends():
+    detector = FloodDetector()
+    limits = flood_limits({"joins": (3, 10), "raid_time": 60})
+    assert detector.joined(1, [1, 2], 100, limits, now=0.0) is None
+    verdict = detector.joined(1, [3], 101, limits, now=1.0)
+    assert verdict.reason == "raid" and verdict.users == {1, 2, 3}
+    assert detector.joined(1, [4], 102, limits, now=30.0).users == {4}
+    assert detector.joined(1, [5], 103, limits, now=100.0) is None
+
+
+def test_detector_memory_is_bounded():
+    detector = FloodDetector(max_chats=10, max_users=5)
+    limits = flood_limits()
+    for chat_id in range(100):
+        for user_id in range(50):
+            detector.message(chat_id, user_id, 1, None, limits, now=0.0)
+    stats = detector.stats()
+    assert stats["chats"] == 10
+    assert stats["users"] <= 50
+
+
+class ModerationClient:
+    def __init__(self):
+        self.calls = []
+
+    async def ban_chat_member(self, chat_id, user_id, *args):
+        self.calls.append(("ban", user_id))
+        return True
+
+    async def unban_chat_member(self, chat_id, user_id):
+        if user_id == 9:
+            raise ValueError("not a member")
+        self.calls.append(("unban", user_id))
+        return True
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append(("delete", list(message_ids)))
+        return len(message_ids)
+
+
+def test_cancelled_moderation_futures_do_not_stop_the_worker():
+    async def run():
+        client, executor = ModerationClient(), ModerationExecutor()
+        deleted = executor.delete(client, 1, [1, 2])
+        banned = executor.ban(client, 1, 7)
+        last = executor.ban(client, 1, 8)
+        deleted.cancel()
+        banned.cancel()
+        assert await last
+        return client.calls
+
+    assert asyncio.run(run()) == [("delete", [1, 2]), ("ban", 7), ("ban", 8)]
+
+
+def test_kick_is_a_ban_then_an_unban():
+    async def run():
+        client, executor = ModerationClient(), ModerationExecutor()
+        assert await executor.kick(client, 1, 7)
+        with pytest.raises(ValueError):
+            await executor.kick(client, 1, 9)
+        return client.calls
+
+    assert asyncio.run(run()) == [("ban", 7), ("unban", 7), ("ban", 9)]
@@ -0,0 +1,232 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import json
+from pathlib import Path
+from types import SimpleNamespace
+
+from utils import lazy
+from utils.lazy import LazyModules, build_manifest, scan_module
+from utils.misc import prefix
+
+HEADER = """
+from pyrogram import Client, filters
+
+from utils.misc import modules_help, prefix
+"""
+
+SIMPLE = "# meta requires: aiohttp lxml\n" + HEADER + """
+
+@Client.on_message(filters.command(["Ping", "p"], prefix) & filters.me)
+async def ping(_, message):
+    await message.edit("pong")
+
+
+@Client.on_message(filters.command("echo", prefix) & filters.me)
+async def echo(_, message):
+    await message.edit(message.text)
+
+
+modules_help["ping"] = {"ping": "Check the bot", f"{prefix}p": "Short"}
+"""
+
+
+def test_command_module_is_lazy():
+    manifest = scan_module(SIMPLE)
+    assert manifest["lazy"]
+    assert not manifest["registers"]
+    assert manifest["commands"] == ["ping", "p", "echo"]
+    assert manifest["public"] == []
+    assert manifest["help"] == [
+        "ping",
+        {"ping": "Check the bot", f"{prefix}p": "Short"},
+    ]
+    assert manifest["requires"] == ["aiohttp", "lxml"]
+    assert manifest["imports"] == []
+
+
+def test_commands_without_filters_me_are_public():
+    manifest = scan_module(
+        SIMPLE.replace(
+            'filters.command("echo", prefix) & filters.me',
+            'filters.command("echo", prefix) & filters.reply',
+        )
+    )
+    assert manifest["lazy"]
+    assert manifest["public"] == ["echo"]
+
+
+def text_message(text: str, own: bool):
+    return SimpleNamespace(
+        text=text,
+        caption=None,
+        from_user=SimpleNamespace(is_self=own),
+        outgoing=own,
+    )
+
+
+def test_only_accepted_commands_import_a_deferred_module(monkeypatch):
+    monkeypatch.setattr(lazy, "modules_help", {})
+    monkeypatch.setattr(lazy, "requirements_list", [])
+    modules = LazyModules()
+    manifest = scan_module(
+        SIMPLE.replace(
+            'filters.command("echo", prefix) & filters.me',
+            'filters.command("echo", prefix)',
+        )
+    )
+    modules.defer("ping", False, manifest)
+
+    def matches(text, own):
+        return asyncio.run(modules._match(None, text_message(text, own)))
+
+    assert matches(f"{prefix}ping", True)
+    assert not matches(f"{prefix}ping", False)
+    # the module's echo handler answers anyone
+    assert matches(f"{prefix}echo hi", False)
+    assert not matches(f"{prefix}unknown", True)
+    assert not matches("ping", True)
+
+
+def test_non_command_handler_is_not_lazy():
+    manifest = scan_module(HEADER + """
+@Client.on_message(filters.private & ~filters.me)
+async def watch(_, message):
+    pass
+
+
+modules_help["watch"] = {"watch": "Watch"}
+""")
+    assert not manifest["lazy"]
+    assert not manifest["registers"]
+
+
+def test_registrations_at_import_are_not_lazy():
+    pipeline_consumer = scan_module(SIMPLE + """
+@pipeline.on_message(filters.text)
+async def consumer(client, message, context):
+    pass
+""")
+    assert not pipeline_consumer["lazy"]
+    assert pipeline_consumer["registers"]
+
+    subscription = scan_module(SIMPLE + "\ndb.subscribe(on_change, 'custom.ping')\n")
+    assert not subscription["lazy"]
+    assert subscription["registers"]
+
+
+def test_dynamic_help_or_commands_are_not_lazy():
+    assert not scan_module(SIMPLE.replace('"ping": "Check', 'name(): "Check'))["lazy"]
+    assert not scan_module(SIMPLE.replace('["Ping", "p"]', "COMMANDS"))["lazy"]
+    assert not scan_module(HEADER)["lazy"]
+
+
+def test_syntax_error_is_not_lazy():
+    assert not scan_module(SIMPLE + "\ndef broken(:\n")["lazy"]
+
+
+def test_imports_of_other_modules_are_listed():
+    manifest = scan_module(
+        "import modules.custom_modules.helper\n"
+        "from modules.custom_modules import shared\n"
+        "from utils.db import db\n" + SIMPLE
+    )
+    assert manifest["imports"] == [
+        "modules.custom_modules.helper",
+        "modules.custom_modules",
+        "modules.custom_modules.shared",
+    ]
+
+
+def test_import_library_calls_are_listed():
+    manifest = scan_module(
+        "from utils.scripts import import_library\n"
+        'genai = import_library("google.generativeai", "google-generativeai")\n'
+        'psutil = import_library("psutil")\n' + SIMPLE
+    )
+    assert manifest["libraries"] == {
+        "google.generativeai": "google-generativeai",
+        "psutil": "psutil",
+    }
+    assert manifest["installs"]
+    assert not scan_module(SIMPLE)["installs"]
+
+
+def test_dynamic_import_library_call_installs():
+    manifest = scan_module(
+        "from utils.scripts import import_library\n"
+        "for name in NAMES:\n    import_library(name)\n" + SIMPLE
+    )
+    assert manifest["libraries"] == {}
+    assert manifest["installs"]
+
+
+def write(path: Path, code: str) -> Path:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(code, encoding="utf-8")
+    return path
+
+
+def test_imported_modules_are_not_lazy(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write(Path("modules/custom_modules/helper.py"), SIMPLE)
+    write(Path("modules/custom_modules/shared.py"), SIMPLE)
+    write(
+        Path("modules/custom_modules/user.py"),
+        "import modules.custom_modules.helper\n"
+        "from modules.custom_modules import shared\n" + SIMPLE,
+    )
+    manifest = build_manifest(
+        sorted(Path("modules").rglob("*.py")), str(tmp_path / "manifest.json")
+    )
+    assert manifest["modules/custom_modules/user.py"]["lazy"]
+    assert not manifest["modules/custom_modules/helper.py"]["lazy"]
+    assert not manifest["modules/custom_modules/shared.py"]["lazy"]
+
+    # the cache keeps what the file says, not the cross-module result
+    with open(tmp_path / "manifest.json", encoding="utf-8") as f:
+        cache = json.load(f)
+    assert cache["modules"]["modules/custom_modules/helper.py"]["lazy"]
+
+
+def test_manifest_cache_is_keyed_by_file_hash(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    module = write(Path("modules/ping.py"), SIMPLE)
+    cache_path = str(tmp_path / "manifest.json")
+    scans = []
+    real_scan = lazy.scan_module
+
+    def counting_scan(code):
+        scans.append(code)
+        return real_scan(code)
+
+    monkeypatch.setattr(lazy, "scan_module", counting_scan)
+    build_manifest([module], cache_path)
+    build_manifest([module], cache_path)
+    assert len(scans) == 1
+
+    write(module, SIMPLE.replace("pong", "PONG"))
+    assert build_manifest([module], cache_path)["modules/ping.py"]["lazy"]
+    assert len(scans) == 2
+
+    with open(cache_path, encoding="utf-8") as f:
+        cache = json.load(f)
+    cache["version"] = lazy.MANIFEST_VERSION - 1
+    with open(cache_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f)
+    build_manifest([module], cache_path)
+    assert len(scans) == 3
@@ -0,0 +1,141 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import logging
+from types import SimpleNamespace
+
+from pyrogram import StopPropagation
+
+from utils.db import db
+from utils.pipeline import MessagePipeline, chat_keys
+
+
+def group_message(chat_id: int = -100):
+    return SimpleNamespace(
+        chat=SimpleNamespace(id=chat_id),
+        message_thread_id=None,
+        from_user=SimpleNamespace(id=7),
+        sender_chat=None,
+    )
+
+
+def test_background_consumers_dont_block_dispatch():
+    pipeline = MessagePipeline()
+    calls = []
+
+    async def main():
+        release = asyncio.Event()
+
+        @pipeline.on_message(background=True)
+        async def slow(_, message, context):
+            await release.wait()
+            calls.append("slow")
+
+        @pipeline.on_message()
+        async def fast(_, message, context):
+            calls.append("fast")
+
+        await asyncio.wait_for(pipeline.dispatch(None, group_message()), 1)
+        assert calls == ["fast"]
+        assert len(pipeline._tasks) == 1
+        release.set()
+        await asyncio.gather(*pipeline._tasks)
+        assert calls == ["fast", "slow"]
+        assert not pipeline._tasks
+
+    asyncio.run(main())
+
+
+def test_background_consumers_keep_their_settings():
+    pipeline = MessagePipeline()
+    seen = []
+
+    async def main():
+        @pipeline.on_message(load=lambda chat_id: "en", background=True)
+        async def first(_, message, context):
+            await asyncio.sleep(0)
+            seen.append(context.settings)
+
+        @pipeline.on_message(load=lambda chat_id: "de")
+        async def second(_, message, context):
+            seen.append(context.settings)
+
+        await pipeline.dispatch(None, group_message())
+        await asyncio.gather(*pipeline._tasks)
+
+    asyncio.run(main())
+    assert seen == ["de", "en"]
+
+
+def test_background_failures_are_logged(caplog):
+    pipeline = MessagePipeline()
+
+    async def main():
+        @pipeline.on_message(background=True)
+        async def broken(_, message, context):
+            raise RuntimeError("boom")
+
+        await pipeline.dispatch(None, group_message())
+        await asyncio.gather(*pipeline._tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+
+    with caplog.at_level(logging.ERROR):
+        asyncio.run(main())
+    assert "broken failed" in caplog.text
+
+
+def test_inline_consumer_stops_propagation():
+    pipeline = MessagePipeline()
+    calls = []
+
+    @pipeline.on_message()
+    async def guard(_, message, context):
+        calls.append("guard")
+        raise StopPropagation
+
+    @pipeline.on_message(background=True)
+    async def after(_, message, context):
+        calls.append("after")
+
+    asyncio.run(pipeline.dispatch(None, group_message()))
+    assert calls == ["guard"]
+
+
+def test_watch_chat_invalidates_only_that_chat():
+    pipeline = MessagePipeline()
+    loads = []
+
+    def load(chat_id):
+        loads.append(chat_id)
+        return db.get("core.test_pipeline", f"on{chat_id}")
+
+    @pipeline.on_message(
+        load=load, watch="core.test_pipeline", watch_chat=chat_keys("on{chat_id}")
+    )
+    async def consumer(_, message, context):
+        pass
+
+    db.set("core.test_pipeline", "on-100", True)
+    for chat_id in (-100, -200, -100, -200):
+        asyncio.run(pipeline.dispatch(None, group_message(chat_id)))
+    assert loads == [-100, -200]
+
+    db.set("core.test_pipeline", "on-200", True)
+    db.set("core.test_pipeline", "unrelated", 1)
+    for chat_id in (-100, -200):
+        asyncio.run(pipeline.dispatch(None, group_message(chat_id)))
+    assert loads == [-100, -200, -200]
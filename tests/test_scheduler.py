@@ -0,0 +1,58 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+
+from pyrogram.errors import FloodWait
+
+from utils.db import db
+from utils.scripts import DeferredScheduler
+
+
+class SchedulerClient:
+    def __init__(self):
+        self.edited = []
+        self.floods = 0
+
+    async def delete_messages(self, chat_id, message_ids):
+        raise ValueError("chat is gone")
+
+    async def edit_message_text(self, chat_id, message_id, text):
+        if text == "flood":
+            self.floods += 1
+            raise FloodWait(value=0)
+        self.edited.append(text)
+
+
+def test_failed_actions_are_dropped_and_the_wheel_keeps_running():
+    async def run():
+        scheduler = DeferredScheduler(resolution=0.01)
+        client = SchedulerClient()
+        scheduler.start(client)
+        ids = [
+            scheduler.delete_later(-1001, [1, 2], 0),
+            scheduler.edit_later(-1001, 3, "flood", 0),
+            scheduler.edit_later(-1001, 4, "done", 0),
+        ]
+        await asyncio.wait_for(scheduler._task, 1)
+        later = scheduler.edit_later(-1001, 5, "later", 0)
+        await asyncio.wait_for(scheduler._task, 1)
+        return client, ids + [later]
+
+    client, ids = asyncio.run(run())
+    assert client.edited == ["done", "later"]
+    assert client.floods == 2
+    assert all(db.get("core.scheduler", action_id) is None for action_id in ids)
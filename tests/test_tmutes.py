@@ -0,0 +1,154 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from utils.db import db
+from utils.handlers import MuteHandler, TimedMutes, TimeMuteHandler, parse_duration
+
+
+@pytest.fixture(autouse=True)
+def clean_ats():
+    for variable in db.get_collection("core.ats"):
+        db.remove("core.ats", variable)
+    yield
+
+
+@pytest.mark.parametrize(
+    "argument, seconds",
+    [("30m", 1800), ("2h", 7200), ("1d12h", 129600), ("1.5h", 5400), ("1W", 604800)],
+)
+def test_parse_duration(argument, seconds):
+    assert parse_duration(argument) == seconds
+
+
+@pytest.mark.parametrize("argument", ["5", "5x", "h", "1.h", "2h-", "10mins"])
+def test_parse_duration_rejects_malformed(argument):
+    with pytest.raises(ValueError):
+        parse_duration(argument)
+
+
+def tmute_message(text, reply=False):
+    return SimpleNamespace(
+        text=text,
+        caption=None,
+        chat=SimpleNamespace(id=-100),
+        reply_to_message=SimpleNamespace(id=1) if reply else None,
+    )
+
+
+@pytest.mark.parametrize(
+    "text, reply, seconds, reason",
+    [
+        (".tmute", True, 0, ""),
+        (".tmute 2h", True, 7200, ""),
+        (".tmute 2h spam links", True, 7200, "spam links"),
+        (".tmute posted 5m of noise", True, 0, "posted 5m of noise"),
+        (".tmute @user2h", False, 0, ""),
+        (".tmute 12345 1d", False, 86400, ""),
+        (".tmute 12345 flood 3h ago", False, 0, "flood 3h ago"),
+    ],
+)
+def test_tmute_reads_only_the_duration_argument(text, reply, seconds, reason):
+    handler = TimeMuteHandler(None, tmute_message(text, reply))
+    assert handler.error is None
+    assert handler.seconds == seconds
+    assert handler.reason == reason
+
+
+def test_tmute_rejects_malformed_duration():
+    handler = TimeMuteHandler(None, tmute_message(".tmute 12345 5x spam"))
+    assert handler.error is not None
+    assert handler.seconds == 0
+
+
+@pytest.mark.parametrize(
+    "text, seconds",
+    [
+        (".mute", 0),
+        (".mute 2h", 7200),
+        (".mute @user 1d 12h", 129600),
+        (".mute @bob5m", 0),
+    ],
+)
+def test_mute_uses_the_same_duration_parser(text, seconds):
+    assert MuteHandler(None, tmute_message(text)).calculate_mute_seconds() == seconds
+
+
+def test_mute_and_unmute():
+    mutes = TimedMutes()
+    mutes.mute(-1, 10)
+    assert mutes.is_muted(-1, 10)
+    assert not mutes.is_muted(-1, 11)
+    assert mutes.expiry(-1, 10) is None
+    assert mutes.unmute(-1, 10)
+    assert not mutes.unmute(-1, 10)
+    assert not mutes.is_muted(-1, 10)
+
+
+def test_timed_mutes_expire_in_order():
+    mutes = TimedMutes()
+    now = time.time()
+    mutes.mute(-1, 10, 60)
+    mutes.mute(-1, 11, 120)
+    mutes.mute(-2, 10, 60)
+    mutes.mute(-2, 12)
+    assert mutes.expire(now + 30) == 0
+    assert mutes.expire(now + 90) == 2
+    assert mutes.users(-1) == [11]
+    assert mutes.users(-2) == [12]
+    assert mutes.expire(now + 10**6) == 1
+    assert not mutes.is_muted(-1, 11)
+    assert mutes.is_muted(-2, 12)
+
+
+def test_extending_a_mute_skips_its_stale_expiry():
+    mutes = TimedMutes()
+    now = time.time()
+    mutes.mute(-1, 10, 60)
+    mutes.mute(-1, 10, 600)
+    assert mutes.expire(now + 90) == 0
+    assert mutes.is_muted(-1, 10)
+    # muting forever drops the expiry
+    mutes.mute(-1, 10)
+    assert mutes.expire(now + 10**6) == 0
+    assert mutes.is_muted(-1, 10)
+
+
+def test_mutes_survive_a_restart():
+    mutes = TimedMutes()
+    mutes.mute(-1, 10)
+    mutes.mute(-1, 11, 3600)
+    reloaded = TimedMutes()
+    assert sorted(reloaded.users(-1)) == [10, 11]
+    assert reloaded.expiry(-1, 11) == pytest.approx(mutes.expiry(-1, 11))
+    assert reloaded.expire(time.time() + 7200) == 1
+    assert TimedMutes().users(-1) == [10]
+
+
+def test_duplicate_stored_mutes_are_counted_once():
+    now = time.time()
+    db.set("core.ats", "c-1", [10])
+    db.set("core.ats", "tmute_until-1", [[10, now + 60], [10, now + 600]])
+    mutes = TimedMutes()
+    assert mutes._timed == 1
+    assert len(mutes._heap) == 1
+    assert mutes.expiry(-1, 10) == pytest.approx(now + 600)
+    assert mutes.expire(now + 90) == 0
+    assert mutes.is_muted(-1, 10)
@@ -0,0 +1,127 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import random
+
+import pytest
+
+from utils.db import db
+from utils.triggers import MATCH_CONTAINS, MATCH_EXACT, MATCH_WORD, TriggerIndex
+
+
+@pytest.fixture(autouse=True, params=["scan", "automaton"])
+def matcher(request, monkeypatch):
+    if request.param == "automaton":
+        monkeypatch.setattr(TriggerIndex, "SCAN_LIMIT", 0)
+    return request.param
+
+
+def test_exact_triggers_ignore_case():
+    index = TriggerIndex([("Hello", MATCH_EXACT)])
+    assert index.match("hELLO") == "hello"
+    assert index.match("hello there") is None
+
+
+def test_empty_index_is_falsy():
+    assert not TriggerIndex([])
+    assert not TriggerIndex([("", MATCH_CONTAINS)])
+    assert TriggerIndex([("a", MATCH_CONTAINS)])
+
+
+def test_contains_matches_anywhere():
+    index = TriggerIndex([("cat", MATCH_CONTAINS)])
+    assert index.match("Concatenate") == "cat"
+    assert index.match("dog") is None
+
+
+def test_word_triggers_need_word_boundaries():
+    index = TriggerIndex([("cat", MATCH_WORD)])
+    assert index.match("a cat!") == "cat"
+    assert index.match("cat") == "cat"
+    assert index.match("concatenate") is None
+    assert index.match("cat_food") is None
+
+
+def test_exact_wins_over_contains():
+    index = TriggerIndex([("hi", MATCH_CONTAINS), ("hi there", MATCH_EXACT)])
+    assert index.match("hi there") == "hi there"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("she sells", "she"),
+        ("ushers", "she"),
+        ("his hers", "his"),
+        ("hershey", "hers"),
+    ],
+)
+def test_leftmost_longest_match(text, expected):
+    index = TriggerIndex(
+        (trigger, MATCH_CONTAINS) for trigger in ("he", "she", "his", "hers")
+    )
+    assert index.match(text) == expected
+
+
+def test_word_trigger_skipped_inside_word_falls_back_to_later_one():
+    index = TriggerIndex([("art", MATCH_WORD), ("part", MATCH_CONTAINS)])
+    assert index.match("smart party") == "part"
+    assert index.match("modern art") == "art"
+
+
+def test_unknown_mode_is_rejected():
+    with pytest.raises(ValueError):
+        TriggerIndex([("x", "regex")])
+
+
+def test_scan_and_automaton_agree(monkeypatch):
+    rng = random.Random(0)
+    for _ in range(200):
+        triggers = [
+            (
+                "".join(rng.choices("ab_ ", k=rng.randint(1, 4))).strip() or "a",
+                rng.choice((MATCH_CONTAINS, MATCH_WORD)),
+            )
+            for _ in range(rng.randint(1, 6))
+        ]
+        text = "".join(rng.choices("ab_ ", k=rng.randint(0, 20)))
+        monkeypatch.setattr(TriggerIndex, "SCAN_LIMIT", 128)
+        scanned = TriggerIndex(triggers).match(text)
+        monkeypatch.setattr(TriggerIndex, "SCAN_LIMIT", 0)
+        assert TriggerIndex(triggers).match(text) == scanned, (triggers, text)
+
+
+def test_filters_index_is_bounded_and_invalidated(monkeypatch):
+    from modules import filters
+
+    monkeypatch.setattr(filters, "FILTERS_INDEX_SIZE", 3)
+    filters.filters_index.clear()
+    for chat_id in range(5):
+        filters.set_filters_chat(chat_id, {f"t{chat_id}": {"MATCH": MATCH_EXACT}})
+
+    async def main():
+        for chat_id in (0, 1, 2, 0, 3, 4):
+            await filters.get_filters_index(chat_id)
+
+    asyncio.run(main())
+    # 1 and 2 were used least recently
+    assert list(filters.filters_index) == ["0", "3", "4"]
+
+    filters.set_filters_chat(3, {})
+    assert "3" not in filters.filters_index
+    db.remove("core.filters", "0")
+    assert "0" not in filters.filters_index
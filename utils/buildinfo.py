@@ -0,0 +1,158 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import logging
+import os
+from typing import Optional, Tuple
+
+BUILD_INFO_PATH = ".build_info.json"
+GIT_DIR = ".git"
+REMOTE_URL = "https://github.com/The-MoonTg-project/Moon-Userbot"
+VERSION_BASE = "2.0"
+
+
+def _git_dir() -> Optional[str]:
+    if os.path.isdir(GIT_DIR):
+        return GIT_DIR
+    # worktrees and submodules have a `gitdir: <path>` file instead
+    try:
+        with open(GIT_DIR, encoding="utf-8") as f:
+            line = f.readline().strip()
+    except OSError:
+        return None
+    if line.startswith("gitdir:"):
+        return line[len("gitdir:") :].strip()
+    return None
+
+
+def read_head() -> Tuple[Optional[str], Optional[str]]:
+    """
+    Commit and branch of HEAD, read from the files in .git. No git process, no
+    history: just HEAD and the loose or packed ref it points to.
+    """
+    git_dir = _git_dir()
+    if git_dir is None:
+        return None, None
+    try:
+        with open(os.path.join(git_dir, "HEAD"), encoding="utf-8") as f:
+            head = f.read().strip()
+    except OSError:
+        return None, None
+    if not head.startswith("ref:"):
+        # detached HEAD
+        return head, None
+
+    ref = head[len("ref:") :].strip()
+    branch = ref.removeprefix("refs/heads/")
+    try:
+        with open(os.path.join(git_dir, ref), encoding="utf-8") as f:
+            return f.read().strip(), branch
+    except OSError:
+        pass
+    try:
+        with open(os.path.join(git_dir, "packed-refs"), encoding="utf-8") as f:
+            for line in f:
+                sha, _, name = line.strip().partition(" ")
+                if name == ref:
+                    return sha, branch
+    except OSError:
+        pass
+    # a branch without commits
+    return None, branch
+
+
+def ensure_repo():
+    """Turn a checkout without .git into a clone of the upstream repository"""
+    import git
+
+    try:
+        return git.Repo(".")
+    except git.exc.InvalidGitRepositoryError:
+        repo = git.Repo.init()
+        origin = repo.create_remote("origin", REMOTE_URL)
+        origin.fetch()
+        repo.create_head("main", origin.refs.main)
+        repo.heads.main.set_tracking_branch(origin.refs.main)
+        repo.heads.main.checkout(True)
+        return git.Repo(".")
+
+
+def compute_build_info() -> dict:
+    """Version and commit details from git, walks the history since the last tag"""
+    import git
+
+    repo = git.Repo(".")
+    commit = repo.head.commit
+    if repo.tags:
+        since_tag = int(repo.git.rev_list("--count", f"{repo.tags[-1].name}..HEAD"))
+    else:
+        since_tag = 0
+    try:
+        remote_url = next(repo.remote().urls)
+    except (ValueError, StopIteration):
+        remote_url = REMOTE_URL
+    return {
+        "head": commit.hexsha,
+        "branch": None if repo.head.is_detached else repo.active_branch.name,
+        "version": f"{VERSION_BASE}.{since_tag}",
+        "author": commit.author.name,
+        "committed_date": commit.committed_date,
+        "remote_url": remote_url.removesuffix(".git"),
+    }
+
+
+def refresh_build_info(path: str = BUILD_INFO_PATH) -> dict:
+    """Recompute the build info and save it, called after the code changed"""
+    info = compute_build_info()
+    try:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(info, f)
+    except OSError:
+        logging.warning("Can't write build info %s", path)
+    info["stale"] = False
+    return info
+
+
+def read_build_info(path: str = BUILD_INFO_PATH) -> dict:
+    """Build info last saved, whatever HEAD it was computed for"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_build_info(path: str = BUILD_INFO_PATH) -> dict:
+    """
+    Build info saved for the current HEAD. When HEAD moved without the updater
+    (or there is no cache yet) the last known details are returned with
+    `stale` set, and the caller refreshes them once startup is done.
+    """
+    head, branch = read_head()
+    info = read_build_info(path)
+    if head is not None and info.get("head") == head:
+        info["stale"] = False
+        return info
+    return {
+        "head": head,
+        "branch": branch,
+        "version": info.get("version", f"{VERSION_BASE}.0"),
+        "author": None,
+        "committed_date": None,
+        "remote_url": info.get("remote_url", REMOTE_URL),
+        "stale": True,
+    }
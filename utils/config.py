@@ -17,6 +17,8 @@ second_session = os.getenv("SECOND_SESSION", env.str("SECOND_SESSION", ""))
 db_type = os.getenv("DATABASE_TYPE", env.str("DATABASE_TYPE"))
 db_url = os.getenv("DATABASE_URL", env.str("DATABASE_URL", ""))
 db_name = os.getenv("DATABASE_NAME", env.str("DATABASE_NAME"))
+db_change_streams = env.bool("DATABASE_CHANGE_STREAMS", False)
+db_slow_query_ms = int(os.getenv("DB_SLOW_QUERY_MS", env.int("DB_SLOW_QUERY_MS", 100)))
 
 apiflash_key = os.getenv("APIFLASH_KEY", env.str("APIFLASH_KEY"))
 rmbg_key = os.getenv("RMBG_KEY", env.str("RMBG_KEY", ""))
@@ -25,6 +27,12 @@ gemini_key = os.getenv("GEMINI_KEY", env.str("GEMINI_KEY", ""))
 cohere_key = os.getenv("COHERE_KEY", env.str("COHERE_KEY", ""))
 
 pm_limit = int(os.getenv("PM_LIMIT", env.int("PM_LIMIT", 4)))
+pm_warn_ttl = int(os.getenv("PM_WARN_TTL", env.int("PM_WARN_TTL", 86400)))
+chat_history_limit = int(
+    os.getenv("CHAT_HISTORY_LIMIT", env.int("CHAT_HISTORY_LIMIT", 100))
+)
+update_shards = int(os.getenv("UPDATE_SHARDS", env.int("UPDATE_SHARDS", 8)))
+lazy_modules = env.bool("LAZY_MODULES", True)
 
 test_server = bool(os.getenv("TEST_SERVER", env.bool("TEST_SERVER", False)))
 modules_repo_branch = os.getenv(
@@ -14,80 +14,570 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
 import re
+import sys
+import dbm
+import time
+import logging
 import json
+import pickle
+import struct
+import asyncio
+import functools
 import threading
 import sqlite3
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from dns import resolver
+import msgpack
 import pymongo
 from utils import config
 
+try:
+    import lmdb
+except ImportError:
+    lmdb = None
+
 resolver.default_resolver = resolver.Resolver(configure=False)
 resolver.default_resolver.nameservers = ["1.1.1.1"]
 
 
+# get() sentinel for "key is not stored"
+_ABSENT = object()
+# DatabaseCache.get() sentinel for "key is not cached"
+_MISSING = object()
+
+
+# SQLite stores every value as a (val, type) pair. Scalars keep their
+# readable encodings, everything else is written with VALUE_CODEC while
+# rows written with older tags stay decodable.
+VALUE_CODEC = "msgpack1"
+
+_DECODERS = {
+    "bool": lambda val: val == "1",
+    "int": int,
+    "str": lambda val: val,
+    "json": json.loads,
+    "msgpack1": functools.partial(msgpack.unpackb, raw=False),
+}
+
+
+def _json_keys(value):
+    """Turn dict keys into strings like json.dumps does, so both codecs agree"""
+    if isinstance(value, dict):
+        result = {}
+        for key, item in value.items():
+            if not isinstance(key, str):
+                if key is not None and not isinstance(key, (int, float)):
+                    raise TypeError(
+                        f"keys must be str, int, float, bool or None, "
+                        f"not {key.__class__.__name__}"
+                    )
+                key = json.dumps(key)
+            result[key] = _json_keys(item)
+        return result
+    if isinstance(value, (list, tuple)):
+        return [_json_keys(item) for item in value]
+    return value
+
+
+def encode_value(value) -> tuple:
+    """Encode value into a (val, type) pair"""
+    if isinstance(value, bool):
+        return "1" if value else "0", "bool"
+    if isinstance(value, str):
+        return value, "str"
+    if isinstance(value, int):
+        return str(value), "int"
+    try:
+        return msgpack.packb(_json_keys(value), use_bin_type=True), VALUE_CODEC
+    except (OverflowError, ValueError):
+        # integers wider than 64 bits
+        return json.dumps(value), "json"
+
+
+def decode_value(val, typ: str):
+    """Decode a (val, type) pair produced by encode_value()"""
+    return _DECODERS.get(typ, json.loads)(val)
+
+
+class _Frozen:
+    """Pickled snapshot of a mutable value, so cache hits return a fresh copy"""
+
+    __slots__ = ("blob",)
+
+    def __init__(self, value):
+        self.blob = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def thaw(self):
+        return pickle.loads(self.blob)
+
+
+class DatabaseCache:
+    """Bounded LRU of decoded values keyed by (module, variable)"""
+
+    _IMMUTABLE = (type(None), bool, int, float, str)
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped on every invalidation, reads that raced a write are not cached
+        self.token = 0
+
+    def get(self, module: str, variable: str):
+        key = (module, variable)
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return _MISSING
+            self._data.move_to_end(key)
+        return entry.thaw() if isinstance(entry, _Frozen) else entry
+
+    def put(self, module: str, variable: str, value, token: int):
+        if value is not _ABSENT and not isinstance(value, self._IMMUTABLE):
+            try:
+                value = _Frozen(value)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                return
+        with self._lock:
+            if token != self.token:
+                return
+            self._data[(module, variable)] = value
+            self._data.move_to_end((module, variable))
+            if len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, module: str, variable: str):
+        with self._lock:
+            self.token += 1
+            self._data.pop((module, variable), None)
+
+    def invalidate_module(self, module: str):
+        with self._lock:
+            self.token += 1
+            for key in [key for key in self._data if key[0] == module]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self.token += 1
+            self._data.clear()
+
+
+class DatabaseEvents:
+    """In-process pub/sub of (module, variable, value) changes"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self._loop = None
+
+    def subscribe(self, callback, module: str, variable: str = None):
+        """
+        Call `callback(module, variable, value)` after a key changes.
+        Without `variable` every key of `module` is watched. Removed keys are
+        reported with value None, keys removed by another process (Mongo
+        change streams) are reported with variable None.
+        Callbacks run on the event loop, coroutine functions are scheduled.
+        """
+        try:
+            self._loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        with self._lock:
+            self._subscribers.setdefault((module, variable), []).append(callback)
+
+    def unsubscribe(self, callback, module: str, variable: str = None):
+        with self._lock:
+            callbacks = self._subscribers.get((module, variable), [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    def unsubscribe_module(self, module_name: str) -> list:
+        """
+        Drop callbacks defined in a python module that is being unloaded.
+        Returns them as (callback, module, variable) to subscribe them again.
+        """
+        removed = []
+        with self._lock:
+            for (module, variable), callbacks in self._subscribers.items():
+                kept = []
+                for callback in callbacks:
+                    if getattr(callback, "__module__", None) == module_name:
+                        removed.append((callback, module, variable))
+                    else:
+                        kept.append(callback)
+                callbacks[:] = kept
+        return removed
+
+    def publish(self, module: str, variable: str, value):
+        with self._lock:
+            callbacks = list(self._subscribers.get((module, None), ()))
+            if variable is not None:
+                callbacks[:0] = self._subscribers.get((module, variable), ())
+        if not callbacks:
+            return
+
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if self._loop is None or self._loop is running or self._loop.is_closed():
+            self._deliver(callbacks, module, variable, value)
+        else:
+            # writes from executor threads are delivered on the event loop
+            self._loop.call_soon_threadsafe(
+                self._deliver, callbacks, module, variable, value
+            )
+
+    @staticmethod
+    def _deliver(callbacks, module, variable, value):
+        for callback in callbacks:
+            try:
+                if asyncio.iscoroutinefunction(callback):
+                    asyncio.ensure_future(callback(module, variable, value))
+                else:
+                    callback(module, variable, value)
+            except Exception:
+                logging.exception("Database change subscriber %r failed", callback)
+
+
+class DatabaseMetrics:
+    """Per-collection operation counters, latency histograms and slow-query log"""
+
+    # upper bounds of the latency buckets, in milliseconds
+    BUCKETS = (0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, float("inf"))
+
+    def __init__(self, slow_query_ms: float):
+        self.slow_query_ms = slow_query_ms
+        self.started = time.time()
+        self._stats = {}
+        self._slow = deque(maxlen=50)
+        self._lock = threading.Lock()
+        # caller of the coroutine an executor thread is running a query for
+        self._local = threading.local()
+
+    def record(self, operation: str, module: str, elapsed: float):
+        elapsed_ms = elapsed * 1000
+        bucket = next(i for i, bound in enumerate(self.BUCKETS) if elapsed_ms <= bound)
+        with self._lock:
+            stats = self._stats.get((module, operation))
+            if stats is None:
+                stats = self._stats[(module, operation)] = {
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "histogram": [0] * len(self.BUCKETS),
+                }
+            stats["count"] += 1
+            stats["total_ms"] += elapsed_ms
+            stats["max_ms"] = max(stats["max_ms"], elapsed_ms)
+            stats["histogram"][bucket] += 1
+
+        if elapsed_ms >= self.slow_query_ms:
+            caller = getattr(self._local, "caller", None) or self.caller(
+                sys._getframe(1)
+            )
+            with self._lock:
+                self._slow.append(
+                    {
+                        "time": time.time(),
+                        "operation": operation,
+                        "collection": module,
+                        "ms": round(elapsed_ms, 2),
+                        "caller": caller,
+                    }
+                )
+            logging.warning(
+                "Slow database %s on %s: %.1f ms (from %s)",
+                operation,
+                module,
+                elapsed_ms,
+                caller,
+            )
+
+    def on_behalf(self, caller: str, func, *args):
+        """Run func in an executor thread, slow queries blamed on `caller`"""
+        self._local.caller = caller
+        try:
+            return func(*args)
+        finally:
+            self._local.caller = None
+
+    @staticmethod
+    def caller(frame) -> str:
+        """Module and line of the first frame outside the database layer"""
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if filename != __file__ and (
+                os.sep + "asyncio" + os.sep not in filename
+                and os.sep + "concurrent" + os.sep not in filename
+                and not filename.endswith(("threading.py", "functools.py"))
+            ):
+                return f"{frame.f_globals.get('__name__')}:{frame.f_lineno}"
+            frame = frame.f_back
+        return "executor"
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            collections = {}
+            for (module, operation), stats in sorted(self._stats.items()):
+                collections.setdefault(module, {})[operation] = {
+                    **stats,
+                    "histogram": list(stats["histogram"]),
+                }
+            return {
+                "since": self.started,
+                "slow_query_ms": self.slow_query_ms,
+                "buckets_ms": [str(bound) for bound in self.BUCKETS],
+                "collections": collections,
+                "slow_queries": list(self._slow),
+            }
+
+    def reset(self):
+        with self._lock:
+            self.started = time.time()
+            self._stats.clear()
+            self._slow.clear()
+
+
+def _timed(operation: str):
+    """Record the latency of a Database method in self.metrics"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self, module, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(self, module, *args, **kwargs)
+            finally:
+                self.metrics.record(operation, module, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
 class Database:
+    _executor: ThreadPoolExecutor = None
+
+    def __init__(self):
+        self._cache = DatabaseCache()
+        self.events = DatabaseEvents()
+        self.metrics = DatabaseMetrics(config.db_slow_query_ms)
+
+    def subscribe(self, callback, module: str, variable: str = None):
+        """Call callback(module, variable, value) when a key of module changes"""
+        self.events.subscribe(callback, module, variable)
+
+    def unsubscribe(self, callback, module: str, variable: str = None):
+        """Stop calling callback on changes"""
+        self.events.unsubscribe(callback, module, variable)
+
+    @_timed("get")
     def get(self, module: str, variable: str, default=None):
         """Get value from database"""
-        raise NotImplementedError
+        value = self._cache.get(module, variable)
+        if value is _MISSING:
+            token = self._cache.token
+            value = self._get(module, variable, _ABSENT)
+            self._cache.put(module, variable, value, token)
+        return default if value is _ABSENT else value
 
+    @_timed("set")
     def set(self, module: str, variable: str, value):
         """Set key in database"""
-        raise NotImplementedError
+        try:
+            result = self._set(module, variable, value)
+        finally:
+            self._cache.invalidate(module, variable)
+        self.events.publish(module, variable, value)
+        return result
 
+    @_timed("remove")
     def remove(self, module: str, variable: str):
         """Remove key from database"""
-        raise NotImplementedError
+        try:
+            result = self._remove(module, variable)
+        finally:
+            self._cache.invalidate(module, variable)
+        self.events.publish(module, variable, None)
+        return result
 
+    @_timed("get_collection")
     def get_collection(self, module: str) -> dict:
         """Get database for selected module"""
+        return self._get_collection(module)
+
+    @_timed("get_many")
+    def get_many(self, module: str, variables: list, default=None) -> dict:
+        """Get several keys of one module at once"""
+        values = {}
+        missing = []
+        for variable in variables:
+            value = self._cache.get(module, variable)
+            if value is _MISSING:
+                missing.append(variable)
+            else:
+                values[variable] = value
+
+        if missing:
+            token = self._cache.token
+            found = self._get_many(module, missing)
+            for variable in missing:
+                value = found.get(variable, _ABSENT)
+                self._cache.put(module, variable, value, token)
+                values[variable] = value
+
+        return {
+            variable: default if values[variable] is _ABSENT else values[variable]
+            for variable in variables
+        }
+
+    @_timed("set_many")
+    def set_many(self, module: str, values: dict):
+        """Set several keys of one module at once"""
+        try:
+            result = self._set_many(module, values)
+        finally:
+            for variable in values:
+                self._cache.invalidate(module, variable)
+        for variable, value in values.items():
+            self.events.publish(module, variable, value)
+        return result
+
+    def _get(self, module: str, variable: str, default):
+        raise NotImplementedError
+
+    def _get_many(self, module: str, variables: list) -> dict:
+        found = {}
+        for variable in variables:
+            value = self._get(module, variable, _ABSENT)
+            if value is not _ABSENT:
+                found[variable] = value
+        return found
+
+    def _set_many(self, module: str, values: dict):
+        for variable, value in values.items():
+            self._set(module, variable, value)
+
+    def _set(self, module: str, variable: str, value):
+        raise NotImplementedError
+
+    def _remove(self, module: str, variable: str):
+        raise NotImplementedError
+
+    def _get_collection(self, module: str) -> dict:
+        raise NotImplementedError
+
+    def append_history(self, conversation: str, entry, limit: int = None) -> int:
+        """Append entry to conversation history, keeping only the last `limit` entries"""
+        if not isinstance(conversation, str):
+            raise ValueError("Conversation must be a string")
+        if limit is None:
+            limit = config.chat_history_limit
+        return self._append_history(conversation, entry, limit)
+
+    def get_history(self, conversation: str, limit: int = None) -> list:
+        """Get the last `limit` entries of conversation history, oldest first"""
+        if not isinstance(conversation, str):
+            raise ValueError("Conversation must be a string")
+        if limit is None:
+            limit = config.chat_history_limit
+        return self._get_history(conversation, limit)
+
+    def clear_history(self, conversation: str):
+        """Delete conversation history"""
+        if not isinstance(conversation, str):
+            raise ValueError("Conversation must be a string")
+        self._clear_history(conversation)
+
+    def migrate_history(self):
+        """Move legacy `chat_history*` JSON lists into the history store"""
+        if self.get("core.main", "history_migrated", False):
+            return
+
+        for module in self._collections():
+            if not module.startswith(("core", "custom")):
+                continue
+            for variable, value in self.get_collection(module).items():
+                if variable == "chat_history":
+                    conversation = module
+                elif variable.startswith("chat_history."):
+                    conversation = f"{module}/{variable[len('chat_history.'):]}"
+                else:
+                    continue
+                self.clear_history(conversation)
+                for entry in (value or [])[-config.chat_history_limit :]:
+                    self.append_history(conversation, entry)
+                self.remove(module, variable)
+
+        self.set("core.main", "history_migrated", True)
+
+    def _append_history(self, conversation: str, entry, limit: int) -> int:
+        raise NotImplementedError
+
+    def _get_history(self, conversation: str, limit: int) -> list:
+        raise NotImplementedError
+
+    def _clear_history(self, conversation: str):
+        raise NotImplementedError
+
+    def _collections(self) -> list:
         raise NotImplementedError
 
+    def migrate_values(self):
+        """Re-encode stored values with the current VALUE_CODEC"""
+
+    def flush(self):
+        """Write pending changes to storage"""
+
     def close(self):
         """Close the database"""
         raise NotImplementedError
 
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        # the executor thread can't see who awaits it, look the caller up here
+        caller = self.metrics.caller(sys._getframe(1))
+        return await loop.run_in_executor(
+            self._executor,
+            functools.partial(self.metrics.on_behalf, caller, func, *args),
+        )
 
-class MongoDatabase(Database):
-    def __init__(self, url, name):
-        self._client = pymongo.MongoClient(url)
-        self._database = self._client[name]
+    async def aget(self, module: str, variable: str, default=None):
+        """Get value from database without blocking the event loop"""
+        return await self._run(self.get, module, variable, default)
 
-    def set(self, module: str, variable: str, value):
-        if not isinstance(module, str) or not isinstance(variable, str):
-            raise ValueError("Module and variable must be strings")
-        self._database[module].replace_one(
-            {"var": variable}, {"var": variable, "val": value}, upsert=True
-        )
+    async def aset(self, module: str, variable: str, value):
+        """Set key in database without blocking the event loop"""
+        return await self._run(self.set, module, variable, value)
 
-    def get(self, module: str, variable: str, default=None):
-        if not isinstance(module, str) or not isinstance(variable, str):
-            raise ValueError("Module and variable must be strings")
-        doc = self._database[module].find_one({"var": variable})
-        return default if doc is None else doc["val"]
+    async def aremove(self, module: str, variable: str):
+        """Remove key from database without blocking the event loop"""
+        return await self._run(self.remove, module, variable)
 
-    def get_collection(self, module: str):
-        if not isinstance(module, str):
-            raise ValueError("Module must be a string")
-        return {item["var"]: item["val"] for item in self._database[module].find()}
+    async def aget_collection(self, module: str) -> dict:
+        """Get database for selected module without blocking the event loop"""
+        return await self._run(self.get_collection, module)
 
-    def remove(self, module: str, variable: str):
-        if not isinstance(module, str) or not isinstance(variable, str):
-            raise ValueError("Module and variable must be strings")
-        self._database[module].delete_one({"var": variable})
+    async def aget_many(self, module: str, variables: list, default=None) -> dict:
+        """Get several keys of one module without blocking the event loop"""
+        return await self._run(self.get_many, module, variables, default)
 
-    def close(self):
-        self._client.close()
+    async def aset_many(self, module: str, values: dict):
+        """Set several keys of one module without blocking the event loop"""
+        return await self._run(self.set_many, module, values)
 
     def add_chat_history(self, user_id, message):
-        chat_history = self.get_chat_history(user_id, default=[])
-        chat_history.append(message)
-        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
+        self.append_history(f"core.cohere.user_{user_id}", message)
 
     def get_chat_history(self, user_id, default=None):
         if default is None:
             default = []
-        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+        return self.get_history(f"core.cohere.user_{user_id}") or default
 
     def addaiuser(self, user_id):
         chatai_users = self.get("core.chatbot", "chatai_users", default=[])
@@ -105,133 +595,622 @@ class MongoDatabase(Database):
         return self.get("core.chatbot", "chatai_users", default=[])
 
 
+class MongoDatabase(Database):
+    def __init__(self, url, name, change_streams: bool = False):
+        super().__init__()
+        self._client = pymongo.MongoClient(url)
+        self._database = self._client[name]
+        # pymongo is thread-safe, so network round-trips can overlap
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="mongodb")
+        # collections that already got their index in this process
+        self._indexed = set()
+        # writes carry the id of the process that made them, so the change
+        # stream can skip what set() and remove() already published here
+        self._origin = os.urandom(8).hex()
+        self._own_deletes = set()
+        self._own_lock = threading.Lock()
+        self._watching = change_streams
+
+        if change_streams:
+            threading.Thread(
+                target=self._watch, name="mongodb-watch", daemon=True
+            ).start()
+
+    def _watch(self):
+        # needs a replica set, lets other processes sharing the database
+        # (and this one) see every write
+        try:
+            with self._database.watch(full_document="updateLookup") as stream:
+                for change in stream:
+                    self._changed(change)
+        except pymongo.errors.PyMongoError:
+            logging.warning("MongoDB change stream stopped", exc_info=True)
+
+    def _changed(self, change: dict):
+        module = change["ns"]["coll"]
+        if not module.startswith(("core", "custom")):
+            return
+        document = change.get("fullDocument")
+        if document is None:
+            key = change.get("documentKey", {}).get("_id")
+            with self._own_lock:
+                if key in self._own_deletes:
+                    self._own_deletes.discard(key)
+                    return
+            # deletes only carry the _id, so the variable is unknown
+            self._cache.invalidate_module(module)
+            self.events.publish(module, None, None)
+        elif document.get("src") != self._origin:
+            self._cache.invalidate(module, document["var"])
+            self.events.publish(module, document["var"], document["val"])
+
+    def _collection(self, module: str):
+        collection = self._database[module]
+        if module not in self._indexed:
+            collection.create_index("var")
+            self._indexed.add(module)
+        return collection
+
+    @property
+    def _history(self):
+        collection = self._database["history"]
+        if "history" not in self._indexed:
+            collection.create_index(
+                [("conversation", pymongo.ASCENDING), ("seq", pymongo.DESCENDING)],
+                unique=True,
+            )
+            self._indexed.add("history")
+        return collection
+
+    def _set(self, module: str, variable: str, value):
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        self._collection(module).replace_one(
+            {"var": variable},
+            {"var": variable, "val": value, "src": self._origin},
+            upsert=True,
+        )
+
+    def _set_many(self, module: str, values: dict):
+        if not isinstance(module, str) or not all(
+            isinstance(variable, str) for variable in values
+        ):
+            raise ValueError("Module and variables must be strings")
+        if not values:
+            return
+        self._collection(module).bulk_write(
+            [
+                pymongo.ReplaceOne(
+                    {"var": variable},
+                    {"var": variable, "val": value, "src": self._origin},
+                    upsert=True,
+                )
+                for variable, value in values.items()
+            ],
+            ordered=False,
+        )
+
+    def _get(self, module: str, variable: str, default=None):
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        doc = self._collection(module).find_one({"var": variable}, {"_id": 0, "val": 1})
+        return default if doc is None else doc["val"]
+
+    def _get_many(self, module: str, variables: list) -> dict:
+        if not isinstance(module, str) or not all(
+            isinstance(variable, str) for variable in variables
+        ):
+            raise ValueError("Module and variables must be strings")
+        return {
+            item["var"]: item["val"]
+            for item in self._collection(module).find(
+                {"var": {"$in": variables}}, {"_id": 0, "var": 1, "val": 1}
+            )
+        }
+
+    def _get_collection(self, module: str):
+        if not isinstance(module, str):
+            raise ValueError("Module must be a string")
+        return {
+            item["var"]: item["val"]
+            for item in self._collection(module).find(
+                {}, {"_id": 0, "var": 1, "val": 1}
+            )
+        }
+
+    def _remove(self, module: str, variable: str):
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        deleted = self._collection(module).find_one_and_delete(
+            {"var": variable}, {"_id": 1}
+        )
+        if deleted is not None and self._watching:
+            with self._own_lock:
+                self._own_deletes.add(deleted["_id"])
+
+    def _append_history(self, conversation: str, entry, limit: int) -> int:
+        counter = self._database["history_counters"].find_one_and_update(
+            {"_id": conversation},
+            {"$inc": {"seq": 1}},
+            upsert=True,
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+        seq = counter["seq"]
+        self._history.insert_one(
+            {"conversation": conversation, "seq": seq, "val": entry}
+        )
+        if limit:
+            self._history.delete_many(
+                {"conversation": conversation, "seq": {"$lte": seq - limit}}
+            )
+        return seq
+
+    def _get_history(self, conversation: str, limit: int) -> list:
+        cursor = self._history.find(
+            {"conversation": conversation}, {"_id": 0, "val": 1}
+        ).sort("seq", pymongo.DESCENDING)
+        if limit:
+            cursor = cursor.limit(limit)
+        return [doc["val"] for doc in cursor][::-1]
+
+    def _clear_history(self, conversation: str):
+        self._history.delete_many({"conversation": conversation})
+        self._database["history_counters"].delete_one({"_id": conversation})
+
+    def _collections(self) -> list:
+        return self._database.list_collection_names()
+
+    def close(self):
+        self._executor.shutdown()
+        self._client.close()
+
+
 class SqliteDatabase(Database):
-    def __init__(self, file):
-        self._conn = sqlite3.connect(file, check_same_thread=False)
+    def __init__(self, file, commit_interval: float = 0.5, commit_batch: int = 100):
+        super().__init__()
+        self._conn = sqlite3.connect(
+            file, check_same_thread=False, cached_statements=512
+        )
         self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA cache_size=-8000")
+        self._conn.execute("PRAGMA temp_store=MEMORY")
         self._cursor = self._conn.cursor()
         self._lock = threading.Lock()
+        # connection is guarded by a lock anyway, one worker keeps writes ordered
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+
+        # write-behind: writes are grouped into one commit, issued either
+        # after commit_interval seconds or once commit_batch writes are pending
+        self._commit_interval = commit_interval
+        self._commit_batch = commit_batch
+        self._commit_timer = None
+        self._pending_writes = 0
+
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS history (
+            conversation TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            val TEXT NOT NULL,
+            PRIMARY KEY (conversation, seq)
+            )
+            """)
+        self._conn.commit()
+
+        # module name -> SQL for its table, doubles as the registry of
+        # validated modules whose table is known to exist
+        self._tables = {}
 
     @staticmethod
     def _parse_row(row: sqlite3.Row):
-        if row["type"] == "bool":
-            return row["val"] == "1"
-        if row["type"] == "int":
-            return int(row["val"])
-        if row["type"] == "str":
-            return row["val"]
-        return json.loads(row["val"])
-
-    def _execute(self, module: str, *args, **kwargs) -> sqlite3.Cursor:
-        pattern = r"^(core|custom)"
-        if not re.match(pattern, module):
+        return decode_value(row["val"], row["type"])
+
+    def _statements(self, module: str) -> dict:
+        # must be called with self._lock held
+        statements = self._tables.get(module)
+        if statements is not None:
+            return statements
+
+        if not re.match(r"^(core|custom)", module):
             raise ValueError(f"Invalid module name format: {module}")
 
-        self._lock.acquire()
-        try:
-            cursor = self._conn.cursor()
-            return cursor.execute(*args, **kwargs)
-        except sqlite3.OperationalError as e:
-            if str(e).startswith("no such table"):
-                sql = f"""
-                CREATE TABLE IF NOT EXISTS '{module}' (
-                var TEXT UNIQUE NOT NULL,
-                val TEXT NOT NULL,
-                type TEXT NOT NULL
-                )
-                """
-                cursor = self._conn.cursor()
-                cursor.execute(sql)
-                self._conn.commit()
-                return cursor.execute(*args, **kwargs)
-            raise e from None
-        finally:
-            self._lock.release()
+        self._cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS '{module}' (
+            var TEXT UNIQUE NOT NULL,
+            val TEXT NOT NULL,
+            type TEXT NOT NULL
+            )
+            """)
+        self._conn.commit()
 
-    def get(self, module: str, variable: str, default=None):
-        sql = f"SELECT * FROM '{module}' WHERE var=?"
-        cur = self._execute(module, sql, (variable,))
+        statements = self._tables[module] = {
+            "get": f"SELECT * FROM '{module}' WHERE var=?",
+            "set": f"""
+            INSERT INTO '{module}' VALUES ( ?, ?, ? )
+            ON CONFLICT (var) DO
+            UPDATE SET val=excluded.val, type=excluded.type
+            """,
+            "remove": f"DELETE FROM '{module}' WHERE var=?",
+            "collection": f"SELECT * FROM '{module}'",
+        }
+        return statements
 
-        row = cur.fetchone()
-        if row is None:
-            return default
-        return self._parse_row(row)
+    def _execute(self, module: str, statement: str, params=()) -> list:
+        with self._lock:
+            sql = self._statements(module)[statement]
+            return self._cursor.execute(sql, params).fetchall()
 
-    def set(self, module: str, variable: str, value) -> bool:
-        sql = f"""
-        INSERT INTO '{module}' VALUES ( ?, ?, ? )
-        ON CONFLICT (var) DO
-        UPDATE SET val=?, type=? WHERE var=?
-        """
+    def _get(self, module: str, variable: str, default=None):
+        rows = self._execute(module, "get", (variable,))
+        if not rows:
+            return default
+        return self._parse_row(rows[0])
 
-        if isinstance(value, bool):
-            val = "1" if value else "0"
-            typ = "bool"
-        elif isinstance(value, str):
-            val = value
-            typ = "str"
-        elif isinstance(value, int):
-            val = str(value)
-            typ = "int"
-        else:
-            val = json.dumps(value)
-            typ = "json"
+    def _get_many(self, module: str, variables: list) -> dict:
+        found = {}
+        with self._lock:
+            self._statements(module)
+            # stay well below SQLITE_MAX_VARIABLE_NUMBER
+            for i in range(0, len(variables), 500):
+                chunk = variables[i : i + 500]
+                sql = (
+                    f"SELECT * FROM '{module}' "
+                    f"WHERE var IN ({', '.join('?' * len(chunk))})"
+                )
+                for row in self._cursor.execute(sql, chunk):
+                    found[row["var"]] = self._parse_row(row)
+        return found
 
-        self._execute(module, sql, (variable, val, typ, val, typ, variable))
-        self._conn.commit()
+    def _set(self, module: str, variable: str, value) -> bool:
+        self._execute(module, "set", (variable, *encode_value(value)))
+        self._schedule_commit()
 
         return True
 
-    def remove(self, module: str, variable: str):
-        sql = f"DELETE FROM '{module}' WHERE var=?"
-        self._execute(module, sql, (variable,))
-        self._conn.commit()
+    def _set_many(self, module: str, values: dict):
+        with self._lock:
+            sql = self._statements(module)["set"]
+            self._cursor.executemany(
+                sql,
+                [
+                    (variable, *encode_value(value))
+                    for variable, value in values.items()
+                ],
+            )
+            # the whole batch goes out as one transaction
+            self._pending_writes += len(values)
+            self._commit()
 
-    def get_collection(self, module: str) -> dict:
-        pattern = r"^(core|custom)"
-        if not re.match(pattern, module):
-            raise ValueError(f"Invalid module name format: {module}")
+    def _remove(self, module: str, variable: str):
+        self._execute(module, "remove", (variable,))
+        self._schedule_commit()
 
-        sql = f"SELECT * FROM '{module}'"
-        cur = self._execute(module, sql)
+    def _get_collection(self, module: str) -> dict:
+        return {
+            row["var"]: self._parse_row(row)
+            for row in self._execute(module, "collection")
+        }
 
-        collection = {}
-        for row in cur:
-            collection[row["var"]] = self._parse_row(row)
+    def _append_history(self, conversation: str, entry, limit: int) -> int:
+        with self._lock:
+            cursor = self._cursor
+            cursor.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM history WHERE conversation=?",
+                (conversation,),
+            )
+            seq = cursor.fetchone()[0]
+            cursor.execute(
+                "INSERT INTO history VALUES ( ?, ?, ? )",
+                (conversation, seq, json.dumps(entry)),
+            )
+            if limit:
+                cursor.execute(
+                    "DELETE FROM history WHERE conversation=? AND seq<=?",
+                    (conversation, seq - limit),
+                )
+        self._schedule_commit()
+        return seq
 
-        return collection
+    def _get_history(self, conversation: str, limit: int) -> list:
+        with self._lock:
+            rows = self._cursor.execute(
+                "SELECT val FROM history WHERE conversation=? "
+                "ORDER BY seq DESC LIMIT ?",
+                (conversation, limit or -1),
+            ).fetchall()
+        return [json.loads(row["val"]) for row in reversed(rows)]
+
+    def _clear_history(self, conversation: str):
+        with self._lock:
+            self._cursor.execute(
+                "DELETE FROM history WHERE conversation=?", (conversation,)
+            )
+        self._schedule_commit()
+
+    def _collections(self) -> list:
+        with self._lock:
+            rows = self._cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type='table'"
+            ).fetchall()
+        return [row["name"] for row in rows]
+
+    def migrate_values(self):
+        if self.get("core.main", "value_codec") == VALUE_CODEC:
+            return
+
+        for module in self._collections():
+            if not module.startswith(("core", "custom")):
+                continue
+            with self._lock:
+                self._statements(module)
+                rows = self._cursor.execute(
+                    f"SELECT var, val, type FROM '{module}' WHERE type != ?",
+                    (VALUE_CODEC,),
+                ).fetchall()
+                updates = []
+                for row in rows:
+                    if row["type"] in ("bool", "int", "str"):
+                        continue
+                    val, typ = encode_value(decode_value(row["val"], row["type"]))
+                    updates.append((val, typ, row["var"]))
+                self._cursor.executemany(
+                    f"UPDATE '{module}' SET val=?, type=? WHERE var=?", updates
+                )
+                self._conn.commit()
+            self._cache.clear()
+
+        self.set("core.main", "value_codec", VALUE_CODEC)
+
+    def _schedule_commit(self):
+        with self._lock:
+            self._pending_writes += 1
+            if self._pending_writes >= self._commit_batch:
+                self._commit()
+            elif self._commit_timer is None:
+                self._commit_timer = threading.Timer(self._commit_interval, self.flush)
+                self._commit_timer.daemon = True
+                self._commit_timer.start()
+
+    def _commit(self):
+        # must be called with self._lock held
+        if self._commit_timer is not None:
+            self._commit_timer.cancel()
+            self._commit_timer = None
+        if self._pending_writes:
+            self._conn.commit()
+            self._pending_writes = 0
+
+    def flush(self):
+        with self._lock:
+            self._commit()
 
     def close(self):
+        self._executor.shutdown()
+        self.flush()
         self._conn.commit()
         self._conn.close()
 
-    def add_chat_history(self, user_id, message):
-        chat_history = self.get_chat_history(user_id, default=[])
-        chat_history.append(message)
-        self.set(f"core.cohere.user_{user_id}", "chat_history", chat_history)
 
-    def get_chat_history(self, user_id, default=None):
-        if default is None:
-            default = []
-        return self.get(f"core.cohere.user_{user_id}", "chat_history", default=[])
+class _LmdbStore:
+    """Memory-mapped store, readers never block each other or the writer"""
 
-    def addaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id not in chatai_users:
-            chatai_users.append(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    concurrent_reads = True
 
-    def remaiuser(self, user_id):
-        chatai_users = self.get("core.chatbot", "chatai_users", default=[])
-        if user_id in chatai_users:
-            chatai_users.remove(user_id)
-            self.set("core.chatbot", "chatai_users", chatai_users)
+    def __init__(self, path):
+        self._env = lmdb.open(path, map_size=1 << 30, max_readers=64, metasync=False)
 
-    def getaiusers(self):
-        return self.get("core.chatbot", "chatai_users", default=[])
+    def get(self, key: bytes, decode):
+        # buffers=True hands out views into the map instead of copying values
+        with self._env.begin(buffers=True) as txn:
+            value = txn.get(key)
+            return _ABSENT if value is None else decode(value)
+
+    def scan(self, prefix: bytes, decode) -> list:
+        items = []
+        with self._env.begin(buffers=True) as txn:
+            cursor = txn.cursor()
+            if not cursor.set_range(prefix):
+                return items
+            for key, value in cursor:
+                key = bytes(key)
+                if not key.startswith(prefix):
+                    break
+                items.append((key, decode(value)))
+        return items
+
+    def keys(self) -> list:
+        with self._env.begin() as txn:
+            return list(txn.cursor().iternext(values=False))
+
+    def write(self, puts: dict, deletes=()):
+        with self._env.begin(write=True) as txn:
+            for key in deletes:
+                txn.delete(key)
+            for key, value in puts.items():
+                txn.put(key, value)
+
+    def sync(self):
+        self._env.sync(True)
+
+    def close(self):
+        self._env.close()
+
+
+class _DbmStore:
+    """Fallback on the stdlib dbm, which has no ordered keys nor safe concurrency"""
+
+    concurrent_reads = False
+
+    def __init__(self, path):
+        self._db = dbm.open(path, "c")
+        self._lock = threading.Lock()
+
+    def get(self, key: bytes, decode):
+        with self._lock:
+            value = self._db.get(key)
+        return _ABSENT if value is None else decode(value)
+
+    def scan(self, prefix: bytes, decode) -> list:
+        with self._lock:
+            items = [
+                (key, self._db[key])
+                for key in self._db.keys()
+                if key.startswith(prefix)
+            ]
+        return [(key, decode(value)) for key, value in sorted(items)]
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._db.keys())
+
+    def write(self, puts: dict, deletes=()):
+        with self._lock:
+            for key in deletes:
+                if key in self._db:
+                    del self._db[key]
+            for key, value in puts.items():
+                self._db[key] = value
+
+    def sync(self):
+        with self._lock:
+            if hasattr(self._db, "sync"):
+                self._db.sync()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class KeyValueDatabase(Database):
+    """Embedded key-value backend: LMDB when installed, stdlib dbm otherwise"""
+
+    _SEP = b"\x00"
+
+    def __init__(self, path, engine: str = "lmdb"):
+        super().__init__()
+        if engine == "lmdb" and lmdb is not None:
+            self._store = _LmdbStore(path)
+        else:
+            self._store = _DbmStore(path)
+        workers = 4 if self._store.concurrent_reads else 1
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="kvdb"
+        )
+        # serialises read-modify-write sequences (history counters)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _pack(cls, value) -> bytes:
+        # same codec as SqliteDatabase, so both backends return equal values
+        val, typ = encode_value(value)
+        if isinstance(val, str):
+            val = val.encode()
+        return typ.encode() + cls._SEP + val
+
+    @classmethod
+    def _unpack(cls, value):
+        typ, _, val = bytes(value).partition(cls._SEP)
+        typ = typ.decode()
+        return decode_value(val if typ == VALUE_CODEC else val.decode(), typ)
+
+    def _key(self, module: str, variable: str) -> bytes:
+        if not isinstance(module, str) or not isinstance(variable, str):
+            raise ValueError("Module and variable must be strings")
+        if not re.match(r"^(core|custom)", module):
+            raise ValueError(f"Invalid module name format: {module}")
+        return module.encode() + self._SEP + variable.encode()
+
+    def _get(self, module: str, variable: str, default=None):
+        value = self._store.get(self._key(module, variable), self._unpack)
+        return default if value is _ABSENT else value
+
+    def _set(self, module: str, variable: str, value):
+        self._store.write({self._key(module, variable): self._pack(value)})
+        return True
+
+    def _set_many(self, module: str, values: dict):
+        self._store.write(
+            {
+                self._key(module, variable): self._pack(value)
+                for variable, value in values.items()
+            }
+        )
+
+    def _remove(self, module: str, variable: str):
+        self._store.write({}, [self._key(module, variable)])
+
+    def _get_collection(self, module: str) -> dict:
+        prefix = self._key(module, "")
+        return {
+            key[len(prefix) :].decode(): value
+            for key, value in self._store.scan(prefix, self._unpack)
+        }
+
+    def _history_key(self, conversation: str, seq: int) -> bytes:
+        # big-endian seq keeps history rows ordered inside LMDB
+        return (
+            b"history"
+            + self._SEP
+            + conversation.encode()
+            + self._SEP
+            + struct.pack(">Q", seq)
+        )
+
+    def _history_counter(self, conversation: str) -> bytes:
+        return b"history_seq" + self._SEP + conversation.encode()
+
+    def _append_history(self, conversation: str, entry, limit: int) -> int:
+        counter = self._history_counter(conversation)
+        with self._lock:
+            seq = self._store.get(counter, self._unpack)
+            seq = 1 if seq is _ABSENT else seq + 1
+            deletes = []
+            if limit and seq > limit:
+                deletes.append(self._history_key(conversation, seq - limit))
+            self._store.write(
+                {
+                    counter: self._pack(seq),
+                    self._history_key(conversation, seq): self._pack(entry),
+                },
+                deletes,
+            )
+        return seq
+
+    def _get_history(self, conversation: str, limit: int) -> list:
+        last = self._store.get(self._history_counter(conversation), self._unpack)
+        if last is _ABSENT:
+            return []
+        first = max(1, last - limit + 1) if limit else 1
+        history = []
+        for seq in range(first, last + 1):
+            entry = self._store.get(self._history_key(conversation, seq), self._unpack)
+            if entry is not _ABSENT:
+                history.append(entry)
+        return history
+
+    def _clear_history(self, conversation: str):
+        prefix = b"history" + self._SEP + conversation.encode() + self._SEP
+        with self._lock:
+            keys = [key for key, _ in self._store.scan(prefix, bytes)]
+            self._store.write({}, [*keys, self._history_counter(conversation)])
+
+    def _collections(self) -> list:
+        modules = {bytes(key).split(self._SEP, 1)[0] for key in self._store.keys()}
+        return [module.decode() for module in modules]
+
+    def flush(self):
+        self._store.sync()
+
+    def close(self):
+        self._executor.shutdown()
+        self.flush()
+        self._store.close()
 
 
 if config.db_type in ["mongo", "mongodb"]:
-    db = MongoDatabase(config.db_url, config.db_name)
+    db = MongoDatabase(config.db_url, config.db_name, config.db_change_streams)
+elif config.db_type in ["lmdb", "dbm"]:
+    db = KeyValueDatabase(config.db_name, config.db_type)
 else:
     db = SqliteDatabase(config.db_name)
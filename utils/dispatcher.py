@@ -0,0 +1,184 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import itertools
+import logging
+import time
+from typing import Optional
+
+from pyrogram import Client, StopPropagation, utils
+from pyrogram.dispatcher import Dispatcher
+
+log = logging.getLogger(__name__)
+
+
+class UpdateShard:
+    """Queue and backpressure counters of one shard"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.processed = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.busy_since = None
+
+    def put(self, packet):
+        self.queue.put_nowait((packet, time.monotonic()))
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def stats(self) -> dict:
+        return {
+            "shard": self.index,
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "processed": self.processed,
+            "avg_wait_ms": (
+                round(self.wait_total / self.processed * 1000, 2)
+                if self.processed
+                else 0.0
+            ),
+            "max_wait_ms": round(self.wait_max * 1000, 2),
+            "busy_ms": (
+                round((time.monotonic() - self.busy_since) * 1000, 2)
+                if self.busy_since is not None
+                else 0.0
+            ),
+        }
+
+    def reset(self):
+        self.processed = 0
+        self.max_depth = self.queue.qsize()
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class ShardedDispatcher(Dispatcher):
+    """
+    Dispatcher that shards updates by chat onto a pool of worker queues.
+
+    Every shard has a single worker, so updates of one chat are handled in the
+    order they arrived, while a slow handler only holds back the chats hashed
+    to its own shard. Updates without a chat are spread over all shards.
+    """
+
+    def __init__(self, client: Client, shards: int):
+        super().__init__(client)
+        self.shards = [UpdateShard(i) for i in range(max(1, shards))]
+        self._round_robin = itertools.cycle(self.shards)
+        self._router_task = None
+
+    @staticmethod
+    def shard_key(update) -> Optional[int]:
+        """
+        Chat of a raw update as a marked peer id (-100... for channels, -id for
+        basic groups), None if it isn't bound to one
+        """
+        message = getattr(update, "message", None)
+        peer = getattr(message, "peer_id", None) or getattr(update, "peer", None)
+        if peer is not None:
+            try:
+                return utils.get_peer_id(peer)
+            except Exception:
+                pass
+        # updates without a peer only carry the bare id, mark it the same way
+        channel_id = getattr(update, "channel_id", None)
+        if isinstance(channel_id, int):
+            return utils.get_channel_id(channel_id)
+        chat_id = getattr(update, "chat_id", None)
+        if isinstance(chat_id, int):
+            return -chat_id
+        user_id = getattr(update, "user_id", None)
+        if isinstance(user_id, int):
+            return user_id
+        return None
+
+    def shard_for(self, update) -> UpdateShard:
+        key = self.shard_key(update)
+        if key is None:
+            return next(self._round_robin)
+        return self.shards[key % len(self.shards)]
+
+    async def start(self):
+        if not self.client.no_updates:
+            for shard in self.shards:
+                lock = asyncio.Lock()
+                self.locks_list.append(lock)
+                shard.task = self.loop.create_task(self.shard_worker(shard, lock))
+                self.handler_worker_tasks.append(shard.task)
+            self._router_task = self.loop.create_task(self.router())
+
+            log.info("Started %s update shards", len(self.shards))
+
+            if not self.client.skip_updates:
+                await self.client.recover_gaps()
+
+    async def stop(self):
+        if not self.client.no_updates:
+            self.updates_queue.put_nowait(None)
+            await self._router_task
+            for shard in self.shards:
+                shard.queue.put_nowait((None, None))
+            await asyncio.gather(*self.handler_worker_tasks)
+
+            self.handler_worker_tasks.clear()
+            self.locks_list.clear()
+            self.groups.clear()
+            self.error_handlers.clear()
+
+            log.info("Stopped %s update shards", len(self.shards))
+
+    async def router(self):
+        while True:
+            packet = await self.updates_queue.get()
+            try:
+                if packet is None:
+                    break
+                self.shard_for(packet[0]).put(packet)
+            finally:
+                self.updates_queue.task_done()
+
+    async def shard_worker(self, shard: UpdateShard, lock: asyncio.Lock):
+        while True:
+            packet, queued = await shard.queue.get()
+
+            if packet is None:
+                break
+
+            wait = time.monotonic() - queued
+            shard.wait_total += wait
+            shard.wait_max = max(shard.wait_max, wait)
+            shard.busy_since = time.monotonic()
+            try:
+                await self._handle_packet(packet, lock)
+            except StopPropagation:
+                pass
+            except Exception as e:
+                log.exception(e)
+            finally:
+                shard.busy_since = None
+                shard.processed += 1
+                shard.queue.task_done()
+
+    def stats(self) -> list:
+        return [shard.stats() for shard in self.shards]
+
+    def reset_stats(self):
+        for shard in self.shards:
+            shard.reset()
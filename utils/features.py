@@ -0,0 +1,124 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import re
+from collections import Counter
+from typing import Callable, Hashable, Iterable, Union
+
+from utils.db import db
+
+
+def chat_flag(pattern: str) -> Callable:
+    """
+    Extractor for per-chat keys like `antiraid{chat_id}`: the chat is enabled
+    while the value is truthy. `pattern` contains `{chat_id}`.
+    """
+    regex = re.compile(
+        "^" + re.escape(pattern).replace(r"\{chat_id\}", r"(-?\d+)") + "$"
+    )
+
+    def extract(variable: str, value) -> Iterable[int]:
+        match = regex.match(variable)
+        if match and value:
+            return (int(match.group(1)),)
+        return ()
+
+    return extract
+
+
+class FeatureRegistry:
+    """
+    In-memory bitsets of the features enabled per chat (or per topic key).
+
+    A feature is declared once with the database module it's stored in and an
+    `extract(variable, value)` function returning the keys a database entry
+    enables. The module is loaded when the feature is registered, then kept in
+    sync through database change events, so `enabled(chat_id, mask)` never
+    touches the database.
+    """
+
+    def __init__(self):
+        self._names = {}
+        self._sources = {}
+        self._bits = {}
+        # (key, bit) -> number of database entries enabling it
+        self._counts = Counter()
+        # (bit, module, variable) -> keys that entry currently enables
+        self._contributions = {}
+
+    def register(self, name: str, module: str, extract: Callable) -> int:
+        """Declare a feature and return its bit, registering twice is a no-op"""
+        if name in self._names:
+            return self._names[name]
+        bit = 1 << len(self._names)
+        self._names[name] = bit
+        if module not in self._sources:
+            self._sources[module] = []
+            db.subscribe(self._on_change, module)
+        self._sources[module].append((bit, extract))
+        self._load(module, bit, extract)
+        return bit
+
+    def bit(self, name: str) -> int:
+        return self._names[name]
+
+    def get(self, key: Hashable) -> int:
+        return self._bits.get(key, 0)
+
+    def enabled(self, key: Hashable, mask: int) -> bool:
+        return bool(self._bits.get(key, 0) & mask)
+
+    def keys(self, name_or_bit: Union[str, int]) -> list:
+        """Keys a feature is enabled for"""
+        bit = self._names.get(name_or_bit, name_or_bit)
+        return [key for key, bits in self._bits.items() if bits & bit]
+
+    def _load(self, module: str, bit: int, extract: Callable):
+        for variable, value in db.get_collection(module).items():
+            self._update(bit, extract, module, variable, value)
+
+    def _update(self, bit: int, extract: Callable, module: str, variable, value):
+        new = set(extract(variable, value)) if value is not None else set()
+        old = self._contributions.pop((bit, module, variable), set())
+        if new:
+            self._contributions[(bit, module, variable)] = new
+        for key in old - new:
+            self._counts[(key, bit)] -= 1
+            if self._counts[(key, bit)] <= 0:
+                del self._counts[(key, bit)]
+                bits = self._bits.get(key, 0) & ~bit
+                if bits:
+                    self._bits[key] = bits
+                else:
+                    self._bits.pop(key, None)
+        for key in new - old:
+            self._counts[(key, bit)] += 1
+            self._bits[key] = self._bits.get(key, 0) | bit
+
+    def _on_change(self, module: str, variable: str, value):
+        for bit, extract in self._sources.get(module, ()):
+            if variable is None:
+                # removed by another process, reload the whole module
+                for contribution in [
+                    c for c in self._contributions if c[0] == bit and c[1] == module
+                ]:
+                    self._update(bit, extract, module, contribution[2], None)
+                self._load(module, bit, extract)
+            else:
+                self._update(bit, extract, module, variable, value)
+
+
+features = FeatureRegistry()
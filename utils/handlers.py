@@ -14,13 +14,25 @@
 #  You should have received a copy of the GNU General Public License
 #  along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import asyncio
+import heapq
+import logging
+import math
 import re
+import time
+from array import array
+from collections import OrderedDict, deque
+from contextlib import suppress
 from datetime import datetime, timedelta
-from typing import Dict, Union
+from typing import Dict, List, Optional, Tuple, Union
 
 from pyrogram import Client
 from pyrogram.errors import (
     ChatAdminRequired,
+    FileReferenceExpired,
+    FileReferenceInvalid,
+    FloodWait,
+    MessageIdInvalid,
     PeerIdInvalid,
     RPCError,
     UserAdminInvalid,
@@ -85,6 +97,277 @@ async def get_user_and_name(message):
         )
 
 
+class TokenBucket:
+    """Allow `rate` calls per second on average, with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Drain the bucket for `seconds`, e.g. after a FloodWait"""
+        self._refill()
+        self.tokens = -seconds * self.rate
+
+
+class ChatActions:
+    __slots__ = ("deletes", "delete_futures", "actions", "task")
+
+    def __init__(self):
+        self.deletes = []
+        self.delete_futures = []
+        self.actions = deque()
+        self.task = None
+
+
+class ModerationExecutor:
+    """
+    Shared queue of moderation calls, run by one worker per chat.
+
+    Pending deletes of a chat are merged into `delete_messages` batches of 100
+    and run before its other actions. Every API method has its own token
+    bucket, a FloodWait drains the bucket of that method and the call is
+    retried, so mass actions slow down instead of failing. Queued calls
+    return futures: await them to get the result or the error.
+    """
+
+    RATES = {
+        "delete_messages": (3, 5),
+        "ban_chat_member": (5, 20),
+        "unban_chat_member": (5, 20),
+        "restrict_chat_member": (5, 20),
+    }
+    DEFAULT_RATE = (10, 20)
+    MAX_RETRIES = 3
+
+    def __init__(self):
+        self._buckets = {}
+        self._chats = {}
+
+    def bucket(self, method: str) -> TokenBucket:
+        if method not in self._buckets:
+            self._buckets[method] = TokenBucket(
+                *self.RATES.get(method, self.DEFAULT_RATE)
+            )
+        return self._buckets[method]
+
+    async def call(self, method, *args, **kwargs):
+        """Call a client method right away, rate limited and retried on FloodWait"""
+        bucket = self.bucket(method.__name__)
+        for attempt in range(self.MAX_RETRIES + 1):
+            await bucket.acquire()
+            try:
+                return await method(*args, **kwargs)
+            except FloodWait as e:
+                if attempt == self.MAX_RETRIES:
+                    raise
+                logging.info("FloodWait of %ss on %s", e.value, method.__name__)
+                bucket.pause(e.value)
+
+    def _queue(self, client: Client, chat_id: int) -> ChatActions:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            queue = self._chats[chat_id] = ChatActions()
+        if queue.task is None:
+            queue.task = asyncio.create_task(self._worker(client, chat_id, queue))
+        return queue
+
+    @staticmethod
+    def _future() -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_log_moderation_error)
+        return future
+
+    def submit(
+        self, client: Client, chat_id: int, method: str, *args, **kwargs
+    ) -> asyncio.Future:
+        """Queue `client.<method>(chat_id, *args, **kwargs)`"""
+        future = self._future()
+        self._queue(client, chat_id).actions.append((method, args, kwargs, future))
+        return future
+
+    def delete(self, client: Client, chat_id: int, message_ids) -> asyncio.Future:
+        future = self._future()
+        queue = self._queue(client, chat_id)
+        queue.deletes.extend(message_ids)
+        queue.delete_futures.append(future)
+        return future
+
+    def ban(self, client: Client, chat_id: int, user_id: int, until_date=None):
+        if until_date is None:
+            return self.submit(client, chat_id, "ban_chat_member", user_id)
+        return self.submit(client, chat_id, "ban_chat_member", user_id, until_date)
+
+    def unban(self, client: Client, chat_id: int, user_id: int):
+        return self.submit(client, chat_id, "unban_chat_member", user_id)
+
+    def kick(self, client: Client, chat_id: int, user_id: int) -> asyncio.Future:
+        """Ban and unban right away: the user is removed but can join again"""
+        kicked = self._future()
+
+        def banned(future: asyncio.Future):
+            if future.cancelled() or future.exception() is not None:
+                _copy_outcome(future, kicked)
+            else:
+                self.unban(client, chat_id, user_id).add_done_callback(
+                    lambda unbanned: _copy_outcome(unbanned, kicked)
+                )
+
+        self.ban(client, chat_id, user_id).add_done_callback(banned)
+        return kicked
+
+    def mute(self, client: Client, chat_id: int, user_id: int, until_date=None):
+        args = (user_id, ChatPermissions())
+        if until_date is not None:
+            args += (until_date,)
+        return self.submit(client, chat_id, "restrict_chat_member", *args)
+
+    def pending(self, chat_id: int) -> int:
+        queue = self._chats.get(chat_id)
+        if queue is None:
+            return 0
+        return len(queue.deletes) + len(queue.actions)
+
+    async def _worker(self, client: Client, chat_id: int, queue: ChatActions):
+        try:
+            while queue.deletes or queue.actions:
+                if queue.deletes:
+                    await self._delete(client, chat_id, queue)
+                    continue
+                method, args, kwargs, future = queue.actions.popleft()
+                try:
+                    result = await self.call(
+                        getattr(client, method), chat_id, *args, **kwargs
+                    )
+                except Exception as e:
+                    # the caller may have cancelled the future meanwhile
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            queue.task = None
+            if not (queue.deletes or queue.actions):
+                self._chats.pop(chat_id, None)
+
+    async def _delete(self, client: Client, chat_id: int, queue: ChatActions):
+        message_ids = sorted(set(queue.deletes))
+        futures = queue.delete_futures
+        queue.deletes, queue.delete_futures = [], []
+
+        deleted, error = 0, None
+        for i in range(0, len(message_ids), 100):
+            try:
+                deleted += await self.call(
+                    client.delete_messages, chat_id, message_ids[i : i + 100]
+                )
+            except Exception as e:
+                error = e
+        for future in futures:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(deleted)
+
+
+def _copy_outcome(source: asyncio.Future, target: asyncio.Future):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+def _log_moderation_error(future: asyncio.Future):
+    if not future.cancelled() and future.exception() is not None:
+        logging.debug("Moderation action failed: %s", future.exception())
+
+
+moderation = ModerationExecutor()
+
+
+class ModerationProgress:
+    """
+    Counts the results of a mass moderation action and keeps the command
+    message updated, at most once every `interval` seconds.
+    """
+
+    def __init__(self, message: Message, title: str, interval: float = 5):
+        self.message = message
+        self.title = title
+        self.interval = interval
+        self.scanned = 0
+        self.queued = 0
+        self.done = 0
+        self.failed = 0
+        self.error = None
+        self._futures = []
+        self._edited = time.monotonic()
+
+    def add(self, future: asyncio.Future):
+        self.queued += 1
+        self._futures.append(future)
+
+    def _collect(self):
+        pending = []
+        for future in self._futures:
+            if not future.done():
+                pending.append(future)
+            elif future.cancelled() or future.exception() is not None:
+                self.failed += 1
+                if not future.cancelled():
+                    self.error = future.exception()
+            else:
+                self.done += 1
+        self._futures = pending
+
+    def text(self) -> str:
+        return (
+            f"<b>{self.title}...</b>\n"
+            f"Scanned: {self.scanned}, done: {self.done}/{self.queued}, "
+            f"failed: {self.failed}"
+        )
+
+    async def report(self, force: bool = False):
+        if not force and time.monotonic() - self._edited < self.interval:
+            return
+        self._edited = time.monotonic()
+        self._collect()
+        with suppress(RPCError):
+            await self.message.edit(self.text())
+
+    async def wait(self):
+        self._collect()
+        while self._futures:
+            await asyncio.wait(self._futures, timeout=self.interval)
+            await self.report()
+            self._collect()
+
+
 class BanHandler:
     def __init__(self, client: Client, message: Message):
         self.client = client
@@ -132,7 +415,7 @@ class BanHandler:
 
     async def ban_user(self, user_id):
         try:
-            await self.client.ban_chat_member(self.message.chat.id, user_id)
+            await moderation.ban(self.client, self.message.chat.id, user_id)
             self.channel = await self.client.resolve_peer(self.message.chat.id)
             self.user_id = await self.client.resolve_peer(user_id)
             await self.handle_additional_actions()
@@ -219,7 +502,7 @@ class UnbanHandler:
 
     async def unban_user(self, user_id):
         try:
-            await self.client.unban_chat_member(self.message.chat.id, user_id)
+            await moderation.unban(self.client, self.message.chat.id, user_id)
             self.channel = await self.client.resolve_peer(self.message.chat.id)
             self.user_id = await self.client.resolve_peer(user_id)
             await self.edit_message()
@@ -291,19 +574,10 @@ class KickHandler:
 
     async def kick_user(self, user_id):
         try:
-            await self.client.ban_chat_member(
-                self.message.chat.id,
-                user_id,
-                datetime.now() + timedelta(minutes=1),
-            )
+            await moderation.kick(self.client, self.message.chat.id, user_id)
             self.channel = await self.client.resolve_peer(self.message.chat.id)
             self.user_id = await self.client.resolve_peer(user_id)
             await self.handle_additional_actions()
-            await self.client.unban_chat_member(
-                self.message.chat.id,
-                user_id,
-                datetime.now() + timedelta(minutes=1),
-            )
             await self.edit_message()
         except UserAdminInvalid:
             await self.message.edit("<b>No rights</b>")
@@ -345,28 +619,191 @@ class KickDeletedAccountsHandler:
         self.client = client
         self.message = message
         self.chat_id = message.chat.id
-        self.kicked_count = 0
+        self.progress = ModerationProgress(message, "Kicking deleted accounts")
 
     async def kick_deleted_accounts(self):
         await self.message.edit("<b>Kicking deleted accounts...</b>")
         try:
             async for member in self.client.get_chat_members(self.chat_id):
+                self.progress.scanned += 1
                 if member.user.is_deleted:
-                    await self.kick_member(member.user.id)
-                    self.kicked_count += 1
+                    self.progress.add(
+                        moderation.kick(self.client, self.chat_id, member.user.id)
+                    )
+                await self.progress.report()
+            await self.progress.wait()
         except Exception as e:
             return await self.message.edit(format_exc(e))
-        await self.message.edit(
-            f"<b>Successfully kicked {self.kicked_count} deleted account(s)</b>",
-        )
-
-    async def kick_member(self, user_id):
-        try:
-            await self.client.ban_chat_member(
-                self.chat_id, user_id, datetime.now() + timedelta(seconds=31)
+        text = f"<b>Successfully kicked {self.progress.done} deleted account(s)</b>"
+        if self.progress.failed:
+            text += (
+                f"\n<b>Failed to kick {self.progress.failed}:</b> "
+                f"<code>{self.progress.error}</code>"
             )
-        except Exception as e:
-            await self.message.edit(f"Failed to kick user {user_id}: {format_exc(e)}")
+        await self.message.edit(text)
+
+
+DURATION_UNITS = {"m": 60, "h": 3600, "d": 86400, "w": 604800}
+DURATION_ARGUMENT = re.compile(r"(?:\d+(?:\.\d+)?[mhdw])+")
+
+
+def parse_duration(argument: str) -> int:
+    """Seconds of a single argument like `90m` or `1d12h`, ValueError if malformed"""
+    argument = argument.lower()
+    if not DURATION_ARGUMENT.fullmatch(argument):
+        raise ValueError(f"invalid duration: {argument}")
+    return sum(
+        int(float(value) * DURATION_UNITS[unit])
+        for value, unit in re.findall(r"(\d+(?:\.\d+)?)([mhdw])", argument)
+    )
+
+
+class TimedMutes:
+    """
+    Users muted with .tmute, whose new messages are deleted.
+
+    The muted users of each chat are a set, so the check on every group
+    message is a hash lookup. Mutes with a duration are also pushed onto a
+    min-heap of (expiry, chat_id, user_id) and lifted by a background task
+    when they expire. Stale heap entries of mutes that were lifted or
+    extended are skipped when they reach the top. Everything is stored in
+    core.ats: `c{chat_id}` is the list of muted users and
+    `tmute_until{chat_id}` has [user_id, expiry] pairs of the timed ones.
+    """
+
+    def __init__(self):
+        self._muted = {}
+        # chat_id -> {user_id: expiry} of the timed mutes
+        self._expiry = {}
+        self._timed = 0
+        self._heap = []
+        self._changed = None
+        self._task = None
+        self._load()
+
+    def _load(self):
+        for variable, value in db.get_collection("core.ats").items():
+            if not value:
+                continue
+            if re.fullmatch(r"c-?\d+", variable):
+                self._muted[int(variable[1:])] = set(value)
+            elif variable.startswith("tmute_until"):
+                chat_id = int(variable[len("tmute_until") :])
+                # a user listed twice keeps the last expiry, like a new .tmute
+                expiries = self._expiry.setdefault(chat_id, {})
+                expiries.update(value)
+        for chat_id, expiries in self._expiry.items():
+            self._timed += len(expiries)
+            for user_id, expiry in expiries.items():
+                self._heap.append((expiry, chat_id, user_id))
+        heapq.heapify(self._heap)
+
+    def is_muted(self, chat_id: int, user_id: int) -> bool:
+        users = self._muted.get(chat_id)
+        return users is not None and user_id in users
+
+    def users(self, chat_id: int) -> List[int]:
+        return list(self._muted.get(chat_id, ()))
+
+    def expiry(self, chat_id: int, user_id: int) -> Optional[float]:
+        return self._expiry.get(chat_id, {}).get(user_id)
+
+    def __len__(self):
+        return sum(len(users) for users in self._muted.values())
+
+    def mute(self, chat_id: int, user_id: int, seconds: int = 0):
+        """Mute a user, forever if `seconds` is 0"""
+        self._muted.setdefault(chat_id, set()).add(user_id)
+        if seconds > 0:
+            expiry = time.time() + seconds
+            self._pop_expiry(chat_id, user_id)
+            self._expiry.setdefault(chat_id, {})[user_id] = expiry
+            self._timed += 1
+            if not self._heap or expiry < self._heap[0][0]:
+                self._wake()
+            heapq.heappush(self._heap, (expiry, chat_id, user_id))
+            if len(self._heap) > 2 * self._timed + 64:
+                self._compact()
+        else:
+            self._pop_expiry(chat_id, user_id)
+        self._save(chat_id)
+
+    def unmute(self, chat_id: int, user_id: int) -> bool:
+        users = self._muted.get(chat_id)
+        if users is None or user_id not in users:
+            return False
+        self._remove(chat_id, user_id)
+        self._save(chat_id)
+        return True
+
+    def _remove(self, chat_id: int, user_id: int):
+        users = self._muted[chat_id]
+        users.discard(user_id)
+        if not users:
+            del self._muted[chat_id]
+        # its heap entry becomes stale and is dropped when it's popped
+        self._pop_expiry(chat_id, user_id)
+
+    def _pop_expiry(self, chat_id: int, user_id: int):
+        expiries = self._expiry.get(chat_id)
+        if expiries is not None and expiries.pop(user_id, None) is not None:
+            self._timed -= 1
+            if not expiries:
+                del self._expiry[chat_id]
+
+    def _save(self, chat_id: int):
+        users = self._muted.get(chat_id, ())
+        db.set("core.ats", f"c{chat_id}", list(users))
+        timed = [list(item) for item in self._expiry.get(chat_id, {}).items()]
+        if timed:
+            db.set("core.ats", f"tmute_until{chat_id}", timed)
+        else:
+            db.remove("core.ats", f"tmute_until{chat_id}")
+
+    def _compact(self):
+        self._heap = [
+            (expiry, chat_id, user_id)
+            for chat_id, expiries in self._expiry.items()
+            for user_id, expiry in expiries.items()
+        ]
+        heapq.heapify(self._heap)
+
+    def expire(self, now: float = None) -> int:
+        """Lift the mutes that have expired, return how many"""
+        now = time.time() if now is None else now
+        lifted = 0
+        changed = set()
+        while self._heap and self._heap[0][0] <= now:
+            expiry, chat_id, user_id = heapq.heappop(self._heap)
+            if self.expiry(chat_id, user_id) != expiry:
+                continue
+            self._remove(chat_id, user_id)
+            changed.add(chat_id)
+            lifted += 1
+        for chat_id in changed:
+            self._save(chat_id)
+        return lifted
+
+    def start(self):
+        """Lift expired mutes in the background, also ones that expired while offline"""
+        self._changed = asyncio.Event()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    def _wake(self):
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _run(self):
+        while True:
+            self.expire()
+            self._changed.clear()
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._changed.wait(), timeout)
+
+
+tmutes = TimedMutes()
 
 
 class TimeMuteHandler:
@@ -375,10 +812,28 @@ class TimeMuteHandler:
         self.message = message
         self.cause = text(message)
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.seconds = 0
+        self.error = None
+        # `.tmute [duration] [reason]` on a reply, else `.tmute user [duration] [reason]`
+        index = 1 if message.reply_to_message else 2
+        parts = self.cause.split(maxsplit=index)
+        rest = parts[index].split(maxsplit=1) if len(parts) > index else []
+        self.reason = " ".join(rest)
+        if rest and rest[0][0].isdigit():
+            try:
+                self.seconds = parse_duration(rest[0])
+            except ValueError:
+                self.error = (
+                    f"<b>Invalid duration:</b> <code>{rest[0]}</code>\n"
+                    "<b>Use</b> <code>30m</code>, <code>2h</code>, <code>1d12h</code>"
+                    " <b>or</b> <code>1w</code>"
+                )
+            self.reason = rest[1] if len(rest) > 1 else ""
 
     async def handle_tmute(self):
-        if self.message.reply_to_message:
+        if self.error:
+            await self.message.edit(self.error)
+        elif self.message.reply_to_message:
             await self.handle_reply_tmute()
         elif not self.message.reply_to_message:
             await self.handle_non_reply_tmute()
@@ -388,14 +843,13 @@ class TimeMuteHandler:
     async def handle_reply_tmute(self):
         if self.message.chat.type not in ["private", "channel"]:
             user_for_tmute, name = await get_user_and_name(self.message)
-            if user_for_tmute in self.tmuted_users:
+            if tmutes.is_muted(self.chat_id, user_for_tmute) and not self.seconds:
                 await self.message.edit(f"<b>{name}</b> <code>already in tmute</code>")
             else:
-                self.tmuted_users.append(user_for_tmute)
-                db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                tmutes.mute(self.chat_id, user_for_tmute, self.seconds)
                 await self.message.edit(
-                    f"<b>{name}</b> <code>in tmute</code>"
-                    + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}",
+                    f"<b>{name}</b> <code>in tmute{self.duration_text()}</code>"
+                    + self.reason_text(),
                 )
 
     async def handle_non_reply_tmute(self):
@@ -408,12 +862,13 @@ class TimeMuteHandler:
                         if getattr(user_to_tmute, "first_name", None)
                         else user_to_tmute.title
                     )
-                    if user_to_tmute.id not in self.tmuted_users:
-                        self.tmuted_users.append(user_to_tmute.id)
-                        db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
+                    if self.seconds or not tmutes.is_muted(
+                        self.chat_id, user_to_tmute.id
+                    ):
+                        tmutes.mute(self.chat_id, user_to_tmute.id, self.seconds)
                         await self.message.edit(
-                            f"<b>{name}</b> <code>in tmute</code>"
-                            + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=2)[2] + '</i>' if len(self.cause.split()) > 2 else ''}",
+                            f"<b>{name}</b> <code>in tmute{self.duration_text()}</code>"
+                            + self.reason_text(),
                         )
                     else:
                         await self.message.edit(
@@ -422,6 +877,16 @@ class TimeMuteHandler:
             else:
                 await self.message.edit("<b>user_id or username</b>")
 
+    def duration_text(self) -> str:
+        if not self.seconds:
+            return ""
+        return f" for {timedelta(seconds=self.seconds)}"
+
+    def reason_text(self) -> str:
+        if not self.reason:
+            return ""
+        return f"\n<b>Cause:</b> <i>{self.reason}</i>"
+
     async def get_user_to_tmute(self):
         user_type = await check_username_or_id(self.cause.split(" ")[1])
         if user_type == "channel":
@@ -438,7 +903,6 @@ class TimeUnmuteHandler:
         self.message = message
         self.cause = text(message)
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
 
     async def handle_tunmute(self):
         if self.message.reply_to_message:
@@ -451,11 +915,9 @@ class TimeUnmuteHandler:
     async def handle_reply_tunmute(self):
         if self.message.chat.type not in ["private", "channel"]:
             user_for_tunmute, name = await get_user_and_name(self.message)
-            if user_for_tunmute not in self.tmuted_users:
+            if not tmutes.unmute(self.chat_id, user_for_tunmute):
                 await self.message.edit(f"<b>{name}</b> <code>not in tmute</code>")
             else:
-                self.tmuted_users.remove(user_for_tunmute)
-                db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
                 await self.message.edit(
                     f"<b>{name}</b> <code>tunmuted</code>"
                     + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=1)[1] + '</i>' if len(self.cause.split()) > 1 else ''}",
@@ -471,13 +933,11 @@ class TimeUnmuteHandler:
                         if getattr(user_to_tunmute, "first_name", None)
                         else user_to_tunmute.title
                     )
-                    if user_to_tunmute.id not in self.tmuted_users:
+                    if not tmutes.unmute(self.chat_id, user_to_tunmute.id):
                         await self.message.edit(
                             f"<b>{name}</b> <code>not in tmute</code>",
                         )
                     else:
-                        self.tmuted_users.remove(user_to_tunmute.id)
-                        db.set("core.ats", f"c{self.chat_id}", self.tmuted_users)
                         await self.message.edit(
                             f"<b>{name}</b> <code>tunmuted</code>"
                             + f"\n{'<b>Cause:</b> <i>' + self.cause.split(maxsplit=2)[2] + '</i>' if len(self.cause.split()) > 2 else ''}",
@@ -500,7 +960,7 @@ class TimeMuteUsersHandler:
         self.client = client
         self.message = message
         self.chat_id = message.chat.id
-        self.tmuted_users = db.get("core.ats", f"c{self.chat_id}", [])
+        self.tmuted_users = tmutes.users(self.chat_id)
 
     async def list_tmuted_users(self):
         if self.message.chat.type not in ["private", "channel"]:
@@ -511,7 +971,12 @@ class TimeMuteUsersHandler:
                     name = await self.get_user_name(user)
                     if name:
                         count += 1
-                        text += f"{count}. <b>{name}</b>\n"
+                        text += f"{count}. <b>{name}</b>"
+                        expiry = tmutes.expiry(self.chat_id, user)
+                        if expiry is not None:
+                            left = timedelta(seconds=int(max(0, expiry - time.time())))
+                            text += f" <i>({left} left)</i>"
+                        text += "\n"
                 except PeerIdInvalid:
                     pass
             if count == 0:
@@ -524,9 +989,10 @@ class TimeMuteUsersHandler:
 
     async def get_user_name(self, user_id):
         try:
-            _name_ = await self.client.get_chat(user_id)
+            _name_ = await moderation.call(self.client.get_chat, user_id)
             if await check_username_or_id(_name_.id) == "channel":
-                channel = await self.client.invoke(
+                channel = await moderation.call(
+                    self.client.invoke,
                     functions.channels.GetChannels(
                         id=[
                             types.InputChannel(
@@ -534,11 +1000,11 @@ class TimeMuteUsersHandler:
                                 access_hash=0,
                             )
                         ]
-                    )
+                    ),
                 )
                 return channel.chats[0].title
             if await check_username_or_id(_name_.id) == "user":
-                user = await self.client.get_users(_name_.id)
+                user = await moderation.call(self.client.get_users, _name_.id)
                 return user.first_name
         except PeerIdInvalid:
             return None
@@ -688,20 +1154,12 @@ class MuteHandler:
         return None
 
     def calculate_mute_seconds(self):
-        mute_seconds: int = 0
-        for character in "mhdw":
-            match = re.search(rf"(\d+|(\d+\.\d+)){character}", self.message.text)
-            if match:
-                value = float(match.string[match.start() : match.end() - 1])
-                if character == "m":
-                    mute_seconds += int(value * 60)
-                if character == "h":
-                    mute_seconds += int(value * 3600)
-                if character == "d":
-                    mute_seconds += int(value * 86400)
-                if character == "w":
-                    mute_seconds += int(value * 604800)
-        return mute_seconds
+        # `.mute 2h`, `.mute @user 1d 12h`: every duration word adds up
+        return sum(
+            parse_duration(word)
+            for word in self.message.text.lower().split()
+            if DURATION_ARGUMENT.fullmatch(word)
+        )
 
     async def mute_user(self, user_id, mute_seconds):
         try:
@@ -1105,6 +1563,440 @@ class AntiRaidHandler:
             await self.message.edit("<b>Anti-raid mode disabled</b>")
 
 
+DEFAULT_FLOOD_LIMITS = {
+    # (events, seconds) per sliding window
+    "joins": (10, 10),
+    "messages": (8, 5),
+    "duplicates": (4, 30),
+    # what happens to flooders, raiders are always banned
+    "action": "mute",
+    "mute_time": 600,
+    "raid_time": 600,
+}
+FLOOD_WINDOWS = ("joins", "messages", "duplicates")
+MAX_FLOOD_EVENTS = 50
+# shorter texts ("ok", "+", "lol") are too common to count as repeats
+MIN_DUPLICATE_LENGTH = 8
+
+
+def flood_limits(overrides: dict = None) -> dict:
+    """Per-chat anti-flood limits, `overrides` as stored in the database"""
+    limits = dict(DEFAULT_FLOOD_LIMITS)
+    for key, value in (overrides or {}).items():
+        if key not in limits:
+            continue
+        limits[key] = tuple(value) if key in FLOOD_WINDOWS else value
+    return limits
+
+
+def content_hash(message: Message) -> Optional[int]:
+    """Hash of what a message says, None for short texts and empty messages"""
+    if message.media:
+        media = getattr(message, message.media.value, None)
+        unique_id = getattr(media, "file_unique_id", None)
+        if unique_id:
+            return hash((unique_id, message.caption or ""))
+    content = " ".join((message.text or message.caption or "").lower().split())
+    if len(content) < MIN_DUPLICATE_LENGTH:
+        return None
+    return hash(content)
+
+
+class RingWindow:
+    """
+    The last `size` events of a sliding window in fixed arrays: time, user id
+    and message id. Once the oldest event kept is younger than the window,
+    `size` events happened inside it.
+    """
+
+    __slots__ = ("times", "users", "messages", "pos")
+
+    def __init__(self, size: int):
+        self.times = array("d", [-math.inf]) * size
+        self.users = array("q", [0]) * size
+        self.messages = array("q", [0]) * size
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def last(self) -> float:
+        return self.times[self.pos - 1]
+
+    def push(self, now: float, user_id: int, message_id: int) -> float:
+        """Add an event and return the age of the oldest one kept"""
+        pos = self.pos
+        self.times[pos] = now
+        self.users[pos] = user_id
+        self.messages[pos] = message_id
+        self.pos = (pos + 1) % len(self.times)
+        return now - self.times[self.pos]
+
+    def recent(self, now: float, window: float) -> List[tuple]:
+        """(user_id, message_id) of the events inside the window"""
+        return [
+            (self.users[i], self.messages[i])
+            for i in range(len(self.times))
+            if now - self.times[i] <= window
+        ]
+
+    def clear(self):
+        for i in range(len(self.times)):
+            self.times[i] = -math.inf
+
+
+class FloodVerdict:
+    __slots__ = ("reason", "action", "users", "messages")
+
+    def __init__(self, reason: str, action: str, events: List[tuple]):
+        self.reason = reason
+        self.action = action
+        self.users = {user_id for user_id, _ in events if user_id}
+        self.messages = {message_id for _, message_id in events if message_id}
+
+
+class ChatFloodState:
+    __slots__ = ("joins", "users", "hashes", "raid_until", "last_seen")
+
+    def __init__(self):
+        self.joins = None
+        self.users = OrderedDict()
+        self.hashes = OrderedDict()
+        self.raid_until = 0.0
+        self.last_seen = 0.0
+
+
+class FloodDetector:
+    """
+    Sliding-window counters of joins per chat, messages per user and repeated
+    content per user. Chats, users and hashes are kept in LRU order and the
+    ones idle for longer than their window are dropped, so memory stays
+    bounded no matter how many groups the account is in.
+    """
+
+    def __init__(
+        self, max_chats: int = 1024, max_users: int = 128, max_hashes: int = 256
+    ):
+        self.max_chats = max_chats
+        self.max_users = max_users
+        self.max_hashes = max_hashes
+        self._chats = OrderedDict()
+
+    @staticmethod
+    def _ring(entries: OrderedDict, key, size: int, limit: int) -> RingWindow:
+        ring = entries.get(key)
+        if ring is None or len(ring) != size:
+            ring = entries[key] = RingWindow(size)
+            if len(entries) > limit:
+                entries.popitem(last=False)
+        else:
+            entries.move_to_end(key)
+        return ring
+
+    @staticmethod
+    def _expire(entries: OrderedDict, now: float, window: float):
+        while entries:
+            key, ring = next(iter(entries.items()))
+            if now - ring.last <= window:
+                break
+            del entries[key]
+
+    def _chat(self, chat_id: int, now: float) -> ChatFloodState:
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = ChatFloodState()
+            while len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        state.last_seen = now
+        return state
+
+    @staticmethod
+    def _window(limits: dict, name: str) -> Tuple[int, float]:
+        count, seconds = limits[name]
+        return max(2, min(int(count), MAX_FLOOD_EVENTS)), float(seconds)
+
+    def message(
+        self,
+        chat_id: int,
+        user_id: int,
+        message_id: int,
+        content: Optional[int],
+        limits: dict,
+        now: float = None,
+    ) -> Optional[FloodVerdict]:
+        now = time.monotonic() if now is None else now
+        state = self._chat(chat_id, now)
+
+        count, window = self._window(limits, "messages")
+        self._expire(state.users, now, window)
+        ring = self._ring(state.users, user_id, count, self.max_users)
+        if ring.push(now, user_id, message_id) <= window:
+            verdict = FloodVerdict("flood", limits["action"], ring.recent(now, window))
+            ring.clear()
+            return verdict
+
+        if content is None:
+            return None
+        count, window = self._window(limits, "duplicates")
+        self._expire(state.hashes, now, window)
+        # per sender, the same short reply from several people isn't spam
+        ring = self._ring(state.hashes, (user_id, content), count, self.max_hashes)
+        if ring.push(now, user_id, message_id) <= window:
+            verdict = FloodVerdict(
+                "duplicates", limits["action"], ring.recent(now, window)
+            )
+            ring.clear()
+            return verdict
+        return None
+
+    def joined(
+        self,
+        chat_id: int,
+        user_ids: List[int],
+        message_id: int,
+        limits: dict,
+        now: float = None,
+    ) -> Optional[FloodVerdict]:
+        now = time.monotonic() if now is None else now
+        state = self._chat(chat_id, now)
+        events = [(user_id, message_id) for user_id in user_ids]
+        if now < state.raid_until:
+            return FloodVerdict("raid", "ban", events)
+
+        count, window = self._window(limits, "joins")
+        if state.joins is None or len(state.joins) != count:
+            state.joins = RingWindow(count)
+        raided = False
+        for user_id in user_ids:
+            raided |= state.joins.push(now, user_id, message_id) <= window
+        if not raided:
+            return None
+        state.raid_until = now + limits["raid_time"]
+        verdict = FloodVerdict("raid", "ban", state.joins.recent(now, window))
+        state.joins.clear()
+        return verdict
+
+    def raiding(self, chat_id: int) -> bool:
+        state = self._chats.get(chat_id)
+        return state is not None and time.monotonic() < state.raid_until
+
+    def forget(self, chat_id: int):
+        self._chats.pop(chat_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "chats": len(self._chats),
+            "users": sum(len(state.users) for state in self._chats.values()),
+            "hashes": sum(len(state.hashes) for state in self._chats.values()),
+        }
+
+
+class FloodActions:
+    """
+    Applies flood verdicts through the moderation executor. A sender is
+    punished once, and their new messages are deleted while it's queued.
+    """
+
+    def __init__(self):
+        self._punishing = {}
+
+    def submit(self, client: Client, chat_id: int, verdict: FloodVerdict, limits):
+        if verdict.messages:
+            moderation.delete(client, chat_id, verdict.messages)
+        punishing = self._punishing.setdefault(chat_id, set())
+        until = datetime.now() + timedelta(seconds=limits["mute_time"])
+        for user_id in verdict.users - punishing:
+            punishing.add(user_id)
+            if verdict.action == "ban":
+                future = moderation.ban(client, chat_id, user_id)
+            else:
+                future = moderation.mute(client, chat_id, user_id, until)
+            future.add_done_callback(
+                lambda _, user_id=user_id: self._done(chat_id, user_id)
+            )
+
+    def _done(self, chat_id: int, user_id: int):
+        punishing = self._punishing.get(chat_id)
+        if punishing is not None:
+            punishing.discard(user_id)
+            if not punishing:
+                del self._punishing[chat_id]
+
+    def track(self, client: Client, chat_id: int, user_id: int, message_id: int):
+        """Delete a message if its sender is about to be punished"""
+        if user_id in self._punishing.get(chat_id, ()):
+            moderation.delete(client, chat_id, [message_id])
+            return True
+        return False
+
+
+flood_detector = FloodDetector()
+flood_actions = FloodActions()
+
+
+class AntiFloodHandler:
+    def __init__(self, client: Client, message: Message):
+        self.client = client
+        self.message = message
+        self.chat_id = message.chat.id
+        self.prefix = prefix
+
+    async def handle_antiflood(self):
+        command = self.message.command
+        if len(command) == 1:
+            await self.show_status()
+        elif command[1] in ("on", "off"):
+            await self.switch(command[1] == "on")
+        elif command[1] in FLOOD_WINDOWS and len(command) == 4:
+            await self.set_limit(command[1], (command[2], command[3]))
+        elif command[1] == "action" and len(command) == 3:
+            await self.set_limit("action", command[2])
+        elif command[1] in ("mute_time", "raid_time") and len(command) == 3:
+            await self.set_limit(command[1], command[2])
+        else:
+            await self.message.edit(
+                f"<b>Usage: </b><code>{self.prefix}help admintool</code>"
+            )
+
+    async def switch(self, enabled: bool):
+        if enabled:
+            group = await self.client.get_chat(self.chat_id)
+            db.set(
+                "core.ats",
+                f"linked{self.chat_id}",
+                group.linked_chat.id if group.linked_chat else 0,
+            )
+        else:
+            flood_detector.forget(self.chat_id)
+        db.set("core.ats", f"antiflood{self.chat_id}", enabled)
+        await self.message.edit(
+            f"<b>Anti-flood {'enabled' if enabled else 'disabled'}</b>"
+        )
+
+    async def set_limit(self, key: str, value):
+        try:
+            if key in FLOOD_WINDOWS:
+                value = [int(value[0]), float(value[1])]
+                if not 2 <= value[0] <= MAX_FLOOD_EVENTS or value[1] <= 0:
+                    raise ValueError
+            elif key == "action":
+                if value not in ("mute", "ban"):
+                    raise ValueError
+            else:
+                value = int(value)
+                if value <= 0:
+                    raise ValueError
+        except ValueError:
+            return await self.message.edit("<b>Invalid value</b>")
+
+        overrides = db.get("core.ats", f"antiflood_limits{self.chat_id}", {})
+        overrides[key] = value
+        db.set("core.ats", f"antiflood_limits{self.chat_id}", overrides)
+        await self.show_status()
+
+    async def show_status(self):
+        enabled = db.get("core.ats", f"antiflood{self.chat_id}", False)
+        limits = flood_limits(db.get("core.ats", f"antiflood_limits{self.chat_id}"))
+        text = f"<b>Anti-flood is {'on' if enabled else 'off'}</b>\n"
+        for name in FLOOD_WINDOWS:
+            count, seconds = limits[name]
+            text += f"\n<b>{name}:</b> {count} per {seconds:g}s"
+        text += (
+            f"\n<b>action:</b> {limits['action']} "
+            f"(mute for {limits['mute_time']}s)"
+            f"\n<b>raid mode:</b> {limits['raid_time']}s"
+        )
+        if flood_detector.raiding(self.chat_id):
+            text += "\n\n<b>Raid in progress, new members are banned</b>"
+        await self.message.edit(text)
+
+
+class ResolvedMediaCache:
+    """
+    TTL/LRU cache of stored filter and note messages, resolved for re-sending.
+    Keyed by (CHAT_ID, MESSAGE_ID) of the copy in the notes chat.
+    """
+
+    def __init__(self, maxsize: int = 256, ttl: float = 3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, chat_id: int, message_id: int):
+        entry = self._entries.get((chat_id, message_id))
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._entries[(chat_id, message_id)]
+            return None
+        self._entries.move_to_end((chat_id, message_id))
+        return value
+
+    def put(self, chat_id: int, message_id: int, value):
+        self._entries[(chat_id, message_id)] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end((chat_id, message_id))
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, chat_id: int, message_id: int):
+        self._entries.pop((chat_id, message_id), None)
+
+
+resolved_media = ResolvedMediaCache()
+
+
+async def resolve_stored_message(
+    client: Client, chat_id: int, message_id: int, media_group: bool
+) -> Union[Message, List]:
+    """Get a stored message, or the InputMedia list of its media group"""
+    resolved = resolved_media.get(chat_id, message_id)
+    if resolved is not None:
+        return resolved
+    if media_group:
+        resolved = NoteSendHandler.prepare_media_group(
+            await client.get_media_group(chat_id, message_id)
+        )
+    else:
+        resolved = await client.get_messages(chat_id, message_id)
+        if resolved.empty:
+            raise MessageIdInvalid
+    resolved_media.put(chat_id, message_id, resolved)
+    return resolved
+
+
+async def send_stored_message(
+    client: Client, chat_id: int, stored: dict, reply_to_message_id: int = None
+):
+    """
+    Send a saved filter/note ({"CHAT_ID", "MESSAGE_ID", "MEDIA_GROUP"}) to chat_id.
+    The resolved message is cached, so a repeated send is a single request.
+    Expired file references re-resolve the message once.
+    """
+    from_chat_id, message_id = int(stored["CHAT_ID"]), int(stored["MESSAGE_ID"])
+    media_group = bool(stored.get("MEDIA_GROUP"))
+    for retry in (False, True):
+        resolved = await resolve_stored_message(
+            client, from_chat_id, message_id, media_group
+        )
+        try:
+            if media_group:
+                return await client.send_media_group(
+                    chat_id, resolved, reply_to_message_id=reply_to_message_id
+                )
+            return await resolved.copy(chat_id, reply_to_message_id=reply_to_message_id)
+        except (FileReferenceExpired, FileReferenceInvalid):
+            resolved_media.invalidate(from_chat_id, message_id)
+            if retry:
+                raise
+        except RPCError:
+            resolved_media.invalidate(from_chat_id, message_id)
+            raise
+
+
 class NoteSendHandler:
     def __init__(self, client: Client, message: Message):
         self.client = client
@@ -1143,89 +2035,71 @@ class NoteSendHandler:
             await self.copy_message(find_note)
 
     async def send_media_group(self, find_note):
-        messages_grouped = await self.client.get_media_group(
-            int(find_note["CHAT_ID"]), int(find_note["MESSAGE_ID"])
+        await send_stored_message(
+            self.client,
+            self.message.chat.id,
+            find_note,
+            reply_to_message_id=self.reply_to_message_id,
         )
-        media_grouped_list = self.prepare_media_group(messages_grouped)
-        if self.message.reply_to_message:
-            await self.client.send_media_group(
-                self.message.chat.id,
-                media_grouped_list,
-                reply_to_message_id=self.message.reply_to_message.id,
-            )
-        else:
-            await self.client.send_media_group(self.message.chat.id, media_grouped_list)
 
     async def copy_message(self, find_note):
+        await send_stored_message(
+            self.client,
+            self.message.chat.id,
+            find_note,
+            reply_to_message_id=self.reply_to_message_id,
+        )
+
+    @property
+    def reply_to_message_id(self):
         if self.message.reply_to_message:
-            await self.client.copy_message(
-                self.message.chat.id,
-                int(find_note["CHAT_ID"]),
-                int(find_note["MESSAGE_ID"]),
-                reply_to_message_id=self.message.reply_to_message.id,
-            )
-        else:
-            await self.client.copy_message(
-                self.message.chat.id,
-                int(find_note["CHAT_ID"]),
-                int(find_note["MESSAGE_ID"]),
-            )
+            return self.message.reply_to_message.id
+        return None
 
-    def prepare_media_group(self, messages_grouped):
+    @staticmethod
+    def prepare_media_group(messages_grouped):
         media_grouped_list = []
         for _ in messages_grouped:
             if _.photo:
-                media_grouped_list.append(self.prepare_photo(_))
+                media_grouped_list.append(NoteSendHandler.prepare_photo(_))
             elif _.video:
-                media_grouped_list.append(self.prepare_video(_))
+                media_grouped_list.append(NoteSendHandler.prepare_video(_))
             elif _.audio:
-                media_grouped_list.append(self.prepare_audio(_))
+                media_grouped_list.append(NoteSendHandler.prepare_audio(_))
             elif _.document:
-                media_grouped_list.append(self.prepare_document(_))
+                media_grouped_list.append(NoteSendHandler.prepare_document(_))
         return media_grouped_list
 
     @staticmethod
     def prepare_photo(message):
-        if message.caption:
-            return InputMediaPhoto(message.photo.file_id, message.caption.markdown)
-        return InputMediaPhoto(message.photo.file_id)
+        return InputMediaPhoto(
+            message.photo.file_id,
+            message.caption or "",
+            caption_entities=message.caption_entities,
+        )
 
     @staticmethod
     def prepare_video(message):
-        if message.caption:
-            if message.video.thumbs:
-                return InputMediaVideo(
-                    message.video.file_id,
-                    message.video.thumbs[0].file_id,
-                    message.caption.markdown,
-                )
-            return InputMediaVideo(message.video.file_id, message.caption.markdown)
-        if message.video.thumbs:
-            return InputMediaVideo(
-                message.video.file_id, message.video.thumbs[0].file_id
-            )
-        return InputMediaVideo(message.video.file_id)
+        return InputMediaVideo(
+            message.video.file_id,
+            message.video.thumbs[0].file_id if message.video.thumbs else None,
+            message.caption or "",
+            caption_entities=message.caption_entities,
+        )
 
     @staticmethod
     def prepare_audio(message):
-        if message.caption:
-            return InputMediaAudio(message.audio.file_id, message.caption.markdown)
-        return InputMediaAudio(message.audio.file_id)
+        return InputMediaAudio(
+            message.audio.file_id,
+            caption=message.caption or "",
+            caption_entities=message.caption_entities,
+        )
 
     @staticmethod
     def prepare_document(message):
-        if message.caption:
-            if message.document.thumbs:
-                return InputMediaDocument(
-                    message.document.file_id,
-                    message.document.thumbs[0].file_id,
-                    message.caption.markdown,
-                )
-            return InputMediaDocument(
-                message.document.file_id, message.caption.markdown
-            )
-        if message.document.thumbs:
-            return InputMediaDocument(
-                message.document.file_id, message.document.thumbs[0].file_id
-            )
-        return InputMediaDocument(message.document.file_id)
+        return InputMediaDocument(
+            message.document.file_id,
+            message.document.thumbs[0].file_id if message.document.thumbs else None,
+            message.caption or "",
+            caption_entities=message.caption_entities,
+        )
@@ -0,0 +1,419 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import ast
+import asyncio
+import hashlib
+import json
+import logging
+import sys
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pyrogram import Client, ContinuePropagation, StopPropagation, filters
+from pyrogram.handlers import MessageHandler
+from pyrogram.types import Message
+
+from utils.misc import modules_help, prefix, requirements_list
+from utils.scripts import (
+    load_module,
+    module_handlers,
+    parse_meta_comments,
+    swap_handlers,
+)
+
+MANIFEST_PATH = ".module_manifest.json"
+MANIFEST_VERSION = 5
+
+# calls that hook a module into the bot when it's imported
+REGISTRATION_CALLS = {
+    "add_handler",
+    "create_task",
+    "ensure_future",
+    "register",
+    "start",
+    "subscribe",
+}
+
+
+def _command_names(expr: ast.expr) -> Optional[List[str]]:
+    """Commands of a `filters.command([...], prefix) & ...` filter expression"""
+    if isinstance(expr, ast.BinOp) and isinstance(expr.op, ast.BitAnd):
+        return _command_names(expr.left) or _command_names(expr.right)
+    if not (
+        isinstance(expr, ast.Call)
+        and isinstance(expr.func, ast.Attribute)
+        and expr.func.attr == "command"
+        and isinstance(expr.func.value, ast.Name)
+        and expr.func.value.id == "filters"
+        and len(expr.args) == 2
+        and isinstance(expr.args[1], ast.Name)
+        and expr.args[1].id == "prefix"
+    ):
+        return None
+    try:
+        commands = _static_value(expr.args[0])
+    except (ValueError, TypeError):
+        return None
+    if isinstance(commands, str):
+        commands = [commands]
+    return [command.lower() for command in commands]
+
+
+def _requires_me(expr: ast.expr) -> bool:
+    """Whether a `... & filters.me & ...` filter expression only matches own messages"""
+    if isinstance(expr, ast.BinOp) and isinstance(expr.op, ast.BitAnd):
+        return _requires_me(expr.left) or _requires_me(expr.right)
+    return (
+        isinstance(expr, ast.Attribute)
+        and expr.attr == "me"
+        and isinstance(expr.value, ast.Name)
+        and expr.value.id == "filters"
+    )
+
+
+def _static_value(node: ast.expr):
+    """Evaluate a literal, also with `+` concatenation and `{prefix}` f-strings"""
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.Dict) and None not in node.keys:
+        return {
+            _static_value(key): _static_value(value)
+            for key, value in zip(node.keys, node.values)
+        }
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_static_value(element) for element in node.elts]
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return _static_value(node.left) + _static_value(node.right)
+    if isinstance(node, ast.JoinedStr):
+        parts = []
+        for value in node.values:
+            if isinstance(value, ast.FormattedValue):
+                if not (
+                    isinstance(value.value, ast.Name)
+                    and value.value.id == "prefix"
+                    and value.conversion == -1
+                    and value.format_spec is None
+                ):
+                    raise ValueError("unsupported f-string")
+                parts.append(prefix)
+            else:
+                parts.append(value.value)
+        return "".join(parts)
+    raise ValueError(f"not a static value: {ast.dump(node)}")
+
+
+def _module_imports(tree: ast.AST) -> List[str]:
+    """Other bot modules (`modules.*`) a module imports"""
+    imports = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            # `from modules.custom_modules import x` may import a submodule
+            names = [node.module] + [f"{node.module}.{a.name}" for a in node.names]
+        else:
+            continue
+        imports.extend(name for name in names if name.startswith("modules."))
+    return imports
+
+
+def _library_imports(tree: ast.AST) -> Tuple[Dict[str, str], bool]:
+    """
+    Libraries a module loads with `import_library(name, package)`, which runs
+    pip when they are missing, and whether some of the calls aren't literal
+    """
+    libraries = {}
+    dynamic = False
+    for call in ast.walk(tree):
+        if not isinstance(call, ast.Call):
+            continue
+        func = call.func
+        name = func.id if isinstance(func, ast.Name) else getattr(func, "attr", None)
+        if name != "import_library":
+            continue
+        try:
+            args = [_static_value(arg) for arg in call.args]
+        except (ValueError, TypeError):
+            dynamic = True
+            continue
+        if not args or not all(isinstance(arg, str) for arg in args):
+            dynamic = True
+            continue
+        libraries[args[0]] = args[1] if len(args) > 1 else args[0]
+    return libraries, dynamic
+
+
+def _registers(node: ast.AST) -> bool:
+    return any(
+        isinstance(call, ast.Call)
+        and isinstance(call.func, ast.Attribute)
+        and (call.func.attr in REGISTRATION_CALLS or call.func.attr.startswith("on_"))
+        for call in ast.walk(node)
+    )
+
+
+def scan_module(code: str) -> dict:
+    """
+    Commands, help and requirements of a module, read from its source without
+    importing it. A module is `lazy` when all its handlers are
+    `Client.on_message` with a literal `filters.command(..., prefix)`, its help
+    is static and nothing registers itself at import time. Modules that do
+    register something (`registers`) are imported one at a time. `imports`
+    lists the other bot modules it imports, see build_manifest. `public`
+    commands are the ones whose filter lets other users' messages through.
+    `libraries` maps what it loads with import_library to pip packages, and
+    `installs` is set when it calls import_library at all.
+    """
+    meta = parse_meta_comments(code)
+    manifest = {
+        "commands": [],
+        "public": [],
+        "help": None,
+        "meta": meta,
+        "requires": meta.get("requires", "").split(),
+        "lazy": True,
+        "registers": False,
+        "imports": [],
+        "libraries": {},
+        "installs": False,
+    }
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        manifest["lazy"] = False
+        return manifest
+
+    manifest["imports"] = _module_imports(tree)
+    manifest["libraries"], dynamic = _library_imports(tree)
+    manifest["installs"] = dynamic or bool(manifest["libraries"])
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            continue
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            for decorator in node.decorator_list:
+                if not isinstance(decorator, ast.Call) or not _registers(decorator):
+                    continue
+                if not (
+                    isinstance(decorator.func, ast.Attribute)
+                    and isinstance(decorator.func.value, ast.Name)
+                    and decorator.func.value.id == "Client"
+                ):
+                    # pipeline consumers and the like change shared state
+                    manifest["registers"] = True
+                commands = None
+                if (
+                    isinstance(decorator.func, ast.Attribute)
+                    and decorator.func.attr == "on_message"
+                    and isinstance(decorator.func.value, ast.Name)
+                    and decorator.func.value.id == "Client"
+                    and decorator.args
+                ):
+                    commands = _command_names(decorator.args[0])
+                if commands is None:
+                    manifest["lazy"] = False
+                else:
+                    manifest["commands"].extend(commands)
+                    if not _requires_me(decorator.args[0]):
+                        manifest["public"].extend(commands)
+            continue
+        if (
+            isinstance(node, ast.Assign)
+            and len(node.targets) == 1
+            and isinstance(node.targets[0], ast.Subscript)
+            and isinstance(node.targets[0].value, ast.Name)
+            and node.targets[0].value.id == "modules_help"
+        ):
+            try:
+                manifest["help"] = [
+                    _static_value(node.targets[0].slice),
+                    _static_value(node.value),
+                ]
+            except (ValueError, TypeError):
+                manifest["lazy"] = False
+            continue
+        if _registers(node):
+            manifest["lazy"] = False
+            manifest["registers"] = True
+
+    if not manifest["commands"] or manifest["help"] is None:
+        manifest["lazy"] = False
+    return manifest
+
+
+def build_manifest(paths: Iterable[Path], cache_path: str = MANIFEST_PATH) -> dict:
+    """
+    Scan modules, reusing cached entries of files whose hash didn't change.
+    Modules imported by another module aren't lazy: they'd be in sys.modules
+    without their handlers once the importing module is loaded.
+    """
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+        # help texts have the prefix filled in
+        if cache.get("version") != MANIFEST_VERSION or cache.get("prefix") != prefix:
+            cache = {}
+    except (OSError, ValueError):
+        cache = {}
+    cached = cache.get("modules", {})
+
+    modules = {}
+    changed = False
+    for path in paths:
+        code = path.read_bytes()
+        digest = hashlib.sha256(code).hexdigest()
+        entry = cached.get(str(path))
+        if entry is None or entry["hash"] != digest:
+            entry = scan_module(code.decode("utf-8"))
+            entry["hash"] = digest
+            changed = True
+        modules[str(path)] = entry
+
+    if changed or len(modules) != len(cached):
+        try:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": MANIFEST_VERSION, "prefix": prefix, "modules": modules},
+                    f,
+                )
+        except OSError:
+            logging.warning("Can't write module manifest %s", cache_path)
+
+    imported = {
+        str(Path(*name.split("."))) + ".py"
+        for entry in modules.values()
+        for name in entry["imports"]
+    }
+    for path in imported & modules.keys():
+        if modules[path]["lazy"]:
+            modules[path] = {**modules[path], "lazy": False}
+    return modules
+
+
+class LazyModules:
+    """
+    Modules known from the manifest but not imported yet.
+
+    Their help is shown right away and their commands are routed to one
+    handler, which imports the module the first time one of them is used and
+    replays that message to the module's own handlers. Later messages go to
+    those handlers directly.
+    """
+
+    # handler group of the dispatcher, runs before the pipeline and modules
+    group = -2
+
+    def __init__(self):
+        # commands of modules not imported yet, checked by the filter
+        self._commands = {}
+        # deferred commands that other users can run too
+        self._public = set()
+        # every deferred command, for messages that passed the filter while
+        # their module was being imported
+        self._routes = {}
+        self._meta = {}
+        self._locks = {}
+
+    def defer(self, module_name: str, core: bool, manifest: dict):
+        for command in manifest["commands"]:
+            self._commands[command] = (module_name, core)
+            self._routes[command] = (module_name, core)
+        self._public.update(manifest["public"])
+        self._meta[module_name] = manifest["meta"]
+        help_name, help_commands = manifest["help"]
+        modules_help[help_name] = help_commands
+        requirements_list.extend(manifest["requires"])
+
+    def forget(self, module_name: str):
+        for command, (name, _) in list(self._commands.items()):
+            if name == module_name:
+                del self._commands[command]
+
+    @property
+    def pending(self) -> set:
+        return {name for name, _ in self._commands.values()}
+
+    def _command(self, message: Message) -> Optional[str]:
+        text = message.text or message.caption
+        if not text or not text.startswith(prefix):
+            return None
+        command = text[len(prefix) :].split(maxsplit=1)
+        return command[0].lower() if command else None
+
+    async def _match(self, client: Client, message: Message) -> bool:
+        # only what the module's own handler would accept imports the module
+        command = self._command(message)
+        if command not in self._commands:
+            return False
+        return command in self._public or await filters.me(client, message)
+
+    async def dispatch(self, client: Client, message: Message):
+        route = self._routes.get(self._command(message))
+        if route is None:
+            return
+        module_name, core = route
+        path = f"modules.{'' if core else 'custom_modules.'}{module_name}"
+
+        # messages that wait here are replayed too once the module is live
+        lock = self._locks.setdefault(module_name, asyncio.Lock())
+        async with lock:
+            if module_name in self.pending:
+                self.forget(module_name)
+                module = sys.modules.get(path)
+                if module is None:
+                    try:
+                        module = await load_module(
+                            module_name,
+                            client,
+                            core=core,
+                            meta=self._meta.pop(module_name),
+                        )
+                    except Exception:
+                        logging.warning(
+                            "Can't import module %s", module_name, exc_info=True
+                        )
+                        return
+                else:
+                    # imported by another module, its handlers were never added
+                    swap_handlers(client, [], module_handlers(module))
+                    module.__meta__ = self._meta.pop(module_name)
+            module = sys.modules.get(path)
+        self._locks.pop(module_name, None)
+        if module is None:
+            # unloaded meanwhile
+            return
+
+        # the dispatcher is still going through the handlers it had before
+        # the module's were swapped in, so they don't see this message
+        handlers = {}
+        for handler, group in module_handlers(module):
+            handlers.setdefault(group, []).append(handler)
+        for group in sorted(handlers):
+            for handler in handlers[group]:
+                try:
+                    if await handler.check(client, message):
+                        await handler.callback(client, message)
+                        break
+                except StopPropagation:
+                    return
+                except ContinuePropagation:
+                    continue
+
+    def handler(self) -> MessageHandler:
+        return MessageHandler(self.dispatch, filters.create(self._match))
+
+
+lazy_modules = LazyModules()
@@ -16,14 +16,15 @@
 
 from sys import version_info
 from .db import db
-import git
+from .buildinfo import ensure_repo, load_build_info
+from .startup import startup
 
 __all__ = [
     "modules_help",
     "requirements_list",
     "python_version",
     "prefix",
-    "gitrepo",
+    "build_info",
     "userbot_version",
 ]
 
@@ -35,21 +36,15 @@ python_version = f"{version_info[0]}.{version_info[1]}.{version_info[2]}"
 
 prefix = db.get("core.main", "prefix", ".")
 
-try:
-    gitrepo = git.Repo(".")
-except git.exc.InvalidGitRepositoryError:
-    repo = git.Repo.init()
-    origin = repo.create_remote(
-        "origin", "https://github.com/The-MoonTg-project/Moon-Userbot"
-    )
-    origin.fetch()
-    repo.create_head("main", origin.refs.main)
-    repo.heads.main.set_tracking_branch(origin.refs.main)
-    repo.heads.main.checkout(True)
-    gitrepo = git.Repo(".")
-
-if len(gitrepo.tags) > 0:
-    commits_since_tag = list(gitrepo.iter_commits(f"{gitrepo.tags[-1].name}..HEAD"))
-else:
-    commits_since_tag = []
-userbot_version = f"2.0.{len(commits_since_tag)}"
+with startup.phase("build info"):
+    build_info = load_build_info()
+userbot_version = build_info["version"]
+
+
+def __getattr__(name):
+    # opening the repository is left to the modules that still use it
+    global gitrepo
+    if name == "gitrepo":
+        gitrepo = ensure_repo()
+        return gitrepo
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
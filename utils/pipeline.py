@@ -0,0 +1,270 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import copy
+import logging
+import re
+from typing import Callable, Iterable, Optional, Union
+
+from pyrogram import Client, ContinuePropagation, StopPropagation
+from pyrogram.filters import Filter
+from pyrogram.handlers import MessageHandler
+from pyrogram.handlers.handler import Handler
+from pyrogram.types import Message
+
+from utils.db import db
+from utils.features import features
+
+
+def chat_keys(*patterns: str) -> Callable[[str], Optional[int]]:
+    """
+    `watch_chat` for per-chat keys like `antiraid{chat_id}`: the chat a changed
+    key belongs to, None for keys matching none of the patterns
+    """
+    regexes = [
+        re.compile("^" + re.escape(pattern).replace(r"\{chat_id\}", r"(-?\d+)") + "$")
+        for pattern in patterns
+    ]
+
+    def chat_of(variable: str) -> Optional[int]:
+        for regex in regexes:
+            match = regex.match(variable)
+            if match:
+                return int(match.group(1))
+        return None
+
+    return chat_of
+
+
+class MessageContext:
+    """Per-message data shared by every pipeline consumer"""
+
+    __slots__ = ("chat_id", "chat_key", "topic_id", "sender_id", "settings")
+
+    def __init__(self, message: Message):
+        self.chat_id = message.chat.id
+        self.chat_key = str(message.chat.id)
+        self.topic_id = f"{self.chat_key}:{message.message_thread_id}"
+        if message.from_user:
+            self.sender_id = message.from_user.id
+        elif message.sender_chat:
+            self.sender_id = message.sender_chat.id
+        else:
+            self.sender_id = None
+        # result of the consumer's `load` for this chat, set before each call
+        self.settings = None
+
+    def with_settings(self, settings) -> "MessageContext":
+        """Own copy for a consumer that keeps running after dispatch moved on"""
+        context = copy.copy(self)
+        context.settings = settings
+        return context
+
+
+class PipelineConsumer:
+    def __init__(
+        self,
+        callback: Callable,
+        filters: Filter = None,
+        load: Callable = None,
+        watch: Iterable[str] = (),
+        feature: int = 0,
+        background: bool = False,
+        watch_chat: Callable[[str], Optional[int]] = None,
+    ):
+        self.callback = callback
+        # plain Handler: only the filters check, without MessageHandler listeners
+        self.handler = Handler(callback, filters)
+        self.load = load
+        self.watch = tuple(watch)
+        self.watch_chat = watch_chat
+        self.feature = feature
+        self.background = background
+        self.module = callback.__module__
+
+
+class MessagePipeline:
+    """
+    Single pre-dispatch stage for catch-all message handlers.
+
+    Consumers register with `load(chat_id)`, which returns the module's settings
+    for a chat or a falsy value when the module is off there. The result is
+    cached per chat until a key of one of the `watch`ed database modules
+    changes, so chats where a module is disabled don't reach it at all. With
+    `watch_chat(variable)` only the route of the chat a changed key belongs
+    to is dropped, and keys it returns None for are ignored.
+    Consumers can also pass a `feature` mask from utils.features. They are
+    only called in chats where one of those bits is set, and messages from
+    chats without any bit a consumer needs are dropped in constant time.
+
+    Consumers that sleep or wait on the network pass `background=True`: once
+    their filters match they run as separate tasks, so the dispatcher worker
+    of the chat only waits for the filter checks and the inline consumers.
+    They can't stop the propagation to the consumers after them.
+    """
+
+    # handler group of the dispatcher, runs before the default group 0
+    group = -1
+
+    def __init__(self):
+        self._consumers = []
+        self._routes = {}
+        self._watched = set()
+        # union of consumer features, and whether some consumer has none
+        self._mask = 0
+        self._unconditional = False
+        # running background consumers, referenced until they finish
+        self._tasks = set()
+
+    def on_message(
+        self,
+        filters: Filter = None,
+        load: Callable = None,
+        watch: Union[str, Iterable[str]] = (),
+        feature: int = 0,
+        background: bool = False,
+        watch_chat: Callable[[str], Optional[int]] = None,
+    ):
+        """Register `callback(client, message, context)` as a consumer"""
+
+        def decorator(func: Callable) -> Callable:
+            self.register(
+                PipelineConsumer(
+                    func,
+                    filters,
+                    load,
+                    (watch,) if isinstance(watch, str) else watch,
+                    feature,
+                    background,
+                    watch_chat,
+                )
+            )
+            return func
+
+        return decorator
+
+    def register(self, consumer: PipelineConsumer):
+        self._consumers.append(consumer)
+        for module in consumer.watch:
+            if module not in self._watched:
+                self._watched.add(module)
+                db.subscribe(self.invalidate, module)
+        self._update_mask()
+        self._routes.clear()
+
+    def unregister_module(self, module_name: str) -> list:
+        """Drop consumers defined in a python module that is being unloaded"""
+        removed = [c for c in self._consumers if c.module == module_name]
+        self._consumers = [c for c in self._consumers if c.module != module_name]
+        self._update_mask()
+        self._routes.clear()
+        return removed
+
+    def _update_mask(self):
+        self._mask = 0
+        self._unconditional = False
+        for consumer in self._consumers:
+            self._mask |= consumer.feature
+            self._unconditional |= not consumer.feature
+
+    def invalidate(self, module: str = None, variable: str = None, *_):
+        if variable is None:
+            # a whole module changed, or removed by another process
+            self._routes.clear()
+            return
+        for consumer in self._consumers:
+            if module not in consumer.watch:
+                continue
+            if consumer.watch_chat is None:
+                self._routes.clear()
+                return
+            chat_id = consumer.watch_chat(variable)
+            if chat_id is not None:
+                self._routes.pop(chat_id, None)
+
+    def _route(self, chat_id: int) -> list:
+        route = []
+        for consumer in self._consumers:
+            if consumer.load is None:
+                route.append((consumer, None))
+                continue
+            try:
+                settings = consumer.load(chat_id)
+            except Exception:
+                logging.exception(
+                    "Pipeline consumer %r failed to load", consumer.callback
+                )
+                continue
+            if settings:
+                route.append((consumer, settings))
+        self._routes[chat_id] = route
+        return route
+
+    async def dispatch(self, client: Client, message: Message):
+        if message.chat is None:
+            return
+        bits = features.get(message.chat.id)
+        if not (bits & self._mask or self._unconditional):
+            return
+        route = self._routes.get(message.chat.id)
+        if route is None:
+            route = self._route(message.chat.id)
+        if not route:
+            return
+
+        context = MessageContext(message)
+        for consumer, settings in route:
+            if consumer.feature and not bits & consumer.feature:
+                continue
+            try:
+                if not await consumer.handler.check(client, message):
+                    continue
+                if consumer.background:
+                    self._spawn(consumer, client, message, context, settings)
+                    continue
+                context.settings = settings
+                await consumer.callback(client, message, context)
+            except StopPropagation:
+                break
+            except ContinuePropagation:
+                continue
+            except Exception:
+                logging.exception("Pipeline consumer %r failed", consumer.callback)
+
+    def _spawn(self, consumer, client, message, context, settings):
+        # the task runs the callback's own coroutine, so reloading the module
+        # cancels it like the module's other tasks
+        task = asyncio.create_task(
+            consumer.callback(client, message, context.with_settings(settings)),
+            name=f"pipeline {consumer.module}.{consumer.callback.__name__}",
+        )
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if task.cancelled():
+            return
+        e = task.exception()
+        if e is not None and not isinstance(e, (StopPropagation, ContinuePropagation)):
+            logging.error("Pipeline consumer %s failed", task.get_name(), exc_info=e)
+
+    def handler(self) -> MessageHandler:
+        return MessageHandler(self.dispatch)
+
+
+pipeline = MessagePipeline()
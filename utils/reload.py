@@ -0,0 +1,187 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import asyncio
+import hashlib
+import importlib
+import importlib.util
+import logging
+import statistics
+import sys
+import time
+from types import ModuleType
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from pyrogram import Client
+
+from utils.db import db
+from utils.lazy import lazy_modules
+from utils.misc import modules_help, requirements_list
+from utils.pipeline import pipeline
+from utils.scripts import (
+    install_requirements,
+    missing_requirements,
+    module_handlers,
+    parse_meta_comments,
+    swap_handlers,
+)
+
+CUSTOM_MODULES = "modules.custom_modules"
+CUSTOM_MODULES_DIR = "modules/custom_modules"
+
+
+def module_tasks(module: ModuleType) -> List[asyncio.Task]:
+    """Running tasks whose coroutine function is defined in a module"""
+    current = asyncio.current_task()
+    tasks = []
+    for task in asyncio.all_tasks():
+        frame = getattr(task.get_coro(), "cr_frame", None)
+        if task is not current and frame is not None:
+            if frame.f_globals is vars(module):
+                tasks.append(task)
+    return tasks
+
+
+def restart_seconds() -> Optional[float]:
+    """Usual duration of a restart, from the startup history"""
+    history = db.get("core.startup", "history", [])
+    if not history:
+        return None
+    return statistics.median(run["total"] for run in history)
+
+
+def _replace(
+    client: Client, name: str, code: bytes, meta: Dict[str, str]
+) -> ModuleType:
+    """
+    Import a custom module from `code` and put it in place of the loaded one.
+
+    Runs without awaiting, so no update is handled between the old module
+    going away and the new one being live. If the new code fails to import,
+    the old module keeps running untouched.
+    """
+    path = f"{CUSTOM_MODULES}.{name}"
+    package = importlib.import_module(CUSTOM_MODULES)
+    old = sys.modules.get(path)
+    old_tasks = module_tasks(old) if old is not None else []
+    help_before = dict(modules_help)
+
+    spec = importlib.util.spec_from_file_location(
+        path, f"{CUSTOM_MODULES_DIR}/{name}.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    subscriptions = db.events.unsubscribe_module(path)
+    consumers = pipeline.unregister_module(path)
+    sys.modules[path] = module
+    try:
+        exec(compile(code, spec.origin, "exec"), vars(module))
+    except BaseException:
+        for task in module_tasks(module):
+            task.cancel()
+        db.events.unsubscribe_module(path)
+        pipeline.unregister_module(path)
+        for callback, db_module, variable in subscriptions:
+            db.subscribe(callback, db_module, variable)
+        for consumer in consumers:
+            pipeline.register(consumer)
+        modules_help.clear()
+        modules_help.update(help_before)
+        if old is None:
+            del sys.modules[path]
+        else:
+            sys.modules[path] = old
+        raise
+
+    module.__meta__ = meta
+    module.__source_hash__ = hashlib.sha256(code).hexdigest()
+    setattr(package, name, module)
+    lazy_modules.forget(name)
+    swap_handlers(
+        client, module_handlers(old) if old is not None else [], module_handlers(module)
+    )
+    for task in old_tasks:
+        task.cancel()
+    requirements_list.extend(meta.get("requires", "").split())
+    return module
+
+
+async def reload_modules(
+    client: Client, names: Iterable[str], force: bool = False
+) -> Tuple[Dict[str, float], Dict[str, BaseException]]:
+    """
+    Hot-reload custom modules from their files, without restarting.
+
+    Modules whose source didn't change since they were imported are skipped
+    unless `force` is set. Missing requirements are installed with one pip
+    call first. Each module's old handlers, database subscriptions, pipeline
+    consumers and background tasks are replaced by the ones the new code
+    registers. Returns reload seconds per module and errors per module.
+    """
+    sources = {}
+    errors = {}
+    for name in dict.fromkeys(names):
+        try:
+            with open(f"{CUSTOM_MODULES_DIR}/{name}.py", "rb") as f:
+                code = f.read()
+        except OSError as e:
+            errors[name] = e
+            continue
+        loaded = sys.modules.get(f"{CUSTOM_MODULES}.{name}")
+        digest = hashlib.sha256(code).hexdigest()
+        if not force and getattr(loaded, "__source_hash__", None) == digest:
+            continue
+        sources[name] = (code, parse_meta_comments(code.decode("utf-8")))
+
+    missing = missing_requirements(
+        package
+        for _, meta in sources.values()
+        for package in meta.get("requires", "").split()
+    )
+    if missing and not await install_requirements(missing):
+        logging.warning("Failed to install requirements: %s", " ".join(missing))
+
+    timings = {}
+    for name, (code, meta) in sources.items():
+        start = time.perf_counter()
+        try:
+            _replace(client, name, code, meta)
+        except Exception as e:
+            errors[name] = e
+            logging.warning("Can't reload module %s", name, exc_info=e)
+            continue
+        timings[name] = time.perf_counter() - start
+    return timings, errors
+
+
+def unload(client: Client, name: str) -> bool:
+    """Remove a custom module with its handlers and background tasks"""
+    path = f"{CUSTOM_MODULES}.{name}"
+    lazy_modules.forget(name)
+    module = sys.modules.pop(path, None)
+    if module is None:
+        # deferred modules only have their help registered
+        return modules_help.pop(name, None) is not None
+
+    swap_handlers(client, module_handlers(module), [])
+    for task in module_tasks(module):
+        task.cancel()
+    db.events.unsubscribe_module(path)
+    pipeline.unregister_module(path)
+    modules_help.pop(name, None)
+    package = sys.modules.get(CUSTOM_MODULES)
+    if getattr(package, name, None) is module:
+        delattr(package, name)
+    return True
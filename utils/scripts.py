@@ -16,6 +16,10 @@
 
 import asyncio
 import importlib
+import importlib.metadata
+import importlib.util
+import itertools
+import logging
 import math
 import os
 import re
@@ -26,8 +30,10 @@ import time
 import traceback
 from PIL import Image
 from io import BytesIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from types import ModuleType
-from typing import Dict, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 import psutil
 from pyrogram import Client, errors, filters
@@ -36,8 +42,10 @@ from pyrogram.types import Message
 from pyrogram.enums import ChatMembersFilter
 
 from utils.db import db
+from utils.pipeline import pipeline
 
 from .misc import modules_help, prefix, requirements_list
+from .startup import EXEC_TIME_ENV
 
 META_COMMENTS = re.compile(r"^ *# *meta +(\S+) *: *(.*?)\s*$", re.MULTILINE)
 interact_with_to_delete = []
@@ -219,6 +227,8 @@ def restart() -> None:
             music_bot_process.terminate()
         except psutil.NoSuchProcess:
             print("Music bot is not running.")
+    db.close()
+    os.environ[EXEC_TIME_ENV] = str(time.time())
     os.execvp(sys.executable, [sys.executable, "main.py"])
 
 
@@ -301,6 +311,168 @@ async def interact_with(message: Message) -> Message:
     return response[0]
 
 
+class DeferredScheduler:
+    """
+    Timer wheel for delayed actions on messages: delete, edit and unmute.
+
+    A single task ticks while actions are pending, instead of one sleeping
+    coroutine per action. Deletions that fall due together are merged per chat
+    into delete_messages calls of up to 100 ids. Pending actions are stored in
+    core.scheduler and picked up again by start() after a restart.
+    """
+
+    ACTIONS = ("delete", "edit", "unmute")
+
+    def __init__(self, resolution: float = 1.0, slots: int = 512):
+        self.resolution = resolution
+        self.slots = slots
+        self._wheel = [[] for _ in range(slots)]
+        self._pending = {}
+        self._tick = self._now_tick()
+        self._seq = itertools.count()
+        self._client = None
+        self._task = None
+
+    def _now_tick(self) -> int:
+        return int(time.time() / self.resolution)
+
+    def start(self, client: Client):
+        """Attach the client and resume actions persisted before a restart"""
+        self._client = client
+        for action_id, entry in db.get_collection("core.scheduler").items():
+            if action_id not in self._pending:
+                self._insert(action_id, entry)
+        self._wake()
+
+    def schedule(self, action: str, chat_id, delay: float, **params) -> str:
+        if action not in self.ACTIONS:
+            raise ValueError(f"Unknown scheduler action: {action}")
+        action_id = f"{time.time_ns():x}{next(self._seq):x}"
+        entry = {"action": action, "chat_id": chat_id, "due": time.time() + delay}
+        entry.update(params)
+        db.set("core.scheduler", action_id, entry)
+        self._insert(action_id, entry)
+        self._wake()
+        return action_id
+
+    def delete_later(self, chat_id, message_ids, delay: float) -> str:
+        if isinstance(message_ids, int):
+            message_ids = [message_ids]
+        return self.schedule("delete", chat_id, delay, message_ids=list(message_ids))
+
+    def edit_later(self, chat_id, message_id: int, text: str, delay: float) -> str:
+        return self.schedule("edit", chat_id, delay, message_id=message_id, text=text)
+
+    def unmute_later(self, chat_id, user_id: int, delay: float) -> str:
+        return self.schedule("unmute", chat_id, delay, user_id=user_id)
+
+    def cancel(self, action_id: str) -> bool:
+        if self._pending.pop(action_id, None) is None:
+            return False
+        db.remove("core.scheduler", action_id)
+        return True
+
+    def _insert(self, action_id: str, entry: dict):
+        if not self._pending:
+            # the wheel is idle, move it to the current time
+            self._tick = self._now_tick()
+        self._pending[action_id] = entry
+        tick = max(int(entry["due"] / self.resolution), self._tick)
+        self._wheel[tick % self.slots].append(action_id)
+
+    def _wake(self):
+        if self._client is None or not self._pending:
+            return
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            now_tick = self._now_tick()
+            due = []
+            while self._tick <= now_tick:
+                slot = self._tick % self.slots
+                keep = []
+                for action_id in self._wheel[slot]:
+                    entry = self._pending.get(action_id)
+                    if entry is None:
+                        continue
+                    if int(entry["due"] / self.resolution) <= now_tick:
+                        due.append(action_id)
+                    else:
+                        keep.append(action_id)
+                self._wheel[slot] = keep
+                self._tick += 1
+            if due:
+                try:
+                    await self._execute(due)
+                except Exception:
+                    logging.exception("Scheduled actions %s failed", due)
+            await asyncio.sleep(self.resolution - time.time() % self.resolution)
+
+    async def _execute(self, action_ids: list):
+        try:
+            await self._run_actions(action_ids)
+        finally:
+            # done or failed, a due action is dropped and never run again
+            for action_id in action_ids:
+                db.remove("core.scheduler", action_id)
+
+    async def _run_actions(self, action_ids: list):
+        deletes = {}
+        others = []
+        for action_id in action_ids:
+            entry = self._pending.pop(action_id, None)
+            if entry is None:
+                continue
+            if entry["action"] == "delete":
+                deletes.setdefault(entry["chat_id"], []).extend(entry["message_ids"])
+            else:
+                others.append(entry)
+
+        for chat_id, message_ids in deletes.items():
+            for i in range(0, len(message_ids), 100):
+                await self._call(
+                    self._client.delete_messages, chat_id, message_ids[i : i + 100]
+                )
+        for entry in others:
+            if entry["action"] == "edit":
+                await self._call(
+                    self._client.edit_message_text,
+                    entry["chat_id"],
+                    entry["message_id"],
+                    entry["text"],
+                )
+            elif entry["action"] == "unmute":
+                await self._call(self._unmute, entry["chat_id"], entry["user_id"])
+
+    async def _unmute(self, chat_id, user_id: int):
+        chat = await self._client.get_chat(chat_id)
+        await self._client.restrict_chat_member(chat_id, user_id, chat.permissions)
+
+    @staticmethod
+    async def _call(func, *args):
+        for attempt in range(2):
+            try:
+                return await func(*args)
+            except FloodWait as e:
+                if attempt:
+                    logging.warning(
+                        "Scheduled %s%r dropped after a second FloodWait of %ss",
+                        func.__name__,
+                        args,
+                        e.value,
+                    )
+                    return None
+                await asyncio.sleep(e.value)
+            except Exception as e:
+                logging.warning("Scheduled %s%r failed: %s", func.__name__, args, e)
+                return None
+
+
+scheduler = DeferredScheduler()
+
+
 def format_module_help(module_name: str, full=True):
     commands = modules_help[module_name]
 
@@ -426,20 +598,50 @@ def resize_new_image(image_path, output_path, desired_width=None, desired_height
         os.remove(image_path)
 
 
+def module_handlers(module: ModuleType) -> list:
+    """(handler, group) pairs declared with Client.on_* decorators in a module"""
+    handlers = []
+    for _name, obj in vars(module).items():
+        if isinstance(getattr(obj, "handlers", []), list):
+            handlers.extend(getattr(obj, "handlers", []))
+    return handlers
+
+
+def swap_handlers(client: Client, remove: Iterable, add: Iterable):
+    """
+    Remove and add (handler, group) pairs in one step.
+
+    The handler groups are rebuilt as new lists and swapped in at once, so an
+    update that's being dispatched finishes on the old handlers and the next
+    one sees the new ones. Unlike client.add_handler this doesn't wait for
+    the dispatcher locks, which are held by the handler doing the load.
+    """
+    dispatcher = client.dispatcher
+    removed = {id(handler) for handler, _ in remove}
+    groups = {
+        group: [handler for handler in handlers if id(handler) not in removed]
+        for group, handlers in dispatcher.groups.items()
+    }
+    for handler, group in add:
+        groups.setdefault(group, []).append(handler)
+    dispatcher.groups = OrderedDict(sorted(groups.items(), key=lambda item: item[0]))
+
+
 async def load_module(
     module_name: str,
     client: Client,
     message: Message = None,
     core=False,
+    meta: Dict[str, str] = None,
 ) -> ModuleType:
     if module_name in modules_help and not core:
         await unload_module(module_name, client)
 
     path = f"modules.{'custom_modules.' if not core else ''}{module_name}"
 
-    with open(f"{path.replace('.', '/')}.py", encoding="utf-8") as f:
-        code = f.read()
-    meta = parse_meta_comments(code)
+    if meta is None:
+        with open(f"{path.replace('.', '/')}.py", encoding="utf-8") as f:
+            meta = parse_meta_comments(f.read())
 
     packages = meta.get("requires", "").split()
     requirements_list.extend(packages)
@@ -485,16 +687,137 @@ async def load_module(
 
         module = importlib.import_module(path)
 
-    for _name, obj in vars(module).items():
-        if isinstance(getattr(obj, "handlers", []), list):
-            for handler, group in getattr(obj, "handlers", []):
-                client.add_handler(handler, group)
+    swap_handlers(client, [], module_handlers(module))
 
     module.__meta__ = meta
 
     return module
 
 
+def missing_requirements(packages: Iterable[str]) -> List[str]:
+    """Packages, as in `# meta requires`, that aren't installed"""
+    missing = []
+    for package in dict.fromkeys(packages):
+        name = re.split(r"[<>=!~\[;@ ]", package, maxsplit=1)[0]
+        try:
+            importlib.metadata.distribution(name)
+        except importlib.metadata.PackageNotFoundError:
+            missing.append(package)
+    return missing
+
+
+async def install_requirements(packages: List[str], timeout: float = 300) -> bool:
+    proc = await asyncio.create_subprocess_exec(
+        sys.executable, "-m", "pip", "install", "-U", *packages
+    )
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        return False
+    return proc.returncode == 0
+
+
+def missing_libraries(libraries: Dict[str, str]) -> List[str]:
+    """Packages of the `{library: package}` pairs whose library can't be imported"""
+    missing = []
+    for library, package in libraries.items():
+        try:
+            found = importlib.util.find_spec(library) is not None
+        except (ImportError, ValueError):
+            found = False
+        if not found:
+            missing.append(package)
+    return missing
+
+
+def _timed_import(path: str) -> Tuple[ModuleType, float]:
+    start = time.perf_counter()
+    module = importlib.import_module(path)
+    return module, time.perf_counter() - start
+
+
+async def load_modules(
+    client: Client, modules: Dict[str, dict], workers: int = None
+) -> Tuple[Dict[str, float], Dict[str, BaseException]]:
+    """
+    Import modules at boot from their manifest entries (see utils.lazy).
+
+    Missing requirements of all of them, and the libraries they load with
+    import_library, are installed with a single pip call first. Modules that
+    don't register anything at import time are imported in parallel on a
+    thread pool, the others one by one. Modules calling import_library come
+    last, one at a time once the pool is done, so a pip run never overlaps
+    other imports. A failure only skips that module. Handlers are added in
+    path order once everything is imported. Returns import seconds per module
+    and errors per module.
+    """
+    missing = missing_requirements(
+        package for entry in modules.values() for package in entry["requires"]
+    )
+    missing += missing_libraries(
+        {
+            library: package
+            for entry in modules.values()
+            for library, package in entry["libraries"].items()
+        }
+    )
+    if missing:
+        logging.info("Installing requirements: %s", " ".join(missing))
+        if not await install_requirements(missing):
+            logging.warning("Failed to install requirements: %s", " ".join(missing))
+
+    names = {}
+    for file_path, entry in modules.items():
+        stem = os.path.splitext(os.path.basename(file_path))[0]
+        core = "custom_modules" not in file_path.split(os.sep)
+        names[file_path] = (stem, f"modules.{'' if core else 'custom_modules.'}{stem}")
+        requirements_list.extend(entry["requires"])
+
+    loop = asyncio.get_running_loop()
+    results = {}
+    with ThreadPoolExecutor(workers, thread_name_prefix="import") as pool:
+        parallel = {
+            file_path: loop.run_in_executor(pool, _timed_import, names[file_path][1])
+            for file_path, entry in modules.items()
+            if not entry["registers"] and not entry["installs"]
+        }
+        for file_path, entry in modules.items():
+            if entry["registers"] and not entry["installs"]:
+                try:
+                    results[file_path] = _timed_import(names[file_path][1])
+                except Exception as e:
+                    results[file_path] = e
+        for file_path, future in parallel.items():
+            try:
+                results[file_path] = await future
+            except Exception as e:
+                results[file_path] = e
+
+    for file_path, entry in modules.items():
+        if entry["installs"]:
+            try:
+                results[file_path] = _timed_import(names[file_path][1])
+            except Exception as e:
+                results[file_path] = e
+
+    timings, errors = {}, {}
+    for file_path, entry in modules.items():
+        stem = names[file_path][0]
+        result = results[file_path]
+        if isinstance(result, BaseException):
+            errors[stem] = result
+            logging.warning("Can't import module %s", stem, exc_info=result)
+            continue
+        module, timings[stem] = result
+        for handler, group in module_handlers(module):
+            client.add_handler(handler, group)
+        module.__meta__ = entry["meta"]
+        # lets utils.reload skip modules whose file didn't change
+        module.__source_hash__ = entry["hash"]
+    return timings, errors
+
+
 async def unload_module(module_name: str, client: Client) -> bool:
     path = "modules.custom_modules." + module_name
     if path not in sys.modules:
@@ -505,6 +828,8 @@ async def unload_module(module_name: str, client: Client) -> bool:
     for _name, obj in vars(module).items():
         for handler, group in getattr(obj, "handlers", []):
             client.remove_handler(handler, group)
+    db.events.unsubscribe_module(path)
+    pipeline.unregister_module(path)
 
     del modules_help[module_name]
     del sys.modules[path]
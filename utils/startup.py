@@ -0,0 +1,99 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+import psutil
+
+# boots kept in core.startup
+HISTORY = 10
+# slower than the median of previous boots by both of these is a regression
+REGRESSION_RATIO = 1.5
+REGRESSION_SECONDS = 0.5
+# set by utils.scripts.restart, exec keeps the pid and its creation time
+EXEC_TIME_ENV = "MOON_EXEC_TIME"
+
+
+def find_regressions(run: dict, history: list) -> list:
+    """[name, seconds, usual seconds] of what got much slower than usual"""
+    candidates = [("total", run["total"], [r["total"] for r in history])]
+    for key, prefix in (("phases", ""), ("modules", "module ")):
+        for name, seconds in run[key].items():
+            previous = [r[key][name] for r in history if name in r.get(key, {})]
+            candidates.append((prefix + name, seconds, previous))
+
+    regressions = []
+    for name, seconds, previous in candidates:
+        if not previous:
+            continue
+        usual = statistics.median(previous)
+        if (
+            seconds >= usual * REGRESSION_RATIO
+            and seconds - usual >= REGRESSION_SECONDS
+        ):
+            regressions.append([name, round(seconds, 3), round(usual, 3)])
+    return regressions
+
+
+class StartupProfile:
+    """
+    Wall time of the boot phases and of each module import.
+
+    Phases are recorded with `with startup.phase(name)` while the bot starts.
+    finish() saves the run to core.startup along with the previous ones and
+    compares it with them to find regressions.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        try:
+            launched = float(os.environ.pop(EXEC_TIME_ENV))
+        except (KeyError, ValueError):
+            launched = psutil.Process().create_time()
+        # interpreter start and imports done before this module
+        self.phases = {"interpreter": self.started - launched}
+        self.modules = {}
+        self.last = None
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0.0) + elapsed
+
+    def finish(self) -> dict:
+        from utils.db import db
+
+        run = {
+            "at": self.started,
+            "total": self.phases["interpreter"] + time.time() - self.started,
+            "phases": dict(self.phases),
+            "modules": dict(self.modules),
+        }
+        history = db.get("core.startup", "history", [])
+        run["regressions"] = find_regressions(run, history)
+        db.set("core.startup", "history", (history + [run])[-HISTORY:])
+        self.last = run
+        return run
+
+
+startup = StartupProfile()
@@ -0,0 +1,149 @@
+#  Moon-Userbot - telegram userbot
+#  Copyright (C) 2020-present Moon Userbot Organization
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from collections import deque
+from typing import Iterable, Optional, Tuple
+
+MATCH_EXACT = "exact"
+MATCH_CONTAINS = "contains"
+MATCH_WORD = "word"
+MATCH_MODES = (MATCH_EXACT, MATCH_CONTAINS, MATCH_WORD)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+class TriggerIndex:
+    """
+    Case-insensitive trigger matcher compiled once per set of triggers.
+    Exact triggers are a hash lookup, contains/word triggers are matched by an
+    Aho-Corasick automaton in a single pass over the text. Up to SCAN_LIMIT
+    of them are searched one by one with str.find instead, which runs in C
+    and is faster than walking the automaton in Python for small sets.
+    """
+
+    SCAN_LIMIT = 128
+
+    def __init__(self, triggers: Iterable[Tuple[str, str]]):
+        self._exact = set()
+        self._patterns = []
+        # automaton: goto transitions, failure links, depth and pattern ids
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._out = [()]
+
+        for trigger, mode in triggers:
+            trigger = trigger.lower()
+            if not trigger:
+                continue
+            if mode == MATCH_EXACT:
+                self._exact.add(trigger)
+            elif mode in (MATCH_CONTAINS, MATCH_WORD):
+                self._patterns.append((trigger, mode == MATCH_WORD))
+            else:
+                raise ValueError(f"Unknown trigger match mode: {mode}")
+
+        self._automaton = len(self._patterns) > self.SCAN_LIMIT
+        if self._automaton:
+            for pattern_id, (trigger, _) in enumerate(self._patterns):
+                self._add(trigger, pattern_id)
+            self._build()
+
+    def __bool__(self):
+        return bool(self._exact or self._patterns)
+
+    def _add(self, trigger: str, pattern_id: int):
+        state = 0
+        for char in trigger:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[state] + 1)
+                self._out.append(())
+            state = next_state
+        self._out[state] += (pattern_id,)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[next_state] = self._goto[fail].get(char, 0)
+                self._out[next_state] += self._out[self._fail[next_state]]
+
+    @staticmethod
+    def _is_word(text: str, start: int, end: int) -> bool:
+        return not (
+            (start and _is_word_char(text[start - 1]))
+            or (end < len(text) and _is_word_char(text[end]))
+        )
+
+    def _scan(self, text: str) -> Optional[str]:
+        best = None
+        best_start = len(text)
+        for trigger, word in self._patterns:
+            start = text.find(trigger, 0, best_start + len(trigger))
+            while start != -1 and word:
+                if self._is_word(text, start, start + len(trigger)):
+                    break
+                start = text.find(trigger, start + 1, best_start + len(trigger))
+            if start == -1 or (start == best_start and len(trigger) <= len(best)):
+                continue
+            best, best_start = trigger, start
+        return best
+
+    def match(self, text: str) -> Optional[str]:
+        """Return the matching trigger: exact first, then leftmost-longest"""
+        text = text.lower()
+        if text in self._exact:
+            return text
+        if not self._patterns:
+            return None
+        if not self._automaton:
+            return self._scan(text)
+
+        goto, fail, depth = self._goto, self._fail, self._depth
+        out, patterns = self._out, self._patterns
+        best = None
+        best_start = len(text)
+        state = 0
+        for end, char in enumerate(text, start=1):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for pattern_id in out[state]:
+                trigger, word = patterns[pattern_id]
+                start = end - len(trigger)
+                if start > best_start or (
+                    start == best_start and len(trigger) <= len(best)
+                ):
+                    continue
+                if word and not self._is_word(text, start, end):
+                    continue
+                best, best_start = trigger, start
+            if best is not None and depth[state] < end - best_start:
+                # no partial match starts at or before the best one any more
+                break
+        return best